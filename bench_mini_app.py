@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Стоимость разбора одного заказа из Mini App (mini_app.parse_order).
+
+Замеряет по отдельности разбор JSON (orjson и стандартный json), проверку
+по скомпилированной схеме и нормализацию, а также весь путь целиком на
+данных из test_data.json и на заказе с длинным описанием.
+Запуск: python bench_mini_app.py [количество повторов]
+"""
+
+import json
+import os
+import sys
+import time
+
+import mini_app
+from mini_app import normalize_order, parse_order, validate_order_details
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def per_call_us(func, arg, count: int) -> float:
+    """Среднее время одного вызова func(arg) в микросекундах"""
+    for _ in range(min(count, 1000)):  # прогрев
+        func(arg)
+    start = time.perf_counter()
+    for _ in range(count):
+        func(arg)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with open(os.path.join(BASE_DIR, 'test_data.json'), encoding='utf-8') as sample_file:
+        sample = sample_file.read().strip()
+    custom = json.dumps({
+        'product': 'custom',
+        'customDescription': 'Сумка-клатч из хрустальных бусин, как на фото, но с ручкой-цепочкой. ' * 20,
+        'user': {'id': 12345678, 'first_name': 'Test', 'username': 'testuser', 'language_code': 'ru'},
+        'contact': None,
+    }, ensure_ascii=False)
+
+    print(f"orjson: {'установлен' if mini_app.orjson is not None else 'не установлен'}, повторов: {count}")
+    for label, raw in (('test_data.json', sample), ('нестандартный заказ', custom)):
+        payload = json.loads(raw)
+        validated = validate_order_details(payload)
+        print(f"\n{label} ({len(raw.encode('utf-8'))} байт):")
+        if mini_app.orjson is not None:
+            print(f"  orjson.loads          {per_call_us(mini_app.orjson.loads, raw, count):7.2f} мкс")
+        print(f"  json.loads            {per_call_us(json.loads, raw, count):7.2f} мкс")
+        print(f"  проверка по схеме     {per_call_us(validate_order_details, payload, count):7.2f} мкс")
+        print(f"  нормализация          {per_call_us(normalize_order, validated, count):7.2f} мкс")
+        print(f"  parse_order целиком   {per_call_us(parse_order, raw, count):7.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
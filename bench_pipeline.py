@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конвейера заказов на локальной заглушке Bot API (fake_bot_api.py).
+
+Сценарии:
+  wizard   - синтетические покупатели проходят мастер заказа до отправки контакта
+  miniapp  - данные Mini App (по образцу test_data.json) приходят как web_app_data
+  admin    - /orders, листание страниц и /export при 1k/10k/100k заказов в базе
+  add      - Database.add_order без бота: последовательно и конкурентно
+
+Для каждого сценария выводятся количество операций, пропускная способность и
+задержки p50/p95/p99. По умолчанию лимиты частоты Telegram отключены, чтобы
+мерить сам бот; --telegram-limits включает их.
+
+Примеры:
+  python bench_pipeline.py
+  python bench_pipeline.py --sessions 500 --concurrency 100 --rows 1000,10000,100000
+  python bench_pipeline.py --json bench.json                 # сохранить результаты
+  python bench_pipeline.py --baseline bench.json --tolerance 0.25   # код 1 при регрессии
+"""
+
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+
+import doraborka
+from config import ADMIN_IDS, SELLER_CHAT_ID, ADMIN_GROUP_ID
+from database import Database
+from fake_bot_api import FakeBotAPI
+from orders import OrderDraft
+from outbound import OutboundRateLimiter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIRST_USER_ID = 1_000_000
+ADMIN_ID = int(ADMIN_IDS[0])
+
+WIZARD_ROUTES = [
+    ["Сумка", "M (влезает телефон и картхолдер)", "Круглая", "Акрил", "Белый", "Застёжка", "Завершить выбор"],
+    ["Сумка", "S (микросумка)", "Сердце", "Хрусталь", "Чёрный", "Подклад", "Ручка-цепочка", "Завершить выбор"],
+    ["Подстаканник", "Swarovski", "Синий", "Короткая ручка", "Завершить выбор"],
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(name: str, latencies: List[float], wall_time: float, operations: Optional[int] = None) -> Dict[str, Any]:
+    operations = len(latencies) if operations is None else operations
+    return {
+        'name': name,
+        'count': operations,
+        'seconds': round(wall_time, 4),
+        'ops_per_sec': round(operations / wall_time, 1) if wall_time else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def print_result(result: Dict[str, Any]):
+    print(f"{result['name']:<42} {result['count']:>7} {result['ops_per_sec']:>10.1f}/с "
+          f"p50 {result['p50_ms']:>8.2f} мс  p95 {result['p95_ms']:>8.2f} мс  p99 {result['p99_ms']:>8.2f} мс")
+
+
+class UpdateFactory:
+    """Собирает JSON обновлений Telegram от синтетических пользователей"""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def _next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, user_id: int, text: Optional[str] = None, **extra) -> Dict[str, Any]:
+        update_id = self._next_id()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f"user{user_id}"},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        message.update(extra)
+        return {'update_id': update_id, 'message': message}
+
+    def contact(self, user_id: int) -> Dict[str, Any]:
+        return self.message(user_id, contact={'phone_number': f"+7999{user_id % 10_000_000:07d}",
+                                              'first_name': 'Bench', 'user_id': user_id})
+
+    def web_app_data(self, user_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return self.message(user_id, web_app_data={'data': json.dumps(payload, ensure_ascii=False),
+                                                   'button_text': 'Оформить заказ'})
+
+    def callback(self, user_id: int, data: str) -> Dict[str, Any]:
+        update_id = self._next_id()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Admin'},
+                'chat_instance': 'bench',
+                'data': data,
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                            'text': 'Список заказов'},
+            },
+        }
+
+
+class PipelineBench:
+    def __init__(self, args):
+        self.args = args
+        self.updates = UpdateFactory()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'bench.db')
+        self.api = FakeBotAPI(latency=args.api_latency / 1000)
+        self.bot: Optional[doraborka.SumkiBot] = None
+        self.application = None
+
+    async def start(self):
+        await self.api.start()
+        doraborka.BOT_API_BASE_URL = self.api.base_url
+        doraborka.METRICS_PORT = 0
+        self.bot = doraborka.SumkiBot(self.db_path)
+        rate_limiter = None
+        if not self.args.telegram_limits:
+            unlimited = 1e9
+            rate_limiter = OutboundRateLimiter(seller_chat_ids=[SELLER_CHAT_ID, ADMIN_GROUP_ID], admin_chat_ids=ADMIN_IDS,
+                                               global_rate=unlimited,
+                                               chat_rate=unlimited, chat_burst=unlimited,
+                                               group_rate_per_minute=unlimited)
+        self.application = self.bot.build_application(rate_limiter=rate_limiter)
+        await self.application.initialize()
+        await self.application.post_init(self.application)
+
+    async def stop(self):
+        await self.application.shutdown()
+        await self.application.post_shutdown(self.application)
+        await self.api.stop()
+        self.tmp_dir.cleanup()
+
+    async def process(self, data: Dict[str, Any]) -> float:
+        start = time.perf_counter()
+        await self.application.process_update(Update.de_json(data, self.application.bot))
+        return time.perf_counter() - start
+
+    async def count_orders(self) -> int:
+        return await asyncio.to_thread(self._count_orders)
+
+    def _count_orders(self) -> int:
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    # --- Сценарии ---
+
+    async def bench_wizard(self) -> List[Dict[str, Any]]:
+        sessions, concurrency = self.args.sessions, self.args.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        message_latencies: List[float] = []
+        session_latencies: List[float] = []
+        orders_before = await self.count_orders()
+
+        async def session(number: int):
+            user_id = FIRST_USER_ID + number
+            route = WIZARD_ROUTES[number % len(WIZARD_ROUTES)]
+            async with semaphore:
+                started = time.perf_counter()
+                for text in ['/start', 'Оформить заказ'] + route:
+                    message_latencies.append(await self.process(self.updates.message(user_id, text)))
+                message_latencies.append(await self.process(self.updates.contact(user_id)))
+                session_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(session(number) for number in range(sessions)))
+        wall_time = time.perf_counter() - started
+
+        created = await self.count_orders() - orders_before
+        if created != sessions:
+            print(f"ВНИМАНИЕ: мастер создал {created} заказов из {sessions}", file=sys.stderr)
+        return [
+            summarize(f"wizard: заказ целиком (x{concurrency})", session_latencies, wall_time, created),
+            summarize("wizard: одно сообщение", message_latencies, wall_time),
+        ]
+
+    async def bench_miniapp(self) -> List[Dict[str, Any]]:
+        with open(os.path.join(BASE_DIR, 'test_data.json'), encoding='utf-8') as sample_file:
+            sample = json.load(sample_file)
+        sizes, colors = ['S', 'M', 'L'], ['розовый', 'белый', 'чёрный', 'синий']
+        count, concurrency = self.args.sessions, self.args.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        orders_before = await self.count_orders()
+
+        async def submit(number: int):
+            user_id = FIRST_USER_ID + 500_000 + number
+            payload = copy.deepcopy(sample)
+            payload['size'] = sizes[number % len(sizes)]
+            payload['color'] = colors[number % len(colors)]
+            payload['contact']['id'] = user_id
+            async with semaphore:
+                latencies.append(await self.process(self.updates.web_app_data(user_id, payload)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(number) for number in range(count)))
+        wall_time = time.perf_counter() - started
+        created = await self.count_orders() - orders_before
+        return [summarize(f"miniapp: web_app_data (заказов: {created})", latencies, wall_time)]
+
+    def _seed_orders(self, target: int):
+        """Доводит число заказов в базе до target одной транзакцией (в обход бота)"""
+        statuses = ['new', 'new', 'in_progress', 'done', 'cancelled']
+        products = ['Сумка', 'Подстаканник', 'Нестандартный заказ']
+        with sqlite3.connect(self.db_path) as conn:
+            existing = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+            start_date = datetime.datetime(2023, 1, 1)
+            rows = []
+            for number in range(existing, target):
+                rows.append((
+                    FIRST_USER_ID + number % 5000, f"user{number % 5000}",
+                    (start_date + datetime.timedelta(minutes=number)).strftime('%Y-%m-%d %H:%M:%S'),
+                    products[number % len(products)], 'M', 'Круглая', 'Акрил', 'Белый',
+                    json.dumps(['Застёжка'], ensure_ascii=False), '', '[]', '+79990000000',
+                    statuses[number % len(statuses)], '', 0,
+                ))
+            conn.executemany(
+                "INSERT INTO orders (user_id, username, order_date, product_type, size, shape, material, color, "
+                "options, custom_description, custom_photos, contact, status, notes, total_price) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    async def bench_admin(self) -> List[Dict[str, Any]]:
+        results = []
+        repeats = self.args.admin_repeats
+        for rows in self.args.rows:
+            await asyncio.to_thread(self._seed_orders, rows)
+            with sqlite3.connect(self.db_path) as conn:
+                middle_id = conn.execute("SELECT id FROM orders ORDER BY id LIMIT 1 OFFSET ?", (rows // 2,)).fetchone()[0]
+
+            scenarios = {
+                '/orders': lambda: self.updates.message(ADMIN_ID, '/orders'),
+                '/orders new': lambda: self.updates.message(ADMIN_ID, '/orders new'),
+                'страница из середины': lambda: self.updates.callback(ADMIN_ID, f"orders:n:{middle_id}:"),
+                'страница из середины, done': lambda: self.updates.callback(ADMIN_ID, f"orders:n:{middle_id}:done"),
+            }
+            for label, make_update in scenarios.items():
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(repeats):
+                    latencies.append(await self.process(make_update()))
+                results.append(summarize(f"admin {rows // 1000}k: {label}", latencies, time.perf_counter() - started))
+
+            for label, command in (('/export csv', '/export'), ('/export jsonl', '/export jsonl')):
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(self.args.export_repeats):
+                    latencies.append(await self.process(self.updates.message(ADMIN_ID, command)))
+                results.append(summarize(f"admin {rows // 1000}k: {label}", latencies, time.perf_counter() - started))
+        return results
+
+    async def bench_add_order(self) -> List[Dict[str, Any]]:
+        count = self.args.add_orders
+        results = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = Database(os.path.join(tmp_dir, 'add.db'))
+            await db.initialize()
+            try:
+                draft = OrderDraft(product='Сумка', size='M', shape='Круглая', material='Акрил', color='Белый',
+                                   options=['Застёжка'], contact='+79990000000')
+                latencies = []
+                started = time.perf_counter()
+                for number in range(count):
+                    call_started = time.perf_counter()
+                    await db.add_order(FIRST_USER_ID + number, 'bench', draft)
+                    latencies.append(time.perf_counter() - call_started)
+                results.append(summarize("add_order: последовательно", latencies, time.perf_counter() - started))
+
+                latencies = []
+
+                async def add(number: int):
+                    call_started = time.perf_counter()
+                    await db.add_order(FIRST_USER_ID + number, 'bench', draft)
+                    latencies.append(time.perf_counter() - call_started)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(add(number) for number in range(count)))
+                results.append(summarize(f"add_order: {count} одновременно", latencies, time.perf_counter() - started))
+            finally:
+                await db.close()
+        return results
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> bool:
+    """Сравнивает p95 и пропускную способность с сохраненными результатами; True, если регрессий нет"""
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+    ok = True
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        if previous['p95_ms'] and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            print(f"РЕГРЕССИЯ {result['name']}: p95 {previous['p95_ms']} -> {result['p95_ms']} мс")
+            ok = False
+        if previous['ops_per_sec'] and result['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+            print(f"РЕГРЕССИЯ {result['name']}: {previous['ops_per_sec']} -> {result['ops_per_sec']} оп/с")
+            ok = False
+    return ok
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    results = []
+    scenarios = args.only.split(',')
+    if 'add' in scenarios:
+        for result in await PipelineBench(args).bench_add_order():
+            print_result(result)
+            results.append(result)
+
+    bench = PipelineBench(args)
+    await bench.start()
+    try:
+        for name, scenario in (('wizard', bench.bench_wizard), ('miniapp', bench.bench_miniapp),
+                               ('admin', bench.bench_admin)):
+            if name in scenarios:
+                for result in await scenario():
+                    print_result(result)
+                    results.append(result)
+    finally:
+        await bench.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера заказов на заглушке Bot API")
+    parser.add_argument('--only', default='add,wizard,miniapp,admin', help="сценарии через запятую")
+    parser.add_argument('--sessions', type=int, default=200, help="покупателей в сценариях wizard и miniapp")
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременных покупателей")
+    parser.add_argument('--rows', default='1000,10000,100000', help="размеры таблицы заказов для сценария admin")
+    parser.add_argument('--admin-repeats', type=int, default=50, help="повторов каждой команды администратора")
+    parser.add_argument('--export-repeats', type=int, default=3, help="повторов /export в сценарии admin")
+    parser.add_argument('--add-orders', type=int, default=2000, help="вызовов add_order в сценарии add")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа заглушки Bot API, мс")
+    parser.add_argument('--telegram-limits', action='store_true', help="включить лимиты частоты Telegram")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--baseline', help="сравнить с сохраненными результатами")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение (доля)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="выводить логи бота")
+    args = parser.parse_args()
+    args.rows = sorted(int(rows) for rows in args.rows.split(',') if rows)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    random.seed(0)
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      output, ensure_ascii=False, indent=2)
+    if args.baseline and not compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Замер памяти на одну сессию мастера заказа и на один заказ в списке.
+
+Сравнивает черновик заказа в виде словаря (как раньше хранилось в
+context.user_data) с OrderDraft, а строку заказа в виде словаря с
+декодированными options - с OrderRecord (JSON декодируется лениво).
+Запуск: python bench_sessions.py [количество объектов]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from orders import OrderDraft, OrderRecord
+
+SAMPLE_DRAFT = {
+    'product': 'Сумка',
+    'size': 'M (влезает телефон и картхолдер)',
+    'shape': 'Круглая',
+    'material': 'Акрил',
+    'color': 'Белый',
+    'options': ['Застёжка', 'Подклад'],
+    'contact': '+79990000000',
+}
+
+SAMPLE_ROW = {
+    'user_id': 12345, 'username': 'testuser', 'order_date': '2024-01-01 12:00:00',
+    'product_type': 'Сумка', 'size': 'M', 'shape': 'Круглая', 'material': 'Акрил',
+    'color': 'Белый', 'options': json.dumps(['Застёжка', 'Подклад'], ensure_ascii=False),
+    'custom_description': None, 'contact': '+79990000000', 'status': 'new', 'notes': None,
+}
+
+
+def measure(label: str, factory, count: int) -> float:
+    """Создает count объектов и возвращает прирост памяти на объект в байтах"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = [factory(i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_object = size / count
+    print(f"{label:<40} {per_object:8.0f} байт/объект  {elapsed * 1e6 / count:6.2f} мкс/объект")
+    del objects
+    return per_object
+
+
+def draft_as_dict(i: int) -> dict:
+    data = dict(SAMPLE_DRAFT)
+    data['options'] = list(SAMPLE_DRAFT['options'])
+    return {'stage': 'choose_options', 'history': ['choose_product', 'choose_size'], **data}
+
+
+def draft_as_slots(i: int) -> dict:
+    draft = OrderDraft(**SAMPLE_DRAFT)
+    draft.options = list(SAMPLE_DRAFT['options'])
+    return {'stage': 'choose_options', 'history': ['choose_product', 'choose_size'], 'draft': draft}
+
+
+def row_as_dict(i: int) -> dict:
+    row = dict(SAMPLE_ROW, id=i)
+    row['options'] = json.loads(row['options'])
+    return row
+
+
+def row_as_record(i: int) -> OrderRecord:
+    return OrderRecord(id=i, **SAMPLE_ROW)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"Объектов: {count}")
+    dict_session = measure("Сессия: черновик в словаре user_data", draft_as_dict, count)
+    slots_session = measure("Сессия: OrderDraft", draft_as_slots, count)
+    dict_row = measure("Заказ: словарь с json.loads(options)", row_as_dict, count)
+    record_row = measure("Заказ: OrderRecord (ленивый JSON)", row_as_record, count)
+    print(f"Экономия на сессию: {dict_session - slots_session:.0f} байт, на заказ: {dict_row - record_row:.0f} байт")
+
+
+if __name__ == "__main__":
+    main()
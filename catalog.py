@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from typing import Dict, List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен - фото отправляются как есть
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Корень проекта: все пути каталога считаются относительно него
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Папки с фотографиями каталога
+CATALOG_DIRS = ('bag_shapes', 'material_type', 'product_type', 'images')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Telegram все равно сжимает фото до 1280px по большей стороне
+MAX_SIDE = 1280
+JPEG_QUALITY = 85
+
+# Фото форм сумок: подпись -> ключ каталога
+SHAPE_PHOTOS = {
+    "Круглая": "bag_shapes/krug.jpeg",
+    "Прямоугольная": "bag_shapes/pramougolnaya.jpeg",
+    "Трапеция": "bag_shapes/trapeciya.jpeg",
+    "Квадратная": "bag_shapes/kvadrat.jpeg",
+    "Месяц": "bag_shapes/mesyac.jpeg",
+    "Сердце": "bag_shapes/serdce.jpeg",
+}
+
+# Фото материалов бусин: название -> ключ каталога
+MATERIAL_PHOTOS = {
+    "Акрил": "material_type/akril.JPEG",
+    "Хрусталь": "material_type/hrustal.JPEG",
+    "Swarovski": "material_type/swarovski.JPEG",
+}
+
+
+class CatalogImage:
+    """Подготовленное фото каталога, полностью загруженное в память."""
+
+    __slots__ = ('key', 'content_hash', 'data')
+
+    def __init__(self, key: str, content_hash: str, data: bytes):
+        self.key = key
+        self.content_hash = content_hash
+        self.data = data
+
+
+def _compress(source: bytes) -> bytes:
+    """Уменьшает фото до MAX_SIDE и пережимает в JPEG."""
+    with Image.open(io.BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((MAX_SIDE, MAX_SIDE))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+class AssetCatalog:
+    """Каталог фотографий для шагов мастера заказа.
+
+    При старте находит фото в CATALOG_DIRS, один раз готовит сжатые варианты
+    (кэшируются на диске по хэшу исходника) и держит их в памяти, чтобы
+    обработчики не читали файлы с диска.
+    """
+
+    def __init__(self, base_dir: str = BASE_DIR, cache_dir: Optional[str] = None):
+        self.base_dir = base_dir
+        self.cache_dir = cache_dir or os.path.join(base_dir, '.catalog_cache')
+        self._images: Dict[str, CatalogImage] = {}
+
+    def _discover(self) -> List[str]:
+        keys = []
+        for directory in CATALOG_DIRS:
+            full_dir = os.path.join(self.base_dir, directory)
+            if not os.path.isdir(full_dir):
+                logger.warning(f"Папка каталога не найдена: {full_dir}")
+                continue
+            for name in sorted(os.listdir(full_dir)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    keys.append(f"{directory}/{name}")
+        return keys
+
+    def _prepare(self, key: str) -> CatalogImage:
+        with open(os.path.join(self.base_dir, key), 'rb') as source_file:
+            source = source_file.read()
+        source_hash = hashlib.sha256(source).hexdigest()
+
+        data = source
+        if Image is not None:
+            cached_path = os.path.join(self.cache_dir, f"{source_hash}.jpg")
+            if os.path.exists(cached_path):
+                with open(cached_path, 'rb') as cached_file:
+                    data = cached_file.read()
+            else:
+                try:
+                    data = _compress(source)
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    tmp_path = f"{cached_path}.tmp"
+                    with open(tmp_path, 'wb') as cached_file:
+                        cached_file.write(data)
+                    os.replace(tmp_path, cached_path)
+                except Exception as e:
+                    logger.error(f"Не удалось сжать фото {key}, используется оригинал: {e}")
+                    data = source
+            # Сжатие может оказаться хуже оригинала для маленьких файлов
+            if len(data) > len(source):
+                data = source
+
+        return CatalogImage(key, hashlib.sha256(data).hexdigest(), data)
+
+    def load(self):
+        """Синхронно загружает каталог (вызывается в отдельном потоке через preload)."""
+        if Image is None:
+            logger.warning("Pillow не установлен: фото каталога отправляются без сжатия")
+        images = {}
+        for key in self._discover():
+            try:
+                images[key] = self._prepare(key)
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке фото каталога {key}: {e}")
+        self._images = images
+        total_size = sum(len(image.data) for image in images.values())
+        logger.info(f"Каталог загружен: {len(images)} фото, {total_size // 1024} КБ в памяти")
+
+    async def preload(self):
+        """Загружает каталог, не блокируя цикл событий."""
+        await asyncio.to_thread(self.load)
+
+    def get(self, key: str) -> Optional[CatalogImage]:
+        """Возвращает фото по ключу вида 'bag_shapes/krug.jpeg' или None."""
+        image = self._images.get(key)
+        if image is None:
+            logger.error(f"Фото не найдено в каталоге: {key}")
+        return image
@@ -1,3 +1,5 @@
+import hashlib
+import importlib.util
 import os
 from dotenv import load_dotenv
 
@@ -12,15 +14,63 @@ BOT_TOKEN = os.getenv('TELEGRAM_TOKEN', '7408506728:AAGK9d5kddSnMQDwgIYOiEK-6nPF
 admin_id_env = os.getenv('ADMIN_ID', '50122963')
 # Разделяем по запятой, если это список, и обеспечиваем, что все элементы - строки
 ADMIN_IDS = [str(id_val.strip()) for id_val in admin_id_env.split(',')]
-print(f"ADMIN_IDS настроены: {ADMIN_IDS}")
 
 # ID чата продавца (для отправки заказов)
 SELLER_CHAT_ID = os.getenv('SELLER_CHAT_ID', '50122963')
-print(f"SELLER_CHAT_ID настроен: {SELLER_CHAT_ID}")
 
 # Группа администраторов для отправки сообщений
 ADMIN_GROUP_ID = os.getenv('ADMIN_GROUP_ID', SELLER_CHAT_ID)
-print(f"ADMIN_GROUP_ID настроен: {ADMIN_GROUP_ID}")
+
+# Режим получения обновлений: 'polling' или 'webhook'
+RUN_MODE = os.getenv('RUN_MODE', 'polling').lower()
+# 1 - при запуске отбросить обновления, накопившиеся в Telegram, пока бот был остановлен
+# (по умолчанию они обрабатываются, и сообщения покупателей не теряются при перезапуске)
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '0').lower() in ('1', 'true', 'yes')
+
+# Публичный адрес, на который Telegram шлет вебхуки (например, https://bot.example.com)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Адрес и порт встроенного HTTP-сервера (обычно за обратным прокси)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+# Сколько одновременных HTTPS-соединений Telegram может открыть к вебхуку
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Адрес Bot API (пусто - api.telegram.org); используется для локального сервера и тестов
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '').rstrip('/')
+
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя - всегда по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '16'))
+# Сколько обновлений может ждать своей очереди внутри приложения
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '1000'))
+
+# Путь к файлу базы данных SQLite
+DB_PATH = os.getenv('DB_PATH', 'bot.db')
+
+# Количество соединений только для чтения (писатель всегда один)
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '2'))
+
+# Групповая фиксация заказов: вставки копятся не дольше DB_BATCH_MAX_DELAY_MS миллисекунд
+# или до DB_BATCH_MAX_ROWS штук и записываются одной транзакцией
+DB_BATCH_MAX_ROWS = int(os.getenv('DB_BATCH_MAX_ROWS', '100'))
+DB_BATCH_MAX_DELAY_MS = float(os.getenv('DB_BATCH_MAX_DELAY_MS', '5'))
+# 1 - каждый заказ фиксируется отдельной транзакцией с fsync (PRAGMA synchronous=FULL)
+DB_SYNCHRONOUS_COMMIT = os.getenv('DB_SYNCHRONOUS_COMMIT', '0').lower() in ('1', 'true', 'yes')
+
+# Защита от повторного создания заказа: одинаковый заказ из Mini App в пределах окна (секунды)
+# считается повтором (окно скользящее: текущий и предыдущий интервал по ORDER_DEDUP_WINDOW), заказ из мастера -
+# по сообщению с контактом; ключи последних заказов держатся в памяти, чтобы не ходить в базу
+ORDER_DEDUP_WINDOW = float(os.getenv('ORDER_DEDUP_WINDOW', '600'))
+ORDER_DEDUP_CACHE_SIZE = int(os.getenv('ORDER_DEDUP_CACHE_SIZE', '10000'))
+
+# Как часто (в секундах) изменения сессий пользователей пачкой сохраняются в базу
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '5'))
+# Через сколько секунд бездействия сессия считается брошенной и удаляется (по умолчанию 7 дней)
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))
+# Как часто проверять брошенные сессии
+SESSION_EVICT_INTERVAL = float(os.getenv('SESSION_EVICT_INTERVAL', '3600'))
 
 # Максимальный размер фото в байтах (5MB)
 MAX_PHOTO_SIZE = 5 * 1024 * 1024
@@ -28,6 +78,22 @@ MAX_PHOTO_SIZE = 5 * 1024 * 1024
 # Максимальное количество фото на заказ
 MAX_PHOTOS_PER_ORDER = 5
 
+# Максимальная длина подписи к фото в Telegram
+MAX_CAPTION_LENGTH = 1024
+
+# Количество заказов на одной странице /orders
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '5'))
+
+# Заполнение индекса поиска /find для заказов, созданных до его появления: размер пачки и пауза между пачками
+SEARCH_BACKFILL_BATCH = int(os.getenv('SEARCH_BACKFILL_BATCH', '500'))
+SEARCH_BACKFILL_PAUSE_MS = float(os.getenv('SEARCH_BACKFILL_PAUSE_MS', '50'))
+
+# Статусы, для которых в /orders показываются кнопки фильтра
+ORDER_STATUS_FILTERS = ['new', 'in_progress', 'done', 'cancelled']
+
+# Максимальный размер файла, который бот может отправить в Telegram (50MB)
+EXPORT_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
 # Таймауты для API Telegram
 TIMEOUTS = {
     'read': 30,
@@ -36,6 +102,45 @@ TIMEOUTS = {
     'pool': 30
 }
 
+# Пул HTTP-соединений общего бота: соединения переиспользуются (keep-alive) между запросами
+BOT_CONNECTION_POOL_SIZE = int(os.getenv('BOT_CONNECTION_POOL_SIZE', '32'))
+# HTTP/2, если установлен пакет h2 (pip install "httpx[http2]"), иначе HTTP/1.1
+BOT_HTTP_VERSION = '2' if importlib.util.find_spec('h2') else '1.1'
+
+# Повторные попытки отправки при сетевых ошибках: экспоненциальная задержка с джиттером
+# (RetryAfter повторяет только очередь исходящих сообщений, см. OUTBOUND_MAX_RETRIES)
+SEND_RETRIES = int(os.getenv('SEND_RETRIES', '5'))
+SEND_RETRY_BASE_DELAY = float(os.getenv('SEND_RETRY_BASE_DELAY', '0.5'))
+SEND_RETRY_MAX_DELAY = float(os.getenv('SEND_RETRY_MAX_DELAY', '30'))
+
+# Очередь исходящих сообщений (ограничения Telegram на частоту отправки)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))                    # сообщений в секунду на бота
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))                         # сообщений в секунду в личный чат
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', '3'))                       # допустимый всплеск в личный чат
+OUTBOUND_GROUP_RATE_PER_MINUTE = float(os.getenv('OUTBOUND_GROUP_RATE_PER_MINUTE', '20'))  # сообщений в минуту в группу
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '8'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))                       # повторов после RetryAfter
+
+# Логирование: запись в файл в фоновом потоке, ротация по размеру
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()                        # 'json' (JSON Lines) или 'text'
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+# Уровни отдельных модулей; httpx по умолчанию пишет строку на каждый запрос к Bot API
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'httpx=WARNING')
+
+# Локальный HTTP-сервер с метриками в формате Prometheus (порт 0 - отключить)
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+# Проверка текстов покупателей на нецензурную лексику
+MODERATION_WORDLIST_RU = os.getenv('MODERATION_WORDLIST_RU', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profanity_ru.txt'))
+MODERATION_INLINE_LIMIT = int(os.getenv('MODERATION_INLINE_LIMIT', '500'))   # более длинные тексты проверяются в пуле
+MODERATION_POOL = os.getenv('MODERATION_POOL', 'thread').lower()             # 'thread' или 'process'
+MODERATION_WORKERS = int(os.getenv('MODERATION_WORKERS', '2'))
+MODERATION_CACHE_SIZE = int(os.getenv('MODERATION_CACHE_SIZE', '1024'))      # сколько вердиктов помнить
+
 # Сообщения бота
 MESSAGES = {
     'welcome': 'Добро пожаловать в VaMi Bags - магазин изделий из бусин! Для оформления заказа нажмите кнопку одну из кнопок ниже.',
@@ -46,6 +151,8 @@ MESSAGES = {
     'contact_received': 'Спасибо! Ваш заказ успешно отправлен. Мы свяжемся с вами в ближайшее время.',
     'error_photo_size': 'Фото слишком большое. Максимальный размер - 5MB.',
     'error_photo_count': 'Достигнуто максимальное количество фото (5).',
-    'admin_help': 'Команды администратора:\n/orders - список всех заказов\n/status <id> <статус> - изменить статус заказа\n/note <id> <текст> - добавить заметку к заказу',
+    'admin_help': 'Команды администратора:\n/orders [статус] - список заказов постранично\n/status <id> <статус> - изменить статус заказа\n/note <id> <текст> - добавить заметку к заказу\n/export [с] [по] [статус] [csv|jsonl] - выгрузить заказы файлом\n/find <запрос> - поиск по описанию, контакту, имени и заметкам\n/stats [дней | all | с [по]] [статус] [изделие] - сводка заказов и выручки (например, /stats 7 new bag)\n/stats_rebuild - пересчитать сводку заказов\n/metrics - задержки и счетчики работы бота',
+    'order_already_sent': 'Этот заказ уже принят, повторно отправлять его не нужно. Чтобы оформить новый заказ, нажмите "Оформить заказ".',
+    'webapp_invalid': 'Не удалось прочитать заказ из приложения. Пожалуйста, попробуйте еще раз или оформите заказ через кнопку "Оформить заказ".',
     'access_denied': 'Доступ запрещен. Вы не являетесь администратором.'
 } 
\ No newline at end of file
@@ -1,11 +1,21 @@
 import aiosqlite
+import asyncio
+import collections
+import contextlib
+import functools
 import json
 import os
+import re
 import datetime
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Union, AsyncIterator, Tuple
 import logging
 import time
 
+from metrics import instrument_methods, metrics
+from orders import OrderDraft, OrderRecord
+
+logger = logging.getLogger(__name__)
+
 # Словарь для преобразования формы сумки (глобальный для удобства)
 shape_mapping = {
     'kruglaya': 'Круглая',
@@ -38,21 +48,337 @@ product_mapping = {
     'custom': 'Индивидуальный заказ'
 }
 
+# PRAGMA, которые выполняются один раз при открытии каждого соединения
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',     # читатели не блокируют писателя
+    'PRAGMA synchronous=NORMAL',   # в режиме WAL безопасно и без fsync на каждый коммит
+    'PRAGMA busy_timeout=5000',    # ждем блокировку до 5 секунд вместо мгновенной ошибки
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',     # ~8MB кэша страниц на соединение
+    'PRAGMA foreign_keys=ON',
+)
+
+# Строка старого поля orders.notes: "[YYYY-MM-DD HH:MM] текст"
+_LEGACY_NOTE_RE = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2})\] ?(.*)$')
+
+
+async def _migrate_legacy_notes(conn: aiosqlite.Connection):
+    """Переносит заметки из текстового поля orders.notes в таблицу order_notes.
+
+    Строки без метки времени считаются продолжением предыдущей заметки.
+    """
+    async with conn.execute("SELECT id, order_date, notes FROM orders WHERE notes IS NOT NULL AND notes != ''") as cursor:
+        rows = await cursor.fetchall()
+    notes = []
+    for order_id, order_date, blob in rows:
+        order_notes = []
+        for line in blob.splitlines():
+            match = _LEGACY_NOTE_RE.match(line)
+            if match:
+                order_notes.append([order_id, f"{match.group(1)}:00", None, match.group(2)])
+            elif order_notes:
+                order_notes[-1][3] += f"\n{line}"
+            elif line.strip():
+                order_notes.append([order_id, order_date, None, line])
+        notes.extend(order_notes)
+    await conn.executemany("INSERT INTO order_notes (order_id, ts, author, text) VALUES (?, ?, ?, ?)", notes)
+    await conn.execute("UPDATE orders SET notes = '' WHERE notes IS NOT NULL AND notes != ''")
+    logger.info(f"DB: Перенесено {len(notes)} заметок из {len(rows)} заказов в order_notes")
+
+
+# Ключ строки сводки order_stats для строки заказа (NEW или OLD в триггере); NULL превращается в '',
+# иначе строки с пустым статусом или материалом не совпадали бы по первичному ключу
+_STATS_KEY = ("date({row}.order_date), COALESCE({row}.status, ''), "
+              "COALESCE({row}.product_type, ''), COALESCE({row}.material, '')")
+_STATS_ADD = (
+    f"INSERT INTO order_stats (day, status, product_type, material, orders, revenue) "
+    f"VALUES ({_STATS_KEY}, 1, COALESCE({{row}}.total_price, 0)) "
+    f"ON CONFLICT(day, status, product_type, material) "
+    f"DO UPDATE SET orders = orders + 1, revenue = revenue + excluded.revenue;"
+)
+_STATS_SUBTRACT = (
+    f"UPDATE order_stats SET orders = orders - 1, revenue = revenue - COALESCE({{row}}.total_price, 0) "
+    f"WHERE (day, status, product_type, material) = ({_STATS_KEY});"
+    f"DELETE FROM order_stats WHERE orders <= 0 AND (day, status, product_type, material) = ({_STATS_KEY});"
+)
+# Пересчет сводки с нуля по всей таблице orders
+ORDER_STATS_REBUILD_SELECT = (
+    "SELECT date(order_date), COALESCE(status, ''), COALESCE(product_type, ''), COALESCE(material, ''), "
+    "COUNT(*), COALESCE(SUM(total_price), 0) FROM orders GROUP BY 1, 2, 3, 4"
+)
+
+# Контакт-телефон одними цифрами, чтобы /find находил его по фрагменту номера в любой записи
+_SEARCH_PHONE = ("replace(replace(replace(replace(replace(replace({row}.contact, ' ', ''), '-', ''), "
+                 "'(', ''), ')', ''), '+', ''), '.', '')")
+_SEARCH_DIGITS = (f"CASE WHEN {_SEARCH_PHONE} GLOB '[0-9]*' AND NOT {_SEARCH_PHONE} GLOB '*[^0-9]*' "
+                  f"THEN {_SEARCH_PHONE} ELSE '' END")
+# Заметки заказа одним текстом: "автор текст" или просто "текст", если автора нет
+_SEARCH_NOTES = ("(SELECT COALESCE(group_concat("
+                 "CASE WHEN author IS NULL OR author = '' THEN text ELSE author || ' ' || text END, char(10)), '') "
+                 "FROM order_notes WHERE order_id = {order_id})")
+
+
+# Миграции схемы: (версия, список SQL или корутинных функций от соединения). Текущая версия хранится в PRAGMA user_version,
+# поэтому существующие файлы bot.db догоняются автоматически при initialize().
+SCHEMA_MIGRATIONS = [
+    (1, [
+        # Индексы под фильтры постраничной выборки; id в конце - для keyset-пагинации
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_id_id ON orders(user_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_product_type_id ON orders(product_type, id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders(order_date)',
+    ]),
+    (2, [
+        # Кэш file_id Telegram для фото каталога: путь + хэш содержимого -> file_id
+        '''CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )''',
+    ]),
+    (3, [
+        # Сессии мастера заказа (context.user_data), переживают перезапуск бота
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)',
+    ]),
+    (4, [
+        # Заметки к заказам: одна строка на заметку вместо перезаписи растущего текста в orders.notes
+        '''CREATE TABLE IF NOT EXISTS order_notes (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+            ts TEXT NOT NULL,
+            author TEXT,
+            text TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_order_notes_order_id_id ON order_notes(order_id, id)',
+        _migrate_legacy_notes,
+    ]),
+    (5, [
+        # Ключ идемпотентности: повтор того же заказа не создает вторую строку (NULL не конфликтуют)
+        'ALTER TABLE orders ADD COLUMN idempotency_key TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders(idempotency_key)',
+    ]),
+    (6, [
+        # Сводка заказов по дням: количество и выручка по статусу, типу и материалу.
+        # Поддерживается триггерами при любом изменении orders, поэтому /stats не читает саму таблицу заказов
+        '''CREATE TABLE IF NOT EXISTS order_stats (
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            product_type TEXT NOT NULL,
+            material TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, status, product_type, material)
+        ) WITHOUT ROWID''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_order_stats_insert AFTER INSERT ON orders BEGIN
+            {_STATS_ADD.format(row='NEW')}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_order_stats_update
+        AFTER UPDATE OF order_date, status, product_type, material, total_price ON orders BEGIN
+            {_STATS_SUBTRACT.format(row='OLD')}
+            {_STATS_ADD.format(row='NEW')}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_order_stats_delete AFTER DELETE ON orders BEGIN
+            {_STATS_SUBTRACT.format(row='OLD')}
+        END''',
+        f"INSERT INTO order_stats {ORDER_STATS_REBUILD_SELECT}",
+    ]),
+    (7, [
+        # Полнотекстовый поиск /find: rowid = id заказа, триграммы - поиск любой подстроки без учета регистра
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS orders_search USING fts5(
+            username, contact, contact_digits, custom_description, notes, tokenize='trigram'
+        )''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_orders_search_insert AFTER INSERT ON orders BEGIN
+            INSERT INTO orders_search (rowid, username, contact, contact_digits, custom_description, notes)
+            VALUES (NEW.id, NEW.username, NEW.contact, {_SEARCH_DIGITS.format(row='NEW')}, NEW.custom_description, '');
+        END''',
+        # Строки, до которых еще не дошло заполнение индекса, здесь не меняются - их возьмет backfill
+        f'''CREATE TRIGGER IF NOT EXISTS trg_orders_search_update
+        AFTER UPDATE OF username, contact, custom_description ON orders BEGIN
+            UPDATE orders_search SET username = NEW.username, contact = NEW.contact,
+                contact_digits = {_SEARCH_DIGITS.format(row='NEW')}, custom_description = NEW.custom_description
+            WHERE rowid = NEW.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_orders_search_delete AFTER DELETE ON orders BEGIN
+            DELETE FROM orders_search WHERE rowid = OLD.id;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_orders_search_note_insert AFTER INSERT ON order_notes BEGIN
+            UPDATE orders_search SET notes = {_SEARCH_NOTES.format(order_id='NEW.order_id')} WHERE rowid = NEW.order_id;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_orders_search_note_delete AFTER DELETE ON order_notes BEGIN
+            UPDATE orders_search SET notes = {_SEARCH_NOTES.format(order_id='OLD.order_id')} WHERE rowid = OLD.order_id;
+        END''',
+        # Существующие заказы индексируются постепенно (Database.backfill_search_index), а не внутри миграции,
+        # чтобы запуск бота на большой базе не держал блокировку записи. Новые заказы получают id > last_id
+        '''CREATE TABLE IF NOT EXISTS search_backfill (
+            next_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        )''',
+        'INSERT INTO search_backfill (next_id, last_id) SELECT MIN(id), MAX(id) FROM orders HAVING COUNT(*) > 0',
+    ]),
+]
+
+# Сколько последних заметок подставляется в заказ при чтении
+LATEST_NOTES_LIMIT = 3
+# Сколько заказов берется в один запрос последних заметок (ограничение SQLite на UNION ALL - 500)
+NOTES_QUERY_CHUNK = 100
+
+# Поиск /find: веса bm25 по столбцам orders_search и длина фрагмента с совпадением (в триграммах)
+SEARCH_COLUMN_WEIGHTS = '3.0, 3.0, 3.0, 1.0, 1.0'
+SEARCH_SNIPPET_TOKENS = 40
+
+# Поля, которые возвращает постраничная выборка (без тяжелых custom_photos)
+ORDER_PAGE_FIELDS = (
+    'id, user_id, username, order_date, product_type, size, shape, material, color, '
+    'options, custom_description, status, contact, total_price'
+)
+
+ORDER_INSERT_FIELDS = (
+    'user_id', 'username', 'order_date', 'product_type', 'size', 'shape', 'material', 'color',
+    'options', 'custom_description', 'custom_photos', 'contact', 'status', 'notes', 'total_price',
+    'idempotency_key',
+)
+# Повтор по ключу идемпотентности ничего не вставляет (rowcount = 0)
+INSERT_ORDER_SQL = (
+    f"INSERT INTO orders ({', '.join(ORDER_INSERT_FIELDS)}) "
+    f"VALUES ({', '.join(':' + field for field in ORDER_INSERT_FIELDS)}) "
+    f"ON CONFLICT(idempotency_key) DO NOTHING"
+)
+
+class DuplicateOrderError(Exception):
+    """Заказ с таким ключом идемпотентности уже создан (order_id - его ID или None, если он еще записывается)"""
+
+    def __init__(self, idempotency_key: str, order_id: Optional[int]):
+        super().__init__(f"Заказ с ключом {idempotency_key} уже создан (ID {order_id})")
+        self.idempotency_key = idempotency_key
+        self.order_id = order_id
+
+
+def format_notes(notes: List[Dict[str, Any]]) -> str:
+    """Заметки в виде текста: по строке "[время] (автор) текст" на заметку"""
+    lines = []
+    for note in notes:
+        author = f" ({note['author']})" if note['author'] else ''
+        lines.append(f"[{note['ts'][:16]}]{author} {note['text']}")
+    return '\n'.join(lines)
+
+
+# Время каждого публичного метода попадает в гистограмму db_seconds{method=...}
+@instrument_methods('db_seconds')
 class Database:
-    def __init__(self, db_path: str = 'bot.db'):
+    def __init__(self, db_path: str = 'bot.db', read_pool_size: int = 2, batch_max_rows: int = 100,
+                 batch_max_delay: float = 0.005, synchronous_commit: bool = False,
+                 idempotency_cache_size: int = 10000):
         """Инициализирует базу данных
 
+        Соединения не открываются здесь: один писатель и небольшой пул читателей
+        создаются в initialize() и живут до вызова close().
+
         Args:
             db_path (str, optional): Путь к базе данных. По умолчанию 'bot.db'.
+            read_pool_size (int, optional): Количество соединений только для чтения. По умолчанию 2.
+            batch_max_rows (int, optional): Максимум заказов в одной групповой транзакции. По умолчанию 100.
+            batch_max_delay (float, optional): Сколько секунд копить заказы перед записью. По умолчанию 0.005.
+            synchronous_commit (bool, optional): Фиксировать каждый заказ отдельно с fsync
+                (PRAGMA synchronous=FULL) вместо групповой записи. По умолчанию False.
+            idempotency_cache_size (int, optional): Сколько ключей идемпотентности последних заказов
+                помнить в памяти. По умолчанию 10000.
         """
         self.db_path = db_path
-        # self._create_tables() # Создание таблиц теперь асинхронное
+        self.read_pool_size = max(1, read_pool_size)
+        self.batch_max_rows = max(1, batch_max_rows)
+        self.batch_max_delay = max(0.0, batch_max_delay)
+        self.synchronous_commit = synchronous_commit
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_queue: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        # Очередь групповой записи заказов: (строка для вставки, future с id заказа)
+        self._pending_orders: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._batch_full = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Ключи идемпотентности последних заказов -> ID заказа (None - заказ еще записывается)
+        self.idempotency_cache_size = max(1, idempotency_cache_size)
+        self._order_keys: 'collections.OrderedDict[str, Optional[int]]' = collections.OrderedDict()
+
+    async def _open_connection(self, synchronous_full: bool = False) -> aiosqlite.Connection:
+        """Открывает соединение и один раз применяет к нему PRAGMA."""
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+        if synchronous_full:
+            await conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    async def _ensure_open(self):
+        """Открывает соединения, если initialize() еще не вызывался."""
+        if self._writer is not None:
+            return
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = await self._open_connection(synchronous_full=self.synchronous_commit)
+            readers = [await self._open_connection() for _ in range(self.read_pool_size)]
+            queue = asyncio.Queue()
+            for reader in readers:
+                queue.put_nowait(reader)
+            self._readers = readers
+            self._reader_queue = queue
+            self._writer = writer
+            logger.info(f"DB: Открыты соединения к {self.db_path} (1 писатель, {len(readers)} читателей)")
+
+    @contextlib.asynccontextmanager
+    async def _write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдает соединение писателя; транзакции сериализуются и фиксируются по выходу из блока."""
+        await self._ensure_open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    @contextlib.asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Берет соединение из пула читателей и возвращает его обратно."""
+        await self._ensure_open()
+        conn = await self._reader_queue.get()
+        try:
+            yield conn
+        finally:
+            self._reader_queue.put_nowait(conn)
+
+    async def close(self):
+        """Дописывает ожидающие заказы и закрывает все соединения. Вызывается из post_shutdown бота."""
+        if self._flush_task is not None:
+            self._batch_full.set()
+            await self._flush_task
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            async with self._write_lock:
+                for conn in [self._writer, *self._readers]:
+                    try:
+                        await conn.close()
+                    except Exception as e:
+                        logger.error(f"DB: Ошибка при закрытии соединения: {e}")
+                self._writer = None
+                self._readers = []
+                self._reader_queue = None
+            logger.info(f"DB: Соединения к {self.db_path} закрыты.")
 
     async def initialize(self):
-        """Асинхронная инициализация - создает таблицы, если их нет."""
-        async with aiosqlite.connect(self.db_path) as conn:
-            # Устанавливаем row_factory для получения результатов в виде словарей
-            # conn.row_factory = aiosqlite.Row # aiosqlite.Row удобнее для доступа по именам
+        """Асинхронная инициализация - открывает соединения и создает таблицы, если их нет."""
+        await self._ensure_open()
+        async with self._write() as conn:
             cursor = await conn.cursor()
             
             # Таблица для заказов
@@ -76,247 +402,825 @@ class Database:
                 total_price REAL
             )
             ''')
+
+            await self._migrate(conn)
             
-            await conn.commit()
-            logging.info(f"База данных {self.db_path} инициализирована.")
+        logger.info(f"База данных {self.db_path} инициализирована.")
+
+    async def _migrate(self, conn: aiosqlite.Connection):
+        """Применяет недостающие миграции из SCHEMA_MIGRATIONS.
 
-    async def add_order(self, user_id: int, username: str, data=None, **kwargs) -> int:
+        Каждая версия выполняется в своей явной транзакции (BEGIN ... COMMIT)
+        вместе с обновлением PRAGMA user_version: sqlite3 сам не открывает
+        транзакцию перед DDL, и без этого сбой посреди миграции оставил бы,
+        например, добавленный столбец без новой версии схемы.
+        """
+        async with conn.execute('PRAGMA user_version') as cursor:
+            row = await cursor.fetchone()
+        current_version = row[0] if row else 0
+
+        for version, statements in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            if conn.in_transaction:
+                await conn.commit()
+            await conn.execute('BEGIN')
+            try:
+                for statement in statements:
+                    if callable(statement):
+                        await statement(conn)
+                    else:
+                        await conn.execute(statement)
+                # PRAGMA не поддерживает плейсхолдеры, версия - целое число из кода
+                await conn.execute(f'PRAGMA user_version = {int(version)}')
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+            current_version = version
+            logger.info(f"DB: Применена миграция схемы до версии {version}")
+
+    async def add_order(self, user_id: int, username: str, data=None, idempotency_key: Optional[str] = None,
+                        previous_idempotency_key: Optional[str] = None, **kwargs) -> int:
         """Асинхронно добавляет новый заказ в базу данных
 
+        Заказ ставится в очередь групповой записи: заказы, пришедшие
+        одновременно (до batch_max_rows), фиксируются одной транзакцией, и
+        каждый вызов получает id своего заказа. При
+        synchronous_commit заказ записывается сразу отдельной транзакцией.
+
         Args:
             user_id: ID пользователя
             username: Имя пользователя
-            data: Данные заказа как словарь (из Mini App)
+            data: Данные заказа как словарь (из Mini App) или OrderDraft (из мастера бота)
+            idempotency_key: Ключ идемпотентности (см. orders.message_idempotency_key и
+                orders.idempotency_keys); повтор заказа с тем же ключом не создает новую строку
+            previous_idempotency_key: Ключ того же заказа за предыдущий интервал (см.
+                orders.idempotency_keys); заказ с ним тоже считается повтором, а сам ключ не записывается
             **kwargs: Данные заказа как отдельные параметры (из старого бота)
 
         Returns:
             int: ID созданного заказа
+
+        Raises:
+            DuplicateOrderError: Заказ с таким ключом уже создан. Недавние ключи проверяются
+                в памяти без обращения к базе, остальные - уникальным индексом.
         """
-        # --- МЕТКА 1.5 --- 
-        logging.info(f"!!!!!!!! database.py: ТОЧКА 1.5 - ВХОД В add_order (user={user_id}) !!!!!!!!")
-        print(f"!!!!!!!! database.py: ТОЧКА 1.5 - ВХОД В add_order (user={user_id}) !!!!!!!!")
-        # -----------------
-        async with aiosqlite.connect(self.db_path) as conn:
-            cursor = await conn.cursor()
-            
-            # Определяем источник данных
-            if data is None and kwargs:
-                source_data = kwargs
-                logging.info(f"DB: Используется старый способ вызова add_order через kwargs: {kwargs}")
-            elif data is None:
-                source_data = {}
-                logging.warning("DB: Данные для заказа не предоставлены!")
+        if idempotency_key is not None:
+            for key in (idempotency_key, previous_idempotency_key):
+                if key is not None and key in self._order_keys:
+                    self._order_keys.move_to_end(key)
+                    metrics.inc('orders_deduplicated_total', where='cache')
+                    raise DuplicateOrderError(key, self._order_keys[key])
+            self._remember_order_key(idempotency_key, None)
+
+        row = self._order_row(user_id, username, data, kwargs)
+        row['idempotency_key'] = idempotency_key
+        # Не параметр INSERT: проверяется отдельным запросом в той же транзакции
+        row['previous_idempotency_key'] = previous_idempotency_key if idempotency_key is not None else None
+        future = None
+        try:
+            if self.synchronous_commit:
+                async with self._write() as conn:
+                    order_id = await self._insert_order(conn, row)
+                logger.info("DB: Заказ успешно добавлен с ID: %s", order_id)
             else:
-                source_data = data
-                # --- ЛОГИРУЕМ СЫРЫЕ ДАННЫЕ, ПРИШЕДШИЕ В ФУНКЦИЮ --- 
+                future = self._enqueue_order(row)
+                # Отмена вызова не убирает заказ из очереди, поэтому само ожидание записи не отменяется
+                order_id = await asyncio.shield(future)
+        except DuplicateOrderError as e:
+            metrics.inc('orders_deduplicated_total', where='db')
+            self._remember_order_key(idempotency_key, e.order_id)
+            raise
+        except asyncio.CancelledError:
+            if idempotency_key is not None:
+                if future is not None:
+                    # Заказ еще будет записан: ключ остается занятым, пока пачка не зафиксирована
+                    future.add_done_callback(functools.partial(self._settle_order_key, idempotency_key))
+                else:
+                    self._order_keys.pop(idempotency_key, None)
+            raise
+        except BaseException:
+            if idempotency_key is not None:
+                self._order_keys.pop(idempotency_key, None)
+            raise
+        if idempotency_key is not None:
+            self._remember_order_key(idempotency_key, order_id)
+        return order_id
+
+    def _remember_order_key(self, key: str, order_id: Optional[int]):
+        self._order_keys[key] = order_id
+        self._order_keys.move_to_end(key)
+        if len(self._order_keys) > self.idempotency_cache_size:
+            self._order_keys.popitem(last=False)
+
+    def _settle_order_key(self, key: str, future: asyncio.Future):
+        """Уточняет ключ отмененного вызова add_order по итогу записи его заказа"""
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or (error is not None and not isinstance(error, DuplicateOrderError)):
+            self._order_keys.pop(key, None)
+        elif error is not None:
+            self._remember_order_key(key, error.order_id)
+        else:
+            self._remember_order_key(key, future.result())
+
+    async def add_orders(self, orders: List[Tuple[int, str, Any]]) -> List[int]:
+        """Асинхронно добавляет несколько заказов (через ту же групповую запись, что и add_order)
+
+        Args:
+            orders: Список кортежей (user_id, username, данные заказа).
+
+        Returns:
+            Список id созданных заказов в том же порядке.
+        """
+        return list(await asyncio.gather(*(self.add_order(user_id, username, data) for user_id, username, data in orders)))
+
+    def _order_row(self, user_id: int, username: str, data, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Приводит данные заказа из любого источника к строке таблицы orders"""
+        # Определяем источник данных
+        if data is None and kwargs:
+            source_data = kwargs
+            logger.debug("DB: Используется старый способ вызова add_order через kwargs: %s", kwargs)
+        elif data is None:
+            source_data = {}
+            logger.warning("DB: Данные для заказа не предоставлены!")
+        elif isinstance(data, OrderDraft):
+            source_data = data.to_dict()
+        else:
+            source_data = data
+            # Сериализуем только если DEBUG действительно включен
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("DB add_order: получены данные: %s", json.dumps(source_data, ensure_ascii=False, default=str))
+
+        # Тип продукта
+        product_type_key = source_data.get('product', source_data.get('product_type', 'Нестандартный заказ'))
+        product_type = product_mapping.get(product_type_key, product_type_key)
+
+        # Форма
+        shape_key = source_data.get('shape', '')
+        shape = shape_mapping.get(shape_key, shape_key) if shape_key else ''
+
+        # Материал
+        material_key = source_data.get('material', '')
+        material = material_mapping.get(material_key, material_key) if material_key else ''
+
+        # Опции (корректная обработка и сериализация)
+        options_data = source_data.get('options', [])
+        options_json = json.dumps(options_data, ensure_ascii=False) if options_data else '[]'
+
+        # Фотографии (корректная обработка и сериализация)
+        custom_photos_data = source_data.get('custom_photos', [])
+        custom_photos_json = json.dumps(custom_photos_data, ensure_ascii=False) if custom_photos_data else '[]'
+
+        # Контакт
+        contact = source_data.get('contact', source_data.get('contact_phone', source_data.get('phone', '')))
+
+        # Описание (учет разных ключей)
+        custom_description = source_data.get('custom_description', source_data.get('customDescription', ''))
+
+        return {
+            'user_id': user_id,
+            'username': username,
+            'order_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'product_type': product_type,
+            'size': source_data.get('size', ''),
+            'shape': shape,
+            'material': material,
+            'color': source_data.get('color', ''),
+            'options': options_json,
+            'custom_description': custom_description,
+            'custom_photos': custom_photos_json,
+            'contact': contact,
+            'status': source_data.get('status', 'new'),
+            'notes': '', # Заметки добавляются отдельно
+            'total_price': source_data.get('total_price', 0) if isinstance(source_data.get('total_price'), (int, float)) else 0
+        }
+
+    async def _insert_order(self, conn: aiosqlite.Connection, row: Dict[str, Any]) -> int:
+        """Вставляет строку заказа в текущей транзакции писателя и возвращает ее id
+
+        Raises:
+            DuplicateOrderError: Заказ с ключом идемпотентности из row (или с ключом предыдущего интервала) уже есть в базе.
+        """
+        previous_key = row.get('previous_idempotency_key')
+        if previous_key is not None:
+            async with conn.execute("SELECT id FROM orders WHERE idempotency_key = ?", (previous_key,)) as cursor:
+                existing = await cursor.fetchone()
+            if existing:
+                raise DuplicateOrderError(previous_key, existing[0])
+        logger.debug("DB SQL: %s, значения: %s", INSERT_ORDER_SQL, row)
+        async with conn.execute(INSERT_ORDER_SQL, row) as cursor:
+            if cursor.rowcount > 0:
+                return cursor.lastrowid
+        async with conn.execute("SELECT id FROM orders WHERE idempotency_key = ?", (row['idempotency_key'],)) as cursor:
+            existing = await cursor.fetchone()
+        raise DuplicateOrderError(row['idempotency_key'], existing[0] if existing else None)
+
+    def _enqueue_order(self, row: Dict[str, Any]) -> asyncio.Future:
+        """Ставит заказ в очередь групповой записи; future получит id заказа или ошибку"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending_orders.append((row, future))
+        if len(self._pending_orders) >= self.batch_max_rows:
+            self._batch_full.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_orders_loop())
+        return future
+
+    async def _flush_orders_loop(self):
+        """Записывает очередь заказов пачками, пока она не опустеет.
+
+        Одиночный заказ записывается сразу, без ожидания; если в очереди уже
+        несколько заказов (идет поток), пачка добирается еще batch_max_delay
+        секунд. Заказы, пришедшие во время записи пачки, уходят следующей.
+        """
+        while self._pending_orders:
+            if 1 < len(self._pending_orders) < self.batch_max_rows and self.batch_max_delay > 0:
                 try:
-                    raw_data_log = json.dumps(source_data, indent=2, ensure_ascii=False)
-                except TypeError: # На случай, если данные не сериализуемы
-                    raw_data_log = repr(source_data)
-                logging.info(f"!!!!!!!! DB add_order: ПОЛУЧЕНЫ СЫРЫЕ ДАННЫЕ: {raw_data_log} !!!!!!!!")
-                # ------------------------------------------------------
+                    await asyncio.wait_for(self._batch_full.wait(), self.batch_max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_full.clear()
+            batch = self._pending_orders[:self.batch_max_rows]
+            del self._pending_orders[:self.batch_max_rows]
+            await self._flush_orders(batch)
 
-            # --- Подготовка данных --- 
-            
-            # Тип продукта
-            product_type_key = source_data.get('product', source_data.get('product_type', 'Нестандартный заказ'))
-            product_type = product_mapping.get(product_type_key, product_type_key)
-            
-            # Форма
-            shape_key = source_data.get('shape', '')
-            shape = shape_mapping.get(shape_key, shape_key) if shape_key else ''
-            
-            # Материал
-            material_key = source_data.get('material', '')
-            material = material_mapping.get(material_key, material_key) if material_key else ''
-            
-            # Опции (корректная обработка и сериализация)
-            options_data = source_data.get('options', [])
-            options_json = json.dumps(options_data, ensure_ascii=False) if options_data else '[]'
-            
-            # Фотографии (корректная обработка и сериализация)
-            custom_photos_data = source_data.get('custom_photos', [])
-            custom_photos_json = json.dumps(custom_photos_data, ensure_ascii=False) if custom_photos_data else '[]'
-            
-            # Контакт
-            contact = source_data.get('contact', source_data.get('contact_phone', source_data.get('phone', '')))
-            
-            # Описание (учет разных ключей)
-            custom_description = source_data.get('custom_description', source_data.get('customDescription', ''))
-            
-            # Подготовка словаря для вставки
-            order_data_to_insert = {
-                'user_id': user_id,
-                'username': username,
-                'order_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'product_type': product_type,
-                'size': source_data.get('size', ''),
-                'shape': shape,
-                'material': material,
-                'color': source_data.get('color', ''),
-                'options': options_json,
-                'custom_description': custom_description,
-                'custom_photos': custom_photos_json,
-                'contact': contact,
-                'status': source_data.get('status', 'new'),
-                'notes': '', # Заметки добавляются отдельно
-                'total_price': source_data.get('total_price', 0) if isinstance(source_data.get('total_price'), (int, float)) else 0
-            }
-            
-            # --- ЛОГИРУЕМ ДАННЫЕ ПЕРЕД ВСТАВКОЙ --- 
-            logging.info(f"DB: Подготовленные данные для вставки: {json.dumps(order_data_to_insert, indent=2, ensure_ascii=False)}")
-            
-            # --- Вставка данных --- 
-            fields = ', '.join(order_data_to_insert.keys())
-            placeholders = ', '.join([f':{key}' for key in order_data_to_insert.keys()]) # Используем именованные плейсхолдеры
-            sql = f'INSERT INTO orders ({fields}) VALUES ({placeholders})'
-            
-            logging.info(f"DB SQL: {sql}")
-            logging.info(f"DB Values: {order_data_to_insert}")
-            
-            await cursor.execute(sql, order_data_to_insert)
-            order_id = cursor.lastrowid
-            
-            await conn.commit()
-            
-            logging.info(f"DB: Заказ успешно добавлен с ID: {order_id}")
-            
-            return order_id
+    async def _flush_orders(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        """Фиксирует пачку заказов одной транзакцией и раздает id ожидающим вызовам.
+
+        Повтор по ключу идемпотентности не прерывает пачку: его вызов получает
+        DuplicateOrderError. Если транзакция не удалась по другой причине,
+        заказы пишутся по одному, чтобы ошибка одного заказа не отменяла остальные.
+        """
+        try:
+            async with self._write() as conn:
+                order_ids = []
+                for row, _ in batch:
+                    try:
+                        order_ids.append(await self._insert_order(conn, row))
+                    except DuplicateOrderError as duplicate:
+                        order_ids.append(duplicate)
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(f"DB: Групповая запись {len(batch)} заказов не удалась ({e}), пишем по одному")
+                for item in batch:
+                    await self._flush_orders([item])
+                return
+            logger.error(f"DB: Ошибка при добавлении заказа: {e}")
+            future = batch[0][1]
+            if not future.done():
+                future.set_exception(e)
+            return
 
-    async def get_order_by_id(self, order_id: int) -> Optional[Dict[str, Any]]:
+        metrics.inc('db_order_batches_total')
+        metrics.inc('db_batched_orders_total', len(batch))
+        for (_, future), order_id in zip(batch, order_ids):
+            # Вызов мог быть отменен, пока заказ ждал записи; заказ при этом все равно сохранен
+            if isinstance(order_id, DuplicateOrderError):
+                logger.info("DB: Повтор заказа #%s (ключ %s) не записан", order_id.order_id, order_id.idempotency_key)
+                if not future.done():
+                    future.set_exception(order_id)
+                continue
+            logger.info("DB: Заказ успешно добавлен с ID: %s", order_id)
+            if not future.done():
+                future.set_result(order_id)
+
+    async def get_order_by_id(self, order_id: int) -> Optional[OrderRecord]:
         """Асинхронно получает данные заказа по ID.
         
         Returns:
-            Словарь с данными заказа или None, если заказ не найден.
+            OrderRecord с данными заказа или None, если заказ не найден.
         """
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row # Получать результаты как объекты Row
+            async with self._read() as conn:
                 cursor = await conn.cursor()
                 await cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
                 order_row = await cursor.fetchone()
                 
                 if order_row:
-                    # Преобразуем Row в обычный словарь
-                    order_dict = dict(order_row)
-                    logging.info(f"DB: Заказ #{order_id} найден: {json.dumps(order_dict, indent=2, ensure_ascii=False)}")
-                    # Десериализуем JSON поля для удобства использования
-                    try:
-                        order_dict['options'] = json.loads(order_dict.get('options', '[]') or '[]')
-                    except (json.JSONDecodeError, TypeError):
-                        logging.warning(f"DB: Не удалось десериализовать options для заказа {order_id}")
-                        order_dict['options'] = []
-                    try:
-                        order_dict['custom_photos'] = json.loads(order_dict.get('custom_photos', '[]') or '[]')
-                    except (json.JSONDecodeError, TypeError):
-                        logging.warning(f"DB: Не удалось десериализовать custom_photos для заказа {order_id}")
-                        order_dict['custom_photos'] = []
-                    return order_dict
+                    # options и custom_photos декодируются лениво при первом обращении
+                    order = OrderRecord.from_row(order_row)
+                    await self._attach_notes(conn, [order])
+                    logger.debug("DB: Заказ #%s найден", order_id)
+                    return order
                 else:
-                    logging.warning(f"DB: Заказ с ID {order_id} не найден.")
+                    logger.warning(f"DB: Заказ с ID {order_id} не найден.")
                     return None
         except Exception as e:
-            logging.error(f"DB: Ошибка при получении заказа по ID {order_id}: {e}")
+            logger.error(f"DB: Ошибка при получении заказа по ID {order_id}: {e}")
             return None
 
-    async def get_all_orders(self) -> List[Dict[str, Any]]:
-        """Асинхронно получает все заказы из БД"""
+    async def get_all_orders(self) -> List[OrderRecord]:
+        """Асинхронно получает все заказы из БД (для больших таблиц используйте get_orders_page)"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                conn.row_factory = aiosqlite.Row # Для удобного доступа к полям
+            async with self._read() as conn:
                 cursor = await conn.cursor()
                 await cursor.execute("""
                     SELECT id, user_id, username, product_type, size, shape, material, color, options, 
-                           custom_description, datetime(order_date, 'localtime') as order_date_local, status, notes, contact
+                           custom_description, datetime(order_date, 'localtime') as order_date, status, contact
                     FROM orders
                     ORDER BY id DESC
                 """)
                 orders_rows = await cursor.fetchall()
-            
-            formatted_orders = []
-            for order_row in orders_rows:
-                order_dict = dict(order_row)
-                # Десериализуем JSON поля
-                try:
-                    order_dict['options'] = json.loads(order_dict.get('options', '[]') or '[]')
-                except (json.JSONDecodeError, TypeError):
-                    order_dict['options'] = []
-                # Добавляем поле order_date из order_date_local
-                order_dict['order_date'] = order_dict.pop('order_date_local', None)
-                formatted_orders.append(order_dict)
-                
-            logging.info(f"DB: Получено {len(formatted_orders)} заказов.")
+                formatted_orders = [OrderRecord.from_row(order_row) for order_row in orders_rows]
+                await self._attach_notes(conn, formatted_orders)
+
+            logger.debug("DB: Получено %s заказов.", len(formatted_orders))
             return formatted_orders
         except Exception as e:
-            logging.error(f"DB: Ошибка при получении всех заказов: {e}")
+            logger.error(f"DB: Ошибка при получении всех заказов: {e}")
             return []
 
+    async def get_orders_page(
+        self,
+        limit: int = 10,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        status: Optional[str] = None,
+        user_id: Optional[int] = None,
+        product_type: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Асинхронно получает одну страницу заказов (новые сверху) с keyset-пагинацией по id.
+
+        Вместо OFFSET используется курсор по id, поэтому стоимость запроса не зависит от
+        номера страницы, а фильтры обслуживаются индексами из SCHEMA_MIGRATIONS.
+
+        Args:
+            limit: Количество заказов на странице.
+            before_id: Вернуть заказы с id меньше указанного (следующая страница).
+            after_id: Вернуть заказы с id больше указанного (предыдущая страница).
+            status: Фильтр по статусу.
+            user_id: Фильтр по ID пользователя.
+            product_type: Фильтр по типу продукта (как он хранится в БД, например 'Сумка').
+            date_from: Нижняя граница order_date включительно ('YYYY-MM-DD' или 'YYYY-MM-DD HH:MM:SS').
+            date_to: Верхняя граница order_date не включительно.
+
+        Returns:
+            Словарь с ключами 'orders' (список OrderRecord), 'next_cursor' (id для before_id
+            следующей страницы или None) и 'prev_cursor' (id для after_id предыдущей страницы или None).
+        """
+        conditions = []
+        params: Dict[str, Any] = {}
+        if status is not None:
+            conditions.append('status = :status')
+            params['status'] = status
+        if user_id is not None:
+            conditions.append('user_id = :user_id')
+            params['user_id'] = user_id
+        if product_type is not None:
+            conditions.append('product_type = :product_type')
+            params['product_type'] = product_type
+        if date_from is not None:
+            conditions.append('order_date >= :date_from')
+            params['date_from'] = date_from
+        if date_to is not None:
+            conditions.append('order_date < :date_to')
+            params['date_to'] = date_to
+
+        limit = max(1, int(limit))
+        page_conditions = list(conditions)
+        if after_id is not None:
+            page_conditions.append('id > :cursor')
+            params['cursor'] = after_id
+            order = 'ASC'
+        else:
+            if before_id is not None:
+                page_conditions.append('id < :cursor')
+                params['cursor'] = before_id
+            order = 'DESC'
+        where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+        # Берем на одну строку больше, чтобы понять, есть ли еще страница в этом направлении
+        sql = f"SELECT {ORDER_PAGE_FIELDS} FROM orders {where} ORDER BY id {order} LIMIT :limit"
+        params['limit'] = limit + 1
+
+        try:
+            async with self._read() as conn:
+                async with conn.execute(sql, params) as cursor:
+                    rows = await cursor.fetchall()
+
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if order == 'ASC':
+                    rows.reverse()
+
+                orders = [OrderRecord.from_row(row) for row in rows]
+                await self._attach_notes(conn, orders)
+
+                if not orders:
+                    return {'orders': [], 'next_cursor': None, 'prev_cursor': None}
+
+                newest_id, oldest_id = orders[0].id, orders[-1].id
+                if order == 'DESC':
+                    has_older = has_more
+                    has_newer = await self._orders_exist(conn, conditions, params, 'id > :edge', newest_id)
+                else:
+                    has_newer = has_more
+                    has_older = await self._orders_exist(conn, conditions, params, 'id < :edge', oldest_id)
+
+            logger.debug("DB: Получена страница из %s заказов.", len(orders))
+            return {
+                'orders': orders,
+                'next_cursor': oldest_id if has_older else None,
+                'prev_cursor': newest_id if has_newer else None,
+            }
+        except Exception as e:
+            logger.error(f"DB: Ошибка при получении страницы заказов: {e}")
+            return {'orders': [], 'next_cursor': None, 'prev_cursor': None}
+
+    async def _orders_exist(self, conn: aiosqlite.Connection, conditions: List[str],
+                            params: Dict[str, Any], edge_condition: str, edge_id: int) -> bool:
+        """Проверяет по индексу, есть ли за границей страницы еще заказы с теми же фильтрами."""
+        where = ' AND '.join([*conditions, edge_condition])
+        exist_params = {key: value for key, value in params.items() if key not in ('cursor', 'limit')}
+        exist_params['edge'] = edge_id
+        async with conn.execute(f"SELECT EXISTS(SELECT 1 FROM orders WHERE {where})", exist_params) as cursor:
+            row = await cursor.fetchone()
+        return bool(row[0])
+
+    async def iter_orders(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          status: Optional[str] = None, batch_size: int = 500) -> AsyncIterator[aiosqlite.Row]:
+        """Асинхронно отдает заказы по одному, читая их пачками по batch_size строк.
+
+        В памяти одновременно находится не больше одной пачки, поэтому выгрузку
+        можно делать и на миллионе заказов. Каждая пачка - отдельный короткий
+        запрос с keyset-условием по последней отданной строке: соединение
+        читателя возвращается в пул между пачками, а долгая транзакция чтения
+        не мешает контрольным точкам WAL. Заказы, изменившиеся во время обхода,
+        попадают в выгрузку в том виде, в каком их застанет очередная пачка.
+        Порядок - по (order_date, id) при фильтре по дате (идет по индексу без
+        сортировки), иначе по id.
+
+        Args:
+            date_from: Нижняя граница order_date включительно.
+            date_to: Верхняя граница order_date не включительно.
+            status: Фильтр по статусу.
+            batch_size: Сколько строк читать за один запрос.
+        """
+        conditions = []
+        params: Dict[str, Any] = {'limit': max(1, int(batch_size))}
+        if date_from is not None:
+            conditions.append('order_date >= :date_from')
+            params['date_from'] = date_from
+        if date_to is not None:
+            conditions.append('order_date < :date_to')
+            params['date_to'] = date_to
+        if status is not None:
+            conditions.append('status = :status')
+            params['status'] = status
+        by_date = date_from is not None or date_to is not None
+        if by_date:
+            order, keyset = 'order_date, id', '(order_date, id) > (:last_date, :last_id)'
+        else:
+            order, keyset = 'id', 'id > :last_id'
+
+        last_row = None
+        while True:
+            page_conditions = list(conditions)
+            if last_row is not None:
+                page_conditions.append(keyset)
+                params['last_date'], params['last_id'] = last_row['order_date'], last_row['id']
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+            async with self._read() as conn:
+                async with conn.execute(f"SELECT * FROM orders {where} ORDER BY {order} LIMIT :limit", params) as cursor:
+                    rows = await cursor.fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < params['limit']:
+                break
+            last_row = rows[-1]
+
+    async def get_order_stats(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                              status: Optional[str] = None, product_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Асинхронно получает сводку заказов за период из таблицы order_stats (не читая orders)
+
+        Args:
+            date_from: Первый день периода ('YYYY-MM-DD') включительно.
+            date_to: День после конца периода (не включительно).
+            status: Фильтр по статусу.
+            product_type: Фильтр по типу изделия (как он хранится в БД, например 'Сумка').
+
+        Returns:
+            Список словарей с ключами status, product_type, material, orders и revenue.
+        """
+        conditions, params = [], []
+        if date_from is not None:
+            conditions.append('day >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append('day < ?')
+            params.append(date_to)
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status)
+        if product_type is not None:
+            conditions.append('product_type = ?')
+            params.append(product_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        async with self._read() as conn:
+            async with conn.execute(
+                f"SELECT status, product_type, material, SUM(orders) AS orders, SUM(revenue) AS revenue "
+                f"FROM order_stats {where} GROUP BY status, product_type, material", params
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+    async def rebuild_order_stats(self) -> int:
+        """Асинхронно пересчитывает сводку order_stats с нуля по таблице orders
+
+        Returns:
+            Количество строк в новой сводке.
+        """
+        async with self._write() as conn:
+            await conn.execute("DELETE FROM order_stats")
+            async with conn.execute(f"INSERT INTO order_stats {ORDER_STATS_REBUILD_SELECT}") as cursor:
+                count = cursor.rowcount
+        logger.info(f"DB: Сводка заказов пересчитана, строк: {count}")
+        return count
+
+    async def search_orders(self, match_query: str, limit: int = 10, offset: int = 0) -> Dict[str, Any]:
+        """Асинхронно ищет заказы по индексу orders_search, лучшие совпадения сверху.
+
+        Совпадения в имени пользователя и контакте весят больше, чем в описании
+        и заметках. Результаты ранжированы, поэтому страницы задаются смещением.
+
+        Args:
+            match_query: Выражение FTS5 MATCH (см. order_search.build_match_query).
+            limit: Количество заказов на странице.
+            offset: Сколько лучших совпадений пропустить.
+
+        Returns:
+            Словарь с ключами 'orders' (список OrderRecord), 'snippets' (id -> фрагмент
+            текста с совпадением) и 'has_more' (есть ли следующая страница).
+        """
+        limit = max(1, int(limit))
+        async with self._read() as conn:
+            async with conn.execute(
+                f"SELECT rowid, snippet(orders_search, -1, '', '', '…', {SEARCH_SNIPPET_TOKENS}) AS snippet "
+                f"FROM orders_search WHERE orders_search MATCH ? "
+                f"ORDER BY bm25(orders_search, {SEARCH_COLUMN_WEIGHTS}), rowid DESC LIMIT ? OFFSET ?",
+                (match_query, limit + 1, max(0, int(offset)))
+            ) as cursor:
+                hits = await cursor.fetchall()
+            has_more = len(hits) > limit
+            snippets = {row['rowid']: row['snippet'] for row in hits[:limit]}
+
+            orders = []
+            if snippets:
+                placeholders = ', '.join('?' * len(snippets))
+                async with conn.execute(
+                    f"SELECT {ORDER_PAGE_FIELDS} FROM orders WHERE id IN ({placeholders})", list(snippets)
+                ) as cursor:
+                    by_id = {row['id']: OrderRecord.from_row(row) for row in await cursor.fetchall()}
+                orders = [by_id[order_id] for order_id in snippets if order_id in by_id]
+                await self._attach_notes(conn, orders)
+        return {'orders': orders, 'snippets': snippets, 'has_more': has_more}
+
+    async def search_backfill_progress(self) -> Optional[Tuple[int, int]]:
+        """Возвращает (следующий id, последний id) незавершенного заполнения индекса поиска или None."""
+        async with self._read() as conn:
+            async with conn.execute("SELECT next_id, last_id FROM search_backfill") as cursor:
+                row = await cursor.fetchone()
+        return (row['next_id'], row['last_id']) if row else None
+
+    async def backfill_search_index(self, batch_size: int = 500, pause: float = 0.05) -> int:
+        """Асинхронно добавляет в индекс поиска заказы, созданные до его появления.
+
+        Каждая пачка из batch_size заказов (по диапазону id) записывается
+        отдельной короткой транзакцией вместе с продвижением search_backfill,
+        поэтому запись заказов ждет не дольше одной пачки, а прерванное
+        заполнение продолжается с того же места при следующем запуске.
+
+        Args:
+            batch_size: Сколько id обрабатывать за одну транзакцию.
+            pause: Пауза между пачками в секундах.
+
+        Returns:
+            Количество проиндексированных заказов.
+        """
+        total = 0
+        while True:
+            async with self._write() as conn:
+                async with conn.execute("SELECT next_id, last_id FROM search_backfill") as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    break
+                next_id, last_id = row
+                batch_end = min(next_id + batch_size - 1, last_id)
+                async with conn.execute(
+                    f"INSERT INTO orders_search (rowid, username, contact, contact_digits, custom_description, notes) "
+                    f"SELECT id, username, contact, {_SEARCH_DIGITS.format(row='orders')}, custom_description, "
+                    f"{_SEARCH_NOTES.format(order_id='orders.id')} FROM orders WHERE id BETWEEN ? AND ?",
+                    (next_id, batch_end)
+                ) as cursor:
+                    total += cursor.rowcount
+                if batch_end >= last_id:
+                    await conn.execute("DELETE FROM search_backfill")
+                else:
+                    await conn.execute("UPDATE search_backfill SET next_id = ?", (batch_end + 1,))
+            if batch_end >= last_id:
+                logger.info(f"DB: Индекс поиска заполнен, добавлено заказов: {total}")
+                break
+            await asyncio.sleep(pause)
+        return total
+
     async def get_next_order_id(self) -> int:
         """Асинхронно получает следующий доступный ID заказа"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async with self._read() as conn:
                 cursor = await conn.cursor()
                 await cursor.execute("SELECT MAX(id) FROM orders")
                 result = await cursor.fetchone()
                 next_id = (result[0] or 0) + 1
-                logging.info(f"DB: Следующий ID заказа: {next_id}")
+                logger.info(f"DB: Следующий ID заказа: {next_id}")
                 return next_id
         except Exception as e:
-            logging.error(f"DB: Ошибка при получении следующего ID заказа: {e}")
+            logger.error(f"DB: Ошибка при получении следующего ID заказа: {e}")
             # В случае ошибки возвращаем временное значение, чтобы избежать падения
             return int(time.time()) # Не идеально, но лучше чем падение
 
     async def update_order_status(self, order_id: int, status: str) -> bool:
         """Асинхронно обновляет статус заказа"""
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
+            async with self._write() as conn:
                 cursor = await conn.cursor()
                 await cursor.execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
-                await conn.commit()
                 if cursor.rowcount > 0:
-                    logging.info(f"DB: Статус заказа #{order_id} обновлен на '{status}'")
+                    logger.info(f"DB: Статус заказа #{order_id} обновлен на '{status}'")
                     return True
                 else:
-                    logging.warning(f"DB: Заказ #{order_id} не найден для обновления статуса.")
+                    logger.warning(f"DB: Заказ #{order_id} не найден для обновления статуса.")
                     return False
         except Exception as e:
-            logging.error(f"DB: Ошибка при обновлении статуса заказа #{order_id}: {e}")
+            logger.error(f"DB: Ошибка при обновлении статуса заказа #{order_id}: {e}")
+            return False
+
+    async def add_order_note(self, order_id: int, note: str, author: Optional[str] = None) -> bool:
+        """Асинхронно добавляет заметку к заказу (одна вставка в order_notes, без чтения старых заметок)
+
+        Args:
+            order_id: ID заказа.
+            note: Текст заметки.
+            author: Кто добавил заметку (имя или ID администратора).
+
+        Returns:
+            True, если заметка добавлена; False, если заказ не найден или произошла ошибка.
+        """
+        try:
+            async with self._write() as conn:
+                # Проверка существования заказа и вставка - один оператор
+                async with conn.execute(
+                    "INSERT INTO order_notes (order_id, ts, author, text) SELECT id, ?, ?, ? FROM orders WHERE id = ?",
+                    (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), author, note, order_id)
+                ) as cursor:
+                    added = cursor.rowcount > 0
+            if added:
+                logger.info(f"DB: Заметка добавлена к заказу #{order_id}")
+            else:
+                logger.warning(f"DB: Заказ #{order_id} не найден для добавления заметки.")
+            return added
+        except Exception as e:
+            logger.error(f"DB: Ошибка при добавлении заметки к заказу #{order_id}: {e}")
             return False
 
-    async def add_order_note(self, order_id: int, note: str) -> bool:
-        """Асинхронно добавляет или обновляет заметку к заказу"""
+    async def get_latest_notes(self, order_ids: List[int], limit: int = LATEST_NOTES_LIMIT) -> Dict[int, List[Dict[str, Any]]]:
+        """Асинхронно получает последние limit заметок для каждого из заказов
+
+        Returns:
+            Словарь {id заказа: [{'ts', 'author', 'text'}, ...]} от старых к новым;
+            заказы без заметок в словарь не попадают.
+        """
+        async with self._read() as conn:
+            return await self._latest_notes(conn, order_ids, limit)
+
+    async def _latest_notes(self, conn: aiosqlite.Connection, order_ids: List[int], limit: int) -> Dict[int, List[Dict[str, Any]]]:
+        """Последние заметки заказов: для каждого заказа - отдельный спуск по индексу (order_id, id) с LIMIT"""
+        notes: Dict[int, List[Dict[str, Any]]] = {}
+        order_ids = list(dict.fromkeys(order_ids))
+        for start in range(0, len(order_ids), NOTES_QUERY_CHUNK):
+            chunk = order_ids[start:start + NOTES_QUERY_CHUNK]
+            sql = ' UNION ALL '.join(
+                'SELECT * FROM (SELECT id, order_id, ts, author, text FROM order_notes '
+                'WHERE order_id = ? ORDER BY id DESC LIMIT ?)' for _ in chunk
+            )
+            params = [value for order_id in chunk for value in (order_id, limit)]
+            async with conn.execute(f"{sql} ORDER BY order_id, id", params) as cursor:
+                async for row in cursor:
+                    notes.setdefault(row['order_id'], []).append(
+                        {'ts': row['ts'], 'author': row['author'], 'text': row['text']}
+                    )
+        return notes
+
+    async def _attach_notes(self, conn: aiosqlite.Connection, orders: List[OrderRecord]):
+        """Подставляет в поле notes заказов текст последних LATEST_NOTES_LIMIT заметок"""
+        if not orders:
+            return
+        notes = await self._latest_notes(conn, [order.id for order in orders], LATEST_NOTES_LIMIT)
+        for order in orders:
+            order.notes = format_notes(notes.get(order.id, []))
+
+    async def get_media_file_ids(self, paths: List[str]) -> Dict[str, tuple]:
+        """Асинхронно получает закэшированные file_id для фото каталога.
+
+        Returns:
+            Словарь {путь: (хэш содержимого, file_id)} только для найденных путей.
+        """
+        if not paths:
+            return {}
+        placeholders = ', '.join('?' for _ in paths)
         try:
-            async with aiosqlite.connect(self.db_path) as conn:
-                cursor = await conn.cursor()
-                # Получаем текущую заметку
-                await cursor.execute("SELECT notes FROM orders WHERE id = ?", (order_id,))
-                current_note_row = await cursor.fetchone()
-                
-                if current_note_row is None:
-                    logging.warning(f"DB: Заказ #{order_id} не найден для добавления заметки.")
-                    return False
-                
-                current_note = current_note_row[0] or ""
-                new_note = f"{current_note}\n[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}] {note}".strip()
-                
-                await cursor.execute("UPDATE orders SET notes = ? WHERE id = ?", (new_note, order_id))
-                await conn.commit()
-                
-                if cursor.rowcount > 0:
-                    logging.info(f"DB: Заметка добавлена к заказу #{order_id}")
-                    return True
-                else:
-                    # Этого не должно произойти, если fetchone вернул результат
-                    logging.error(f"DB: Не удалось обновить заметку для заказа #{order_id} после ее нахождения.")
-                    return False
+            async with self._read() as conn:
+                async with conn.execute(
+                    f"SELECT path, content_hash, file_id FROM media_cache WHERE path IN ({placeholders})",
+                    list(paths)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            return {row['path']: (row['content_hash'], row['file_id']) for row in rows}
         except Exception as e:
-            logging.error(f"DB: Ошибка при добавлении заметки к заказу #{order_id}: {e}")
+            logger.error(f"DB: Ошибка при чтении кэша file_id: {e}")
+            return {}
+
+    async def save_media_file_ids(self, entries: List[tuple]) -> bool:
+        """Асинхронно сохраняет file_id для фото каталога.
+
+        Args:
+            entries: Список кортежей (путь, хэш содержимого, file_id).
+        """
+        if not entries:
+            return True
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            async with self._write() as conn:
+                await conn.executemany(
+                    "INSERT INTO media_cache (path, content_hash, file_id, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET content_hash = excluded.content_hash, "
+                    "file_id = excluded.file_id, updated_at = excluded.updated_at",
+                    [(path, content_hash, file_id, now) for path, content_hash, file_id in entries]
+                )
+            logger.debug("DB: Сохранено %s file_id в кэш медиа", len(entries))
+            return True
+        except Exception as e:
+            logger.error(f"DB: Ошибка при сохранении кэша file_id: {e}")
             return False
 
+    async def delete_media_file_ids(self, paths: List[str]) -> bool:
+        """Асинхронно удаляет file_id из кэша (например, если Telegram их больше не принимает)."""
+        if not paths:
+            return True
+        placeholders = ', '.join('?' for _ in paths)
+        try:
+            async with self._write() as conn:
+                await conn.execute(f"DELETE FROM media_cache WHERE path IN ({placeholders})", list(paths))
+            return True
+        except Exception as e:
+            logger.error(f"DB: Ошибка при удалении из кэша file_id: {e}")
+            return False
+
+    async def load_sessions(self) -> Dict[int, str]:
+        """Асинхронно загружает все сохраненные сессии пользователей.
+
+        Returns:
+            Словарь {user_id: JSON-строка с данными сессии}.
+        """
+        async with self._read() as conn:
+            async with conn.execute("SELECT user_id, data FROM sessions") as cursor:
+                rows = await cursor.fetchall()
+        return {row['user_id']: row['data'] for row in rows}
+
+    async def save_sessions(self, sessions: List[tuple]):
+        """Асинхронно сохраняет сессии одной транзакцией.
+
+        Args:
+            sessions: Список кортежей (user_id, JSON-строка данных, время последней активности).
+        """
+        if not sessions:
+            return
+        async with self._write() as conn:
+            await conn.executemany(
+                "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                sessions
+            )
+
+    async def delete_sessions(self, user_ids: List[int]):
+        """Асинхронно удаляет сессии пользователей."""
+        if not user_ids:
+            return
+        async with self._write() as conn:
+            await conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+    async def get_expired_session_ids(self, cutoff: float) -> List[int]:
+        """Асинхронно получает ID пользователей, чьи сессии не обновлялись с момента cutoff (unix time)."""
+        async with self._read() as conn:
+            async with conn.execute("SELECT user_id FROM sessions WHERE updated_at < ?", (cutoff,)) as cursor:
+                rows = await cursor.fetchall()
+        return [row['user_id'] for row in rows]
+
 # Пример использования (если нужно запустить отдельно для инициализации)
 #async def main():
 #    db = Database()
 #    await db.initialize()
+#    await db.close()
 #
 #if __name__ == "__main__":
 #    import asyncio
@@ -3,83 +3,173 @@ import os
 import sys
 import time
 import json
+import signal
+import tempfile
+from pathlib import Path
+from typing import Optional
 from telegram import Bot, Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
-from telegram.error import Conflict, TimedOut, NetworkError
-from better_profanity import Profanity
+from telegram.error import Conflict, TimedOut, NetworkError, BadRequest
 from config import *
-from database import Database
+from database import Database, DuplicateOrderError, product_mapping
+from export import export_filename, export_orders, parse_export_args
+from order_search import build_match_query
+from orders import OrderDraft, idempotency_keys, message_idempotency_key
+from order_stats import format_order_stats, parse_stats_args
+from wizard import (
+    PRODUCT_FLOWS, STEP_FIELDS, BUTTON_BACK, BUTTON_CANCEL, BUTTON_START_ORDER,
+    BUTTON_FINISH_OPTIONS, keyboard_for, next_step, push_history,
+)
+from catalog import AssetCatalog, SHAPE_PHOTOS, MATERIAL_PHOTOS
+from media_cache import MediaCache
+from mini_app import MiniAppOrderError, format_order_text, parse_order
+from moderation import Moderator
 from menu import get_menu_commands
+from persistence import SQLitePersistence
+from update_processor import PerUserUpdateProcessor
+from webhook_server import WebhookServer
+from outbound import OutboundRateLimiter, PRIORITY_ADMIN, PRIORITY_SELLER, send_with_retry
+from log_setup import setup_logging
+from metrics import metrics, timed, MetricsServer
 import asyncio
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filename='bot.log'
-)
 logger = logging.getLogger(__name__)
 
-# Инициализация фильтра нецензурной лексики
-profanity = Profanity()
-profanity.load_censor_words()
-
 # Определение этапов
 PRODUCT, SIZE, SHAPE, MATERIAL, COLOR, OPTIONS, CONTACT, ORDER, PREVIEW = range(9)
 
 class SumkiBot:
-    def __init__(self):
-        self.user_data = {}
-        self.stages = ['start', 'choose_product', 'choose_size', 'choose_shape', 'choose_material', 'choose_color', 'choose_options', 'contact', 'order', 'preview']
-        self.state_history = {}
-        self.db = Database()
-
-    async def initialize_db(self, application: ApplicationBuilder):
-        """Асинхронно инициализирует базу данных (принимает application от post_init)."""
+    def __init__(self, db_path: str = DB_PATH):
+        # Таблицы мастера: шаг -> метод, показывающий шаг, и шаг -> обработчик ответа на нем
+        self.step_handlers = {
+            'start': self.start,
+            'choose_product': self.choose_product,
+            'choose_size': self.choose_bag_size,
+            'choose_shape': self.choose_bag_shape,
+            'choose_material': self.choose_bag_material,
+            'choose_color': self.choose_bag_color,
+            'choose_options': self.choose_options,
+            'custom_order': self.handle_custom_order,
+            'preview': self.show_order_preview,
+            'contact': self.request_contact,
+        }
+        self.input_handlers = {
+            'start': self._on_start_input,
+            'choose_product': self._on_product_input,
+            'custom_order': self._on_custom_order_input,
+            'choose_options': self._on_option_input,
+        }
+        self.input_handlers.update({step: self._on_field_input for step in STEP_FIELDS})
+        self.db = Database(db_path, read_pool_size=DB_READ_POOL_SIZE, batch_max_rows=DB_BATCH_MAX_ROWS,
+                           batch_max_delay=DB_BATCH_MAX_DELAY_MS / 1000, synchronous_commit=DB_SYNCHRONOUS_COMMIT,
+                           idempotency_cache_size=ORDER_DEDUP_CACHE_SIZE)
+        self.catalog = AssetCatalog()
+        self.media_cache = MediaCache(self.db)
+        # Словари нецензурной лексики компилируются в автомат один раз при запуске
+        self.moderator = Moderator()
+        # context.user_data (этап и история шагов мастера) хранится в SQLite и переживает перезапуск
+        self.persistence = SQLitePersistence(self.db, update_interval=PERSISTENCE_UPDATE_INTERVAL)
+        self._eviction_task = None
+        self._search_backfill_task = None
+        self.metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+        # Общий бот приложения (с пулом соединений), задается в build_application
+        self.bot = None
+
+    async def initialize_db(self, application: Application):
+        """Асинхронно инициализирует базу данных, каталог фото и меню команд (принимает application от post_init)."""
         await self.db.initialize()
+        await self.catalog.preload()
+        await self.set_commands(application)
+        self._eviction_task = asyncio.create_task(self.evict_expired_sessions(application))
+        self._search_backfill_task = asyncio.create_task(self.backfill_search_index())
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"Не удалось запустить сервер метрик: {e}")
+
+    async def evict_expired_sessions(self, application: Application):
+        """Периодически удаляет брошенные сессии мастера заказа из памяти и базы"""
+        while True:
+            await asyncio.sleep(SESSION_EVICT_INTERVAL)
+            try:
+                expired = await self.persistence.expired_user_ids(SESSION_TTL)
+                for user_id in expired:
+                    # Удаление из базы выполнит Application при следующем обновлении persistence
+                    application.drop_user_data(user_id)
+                if expired:
+                    logger.info(f"Удалено брошенных сессий: {len(expired)}")
+            except Exception as e:
+                logger.error(f"Ошибка при удалении брошенных сессий: {e}")
+
+    async def backfill_search_index(self):
+        """Постепенно добавляет в индекс поиска /find заказы, созданные до его появления"""
+        try:
+            await self.db.backfill_search_index(SEARCH_BACKFILL_BATCH, SEARCH_BACKFILL_PAUSE_MS / 1000)
+        except Exception as e:
+            logger.error(f"Ошибка при заполнении индекса поиска: {e}")
+
+    async def close_db(self, application: Application):
+        """Закрывает соединения с базой данных (принимает application от post_shutdown)."""
+        for task in (self._eviction_task, self._search_backfill_task):
+            if task:
+                task.cancel()
+        self._eviction_task = self._search_backfill_task = None
+        self.moderator.shutdown()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.db.close()
+
+    def _history(self, context: ContextTypes.DEFAULT_TYPE):
+        """История шагов мастера хранится в user_data, чтобы сохраняться вместе с ней"""
+        return context.user_data.setdefault('history', [])
+
+    def _enter_step(self, context: ContextTypes.DEFAULT_TYPE, step: str):
+        """Переводит мастер на шаг step и запоминает его для кнопки "Назад" """
+        push_history(self._history(context), step)
+        context.user_data['stage'] = step
+
+    def _draft(self, context: ContextTypes.DEFAULT_TYPE) -> OrderDraft:
+        """Черновик заказа пользователя (создается при первом обращении)"""
+        draft = context.user_data.get('draft')
+        if draft is None:
+            draft = context.user_data['draft'] = OrderDraft()
+        return draft
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id] = []
+        context.user_data['history'] = []
         context.user_data['stage'] = 'start'
-        keyboard = ReplyKeyboardMarkup([
-            ["Оформить заказ"],
-            ["Заказать через приложение"]
-        ], resize_keyboard=True)
-        await update.message.reply_text(MESSAGES['welcome'], reply_markup=keyboard)
+        await update.message.reply_text(MESSAGES['welcome'], reply_markup=keyboard_for('start'))
 
     async def cancel_order(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отмена текущего заказа"""
-        user_id = update.message.from_user.id
         context.user_data.clear()
-        self.state_history[user_id] = []
-        keyboard = ReplyKeyboardMarkup([["Оформить заказ"]], resize_keyboard=True)
-        await update.message.reply_text(MESSAGES['order_cancelled'], reply_markup=keyboard)
+        context.user_data['history'] = []
+        await update.message.reply_text(MESSAGES['order_cancelled'], reply_markup=keyboard_for('cancelled'))
         return ConversationHandler.END
 
     async def show_order_preview(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает предпросмотр заказа"""
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('preview')
-        context.user_data['stage'] = 'preview'
+        self._enter_step(context, 'preview')
 
         # Формируем текст предпросмотра
+        draft = self._draft(context)
         preview_text = MESSAGES['order_preview'] + "\n\n"
         
-        if context.user_data.get('product') == "Нестандартный заказ":
+        if draft.product == "Нестандартный заказ":
             preview_text += f"Тип заказа: Нестандартный\n"
-            preview_text += f"Описание: {context.user_data.get('custom_description', 'Не указано')}\n"
-            if 'custom_photo_id' in context.user_data:
+            preview_text += f"Описание: {draft.custom_description or 'Не указано'}\n"
+            if draft.custom_photos:
                 preview_text += "Фотографии: Прикреплены\n"
         else:
-            preview_text += f"Продукт: {context.user_data.get('product', 'Не указан')}\n"
-            if context.user_data.get('product') == "Сумка":
-                preview_text += f"Размер: {context.user_data.get('size', 'Не указан')}\n"
-                preview_text += f"Форма: {context.user_data.get('shape', 'Не указана')}\n"
+            preview_text += f"Продукт: {draft.product or 'Не указан'}\n"
+            if draft.product == "Сумка":
+                preview_text += f"Размер: {draft.size or 'Не указан'}\n"
+                preview_text += f"Форма: {draft.shape or 'Не указана'}\n"
             preview_text += (
-                f"Материал бусин: {context.user_data.get('material', 'Не указан')}\n"
-                f"Цвет: {context.user_data.get('color', 'Не указан')}\n"
-                f"Дополнительные опции: {', '.join(context.user_data.get('options', ['Не указаны']))}\n"
+                f"Материал бусин: {draft.material or 'Не указан'}\n"
+                f"Цвет: {draft.color or 'Не указан'}\n"
+                f"Дополнительные опции: {', '.join(draft.options or ['Не указаны'])}\n"
             )
 
         # Создаем клавиатуру для подтверждения/отмены
@@ -100,78 +190,30 @@ class SumkiBot:
 
         if query.data == "confirm_order":
             await query.message.reply_text(MESSAGES['request_contact'])
-            keyboard = ReplyKeyboardMarkup([[KeyboardButton("Поделиться контактом", request_contact=True)]], resize_keyboard=True)
-            await query.message.reply_text(MESSAGES['contact_button'], reply_markup=keyboard)
-            context.user_data['stage'] = 'contact'
+            await query.message.reply_text(MESSAGES['contact_button'], reply_markup=keyboard_for('contact'))
+            self._enter_step(context, 'contact')
         elif query.data == "cancel_order":
             await self.cancel_order(update, context)
 
     async def choose_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_product')
-        context.user_data['stage'] = 'choose_product'
-        keyboard = ReplyKeyboardMarkup([
-            ["Сумка", "Подстаканник"],
-            ["Нестандартный заказ"]
-        ], resize_keyboard=True)
-        await update.message.reply_text("Какой продукт вы хотите заказать?", reply_markup=keyboard)
+        self._enter_step(context, 'choose_product')
+        await update.message.reply_text("Какой продукт вы хотите заказать?", reply_markup=keyboard_for('choose_product'))
 
     async def choose_bag_size(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_size')
-        context.user_data['stage'] = 'choose_size'
-        keyboard = ReplyKeyboardMarkup([
-            ["S (микросумка)"], 
-            ["M (влезает телефон и картхолдер)"],
-            ["L (на 5 см больше размера M)"],
-            ["Назад"]
-        ], resize_keyboard=True)
-        await update.message.reply_text("Пожалуйста, выберите размер сумки:", reply_markup=keyboard)
+        self._enter_step(context, 'choose_size')
+        await update.message.reply_text("Пожалуйста, выберите размер сумки:", reply_markup=keyboard_for('choose_size'))
 
     async def choose_bag_shape(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_shape')
-        context.user_data['stage'] = 'choose_shape'
-        keyboard = ReplyKeyboardMarkup([
-            ["Круглая", "Прямоугольная"],
-            ["Трапеция", "Квадратная"],
-            ["Месяц", "Сердце"],
-            ["Назад"]
-        ], resize_keyboard=True)
-        
-        # Отправка фотографий
-        photo_files = {
-            "Круглая": "/Users/tumowuh/Desktop/Telebot/bag_shapes/krug.jpeg",
-            "Прямоугольная": "/Users/tumowuh/Desktop/Telebot/bag_shapes/pramougolnaya.jpeg",
-            "Трапеция": "/Users/tumowuh/Desktop/Telebot/bag_shapes/trapeciya.jpeg",
-            "Квадратная": "/Users/tumowuh/Desktop/Telebot/bag_shapes/kvadrat.jpeg",
-            "Месяц": "/Users/tumowuh/Desktop/Telebot/bag_shapes/mesyac.jpeg",
-            "Сердце": "/Users/tumowuh/Desktop/Telebot/bag_shapes/serdce.jpeg"
-        }
-        
-        # Подготовка медиа-группы
+        self._enter_step(context, 'choose_shape')
+        # Отправляем медиагруппу; повторно фото уходят по file_id без загрузки
         success = False
-        media_group = []
         try:
-            for shape_name, photo_path in photo_files.items():
-                if os.path.exists(photo_path):
-                    try:
-                        with open(photo_path, 'rb') as photo_file:
-                            photo_bytes = photo_file.read()
-                            media_group.append(InputMediaPhoto(media=photo_bytes, caption=shape_name))
-                            logger.info(f"Фото {shape_name} успешно добавлено в медиагруппу")
-                    except Exception as e:
-                        logger.error(f"Ошибка при открытии или чтении файла {photo_path}: {e}")
-                else:
-                    logger.error(f"Файл не найден: {photo_path}")
-            
-            if media_group:
-                await context.bot.send_media_group(chat_id=user_id, media=media_group)
-                success = True
+            success = await self.media_cache.send_album(
+                context.bot, user_id, [(self.catalog.get(key), shape_name) for shape_name, key in SHAPE_PHOTOS.items()]
+            )
+            if success:
                 logger.info("Медиагруппа форм успешно отправлена")
-            else:
-                logger.error("Не удалось подготовить ни одной фотографии форм.")
-                
         except Exception as e:
             logger.error(f"Ошибка при подготовке или отправке медиагруппы форм: {e}")
 
@@ -179,41 +221,15 @@ class SumkiBot:
         await update.message.reply_text(
             "Выберите форму сумки:\n\n" + 
             ("Фотографии доступных форм отправлены выше." if success else "К сожалению, не удалось отобразить фотографии форм."), 
-            reply_markup=keyboard
+            reply_markup=keyboard_for('choose_shape')
         )
 
     async def choose_bag_material(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_material')
-        context.user_data['stage'] = 'choose_material'
-        keyboard = ReplyKeyboardMarkup([
-            ["Акрил"],
-            ["Хрусталь", "Swarovski"],
-            ["Назад"]
-        ], resize_keyboard=True)
-        
-        # Отправка фотографий
-        photos = [
-            "/Users/tumowuh/Desktop/Telebot/akril.jpeg",
-            "/Users/tumowuh/Desktop/Telebot/hrust.jpeg",
-            "/Users/tumowuh/Desktop/Telebot/swarovski.jpeg"
-        ]
-        
-        media_group = []
+        self._enter_step(context, 'choose_material')
+        # Отправка фотографий (из каталога в памяти, повторно - по file_id)
         try:
-            for photo_path in photos:
-                if os.path.exists(photo_path):
-                    try:
-                        with open(photo_path, 'rb') as photo_file:
-                            photo_bytes = photo_file.read()
-                            media_group.append(InputMediaPhoto(media=photo_bytes))
-                    except Exception as e:
-                        logger.error(f"Ошибка при открытии или чтении файла материала {photo_path}: {e}")
-                else:
-                    logger.error(f"Файл материала не найден: {photo_path}")
-            
-            if media_group:
-                await context.bot.send_media_group(chat_id=user_id, media=media_group)
+            if await self.media_cache.send_album(context.bot, user_id, [(self.catalog.get(key), None) for key in MATERIAL_PHOTOS.values()]):
                 logger.info("Медиагруппа материалов успешно отправлена")
             else:
                 await update.message.reply_text("Не удалось найти фотографии материалов для отображения.")
@@ -226,58 +242,30 @@ class SumkiBot:
             logger.error(f"Общая ошибка при обработке фотографий материалов: {e}")
             await update.message.reply_text("Произошла неизвестная ошибка при показе фотографий материалов.")
         
-        await update.message.reply_text("Выберите материал бусин:", reply_markup=keyboard)
+        await update.message.reply_text("Выберите материал бусин:", reply_markup=keyboard_for('choose_material'))
 
     async def choose_bag_color(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_color')
-        context.user_data['stage'] = 'choose_color'
-        keyboard = ReplyKeyboardMarkup([
-            ["Белый", "Чёрный"],
-            ["Синий", "Зелёный"],
-            ["Назад"]
-        ], resize_keyboard=True)
-        await update.message.reply_text("Выберите цвет сумки:", reply_markup=keyboard)
+        self._enter_step(context, 'choose_color')
+        await update.message.reply_text("Выберите цвет сумки:", reply_markup=keyboard_for('choose_color'))
 
     async def choose_options(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('choose_options')
-        context.user_data['stage'] = 'choose_options'
-        
-        product = context.user_data.get('product')
-        if product == "Сумка":
-            keyboard = ReplyKeyboardMarkup([
-                ["Застёжка", "Подклад"],
-                ["Ручка-цепочка"],
-                ["Назад", "Завершить выбор"]
-            ], resize_keyboard=True)
-        elif product == "Подстаканник":
-            keyboard = ReplyKeyboardMarkup([
-                ["Короткая ручка", "Ручка-цепочка"],
-                ["Назад", "Завершить выбор"]
-            ], resize_keyboard=True)
-        else:
-            keyboard = ReplyKeyboardMarkup([
-                ["Назад", "Завершить выбор"]
-            ], resize_keyboard=True)
-        
-        await update.message.reply_text("Выберите дополнительные опции:", reply_markup=keyboard)
+        self._enter_step(context, 'choose_options')
+        await update.message.reply_text("Выберите дополнительные опции:",
+                                        reply_markup=keyboard_for('choose_options', self._draft(context).product))
 
     async def check_text_content(self, text):
         """Проверяет текст на наличие непристойного содержания"""
         try:
-            # Проверяем текст на непристойности
-            return not profanity.contains_profanity(text)
+            # Длинные тексты проверяются в пуле, чтобы не блокировать цикл событий
+            return await self.moderator.is_acceptable(text)
         except Exception as e:
             logger.error(f"Ошибка при проверке текста: {e}")
             return True  # В случае ошибки пропускаем проверку
 
     async def handle_custom_order(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('custom_order')
-        context.user_data['stage'] = 'custom_order'
-        context.user_data['product'] = "Нестандартный заказ"
-        keyboard = ReplyKeyboardMarkup([["Назад"]], resize_keyboard=True)
+        self._enter_step(context, 'custom_order')
+        self._draft(context).product = "Нестандартный заказ"
+        keyboard = keyboard_for('custom_order')
         await update.message.reply_text(
             "Пожалуйста, опишите ваш заказ в свободной форме. "
             "Вы можете приложить фото-пример на следующем шаге, если он у вас есть. "
@@ -298,12 +286,12 @@ class SumkiBot:
                 await update.message.reply_text(
                     "Извините, но ваше сообщение содержит неприемлемый контент. "
                     "Пожалуйста, переформулируйте ваш запрос.",
-                    reply_markup=ReplyKeyboardMarkup([["Назад"]], resize_keyboard=True)
+                    reply_markup=keyboard_for('custom_order')
                 )
                 return
 
-            context.user_data['custom_description'] = update.message.text
-            keyboard = ReplyKeyboardMarkup([["Завершить описание", "Назад"]], resize_keyboard=True)
+            self._draft(context).custom_description = update.message.text
+            keyboard = keyboard_for('custom_order_saved')
             await update.message.reply_text(
                 "Описание сохранено. Вы можете добавить фото или завершить описание.",
                 reply_markup=keyboard
@@ -321,16 +309,14 @@ class SumkiBot:
             return
 
         # Проверяем количество фото
-        photos = context.user_data.get('custom_photos', [])
+        photos = self._draft(context).custom_photos
         if len(photos) >= MAX_PHOTOS_PER_ORDER:
             await update.message.reply_text(MESSAGES['error_photo_count'])
             return
 
         photos.append(photo.file_id)
-        context.user_data['custom_photos'] = photos
-        context.user_data['custom_photo_id'] = photo.file_id
 
-        keyboard = ReplyKeyboardMarkup([["Завершить описание", "Назад"]], resize_keyboard=True)
+        keyboard = keyboard_for('custom_order_saved')
         await update.message.reply_text(
             f"Фото сохранено ({len(photos)}/{MAX_PHOTOS_PER_ORDER}). Вы можете добавить ещё фото или завершить описание.",
             reply_markup=keyboard
@@ -340,136 +326,129 @@ class SumkiBot:
         stage = context.user_data.get('stage', 'start')
         user_input = update.message.text
 
-        if user_input == "Назад":
+        if user_input == BUTTON_BACK:
             await self.go_back(update, context)
             return
 
-        if user_input == "Отменить заказ":
+        if user_input == BUTTON_CANCEL:
             await self.cancel_order(update, context)
             return
 
-        if stage == 'start' and user_input == "Оформить заказ":
+        handler = self.input_handlers.get(stage)
+        if handler:
+            await handler(update, context, stage, user_input)
+
+    async def _advance(self, update: Update, context: ContextTypes.DEFAULT_TYPE, stage: str):
+        """Показывает следующий шаг маршрута выбранного продукта"""
+        step = next_step(self._draft(context).product, stage)
+        if step:
+            await self.step_handlers[step](update, context)
+
+    async def _on_start_input(self, update, context, stage, user_input):
+        if user_input == BUTTON_START_ORDER:
             await self.choose_product(update, context)
-        elif stage == 'choose_product':
-            if user_input == "Нестандартный заказ":
-                await self.handle_custom_order(update, context)
-            else:
-                context.user_data['product'] = user_input
-                if user_input == "Сумка":
-                    await self.choose_bag_size(update, context)
-                elif user_input == "Подстаканник":
-                    await self.choose_bag_material(update, context)
-        elif stage == 'custom_order':
-            if update.message.photo:
-                await self.handle_custom_order_photo(update, context)
-            else:
-                await self.handle_custom_order_description(update, context)
-        elif stage == 'choose_size':
-            context.user_data['size'] = user_input
-            await self.choose_bag_shape(update, context)
-        elif stage == 'choose_shape':
-            context.user_data['shape'] = user_input
-            await self.choose_bag_material(update, context)
-        elif stage == 'choose_material':
-            context.user_data['material'] = user_input
-            await self.choose_bag_color(update, context)
-        elif stage == 'choose_color':
-            context.user_data['color'] = user_input
-            await self.choose_options(update, context)
-        elif stage == 'choose_options':
-            if user_input == "Завершить выбор":
-                await self.show_order_preview(update, context)
-            else:
-                # Обработка дополнительных опций только на этапе выбора опций
-                options = context.user_data.get('options', [])
-                if user_input not in ["Назад", "Завершить выбор"]:  # Проверяем, что это не служебная команда
-                    options.append(user_input)
-                    context.user_data['options'] = options
-                    await update.message.reply_text(f"Опция '{user_input}' добавлена. Выберите ещё или нажмите 'Завершить выбор'.")
+
+    async def _on_product_input(self, update, context, stage, user_input):
+        if user_input in PRODUCT_FLOWS:
+            self._draft(context).product = user_input
+            await self._advance(update, context, stage)
+
+    async def _on_custom_order_input(self, update, context, stage, user_input):
+        # Сюда приходит только текст: фото обрабатывает отдельный обработчик handle_custom_order_photo
+        await self.handle_custom_order_description(update, context)
+
+    async def _on_field_input(self, update, context, stage, user_input):
+        setattr(self._draft(context), STEP_FIELDS[stage], user_input)
+        await self._advance(update, context, stage)
+
+    async def _on_option_input(self, update, context, stage, user_input):
+        if user_input == BUTTON_FINISH_OPTIONS:
+            await self._advance(update, context, stage)
+        else:
+            self._draft(context).options.append(user_input)
+            await update.message.reply_text(f"Опция '{user_input}' добавлена. Выберите ещё или нажмите 'Завершить выбор'.")
 
     async def go_back(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        if user_id in self.state_history and len(self.state_history[user_id]) > 1:
-            # Удаляем текущее состояние
-            self.state_history[user_id].pop()
-            # Получаем предыдущее состояние
-            previous_state = self.state_history[user_id].pop()
-            if previous_state == 'start':
-                await self.start(update, context)
-            elif previous_state == 'choose_product':
-                await self.choose_product(update, context)
-            elif previous_state == 'choose_size':
-                await self.choose_bag_size(update, context)
-            elif previous_state == 'choose_shape':
-                await self.choose_bag_shape(update, context)
-            elif previous_state == 'choose_material':
-                await self.choose_bag_material(update, context)
-            elif previous_state == 'choose_color':
-                await self.choose_bag_color(update, context)
-            elif previous_state == 'choose_options':
-                await self.choose_options(update, context)
-            elif previous_state == 'custom_order':
-                await self.handle_custom_order(update, context)
+        history = self._history(context)
+        if len(history) > 1:
+            # Удаляем текущее состояние; предыдущий шаг добавит себя в историю заново
+            history.pop()
+            previous_state = history.pop()
+            handler = self.step_handlers.get(previous_state)
+            if handler:
+                await handler(update, context)
         else:
             await update.message.reply_text('No previous state found.')
             return ConversationHandler.END
 
     async def request_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.message.from_user.id
-        self.state_history[user_id].append('contact')
-        context.user_data['stage'] = 'contact'
-        keyboard = ReplyKeyboardMarkup([[KeyboardButton("Поделиться контактом", request_contact=True)]], resize_keyboard=True)
-        await update.message.reply_text("Пожалуйста, поделитесь своим контактом, чтобы мы могли с вами связаться.", reply_markup=keyboard)
+        self._enter_step(context, 'contact')
+        await update.message.reply_text("Пожалуйста, поделитесь своим контактом, чтобы мы могли с вами связаться.",
+                                        reply_markup=keyboard_for('contact'))
 
     async def contact_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         contact = update.message.contact
-        context.user_data['contact'] = contact.phone_number
+        if not self._draft(context).product:
+            # Повторное нажатие "Поделиться контактом" после отправки заказа: черновик уже очищен
+            logger.info(f"Контакт от пользователя {update.effective_user.id} без незавершенного заказа")
+            await update.message.reply_text(MESSAGES['order_already_sent'], reply_markup=keyboard_for('cancelled'))
+            return
+        self._draft(context).contact = contact.phone_number
         await update.message.reply_text("Благодарим за заказ!", reply_markup=ReplyKeyboardRemove())
         await self.send_order(update, context)
 
     async def send_order(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if context.user_data.get('product') == "Нестандартный заказ":
+        draft = self._draft(context)
+        if draft.product == "Нестандартный заказ":
             order = (
                 f"Нестандартный заказ от {update.effective_user.username}:\n"
-                f"Описание: {context.user_data.get('custom_description', 'Не указано')}\n"
+                f"Описание: {draft.custom_description or 'Не указано'}\n"
             )
-            if 'custom_photo_id' in context.user_data:
+            if draft.custom_photos:
                 order += "Фотография прикреплена\n"
         else:
             order = (
                 f"Заказ от {update.effective_user.username}:\n"
-                f"Продукт: {context.user_data.get('product', 'Не указан')}\n"
+                f"Продукт: {draft.product or 'Не указан'}\n"
             )
-            if context.user_data.get('product') == "Сумка":
-                order += f"Размер: {context.user_data.get('size', 'Не указан')}\n"
-                order += f"Форма: {context.user_data.get('shape', 'Не указана')}\n"
+            if draft.product == "Сумка":
+                order += f"Размер: {draft.size or 'Не указан'}\n"
+                order += f"Форма: {draft.shape or 'Не указана'}\n"
             order += (
-                f"Материал бусин: {context.user_data.get('material', 'Не указан')}\n"
-                f"Цвет: {context.user_data.get('color', 'Не указан')}\n"
-                f"Дополнительные опции: {', '.join(context.user_data.get('options', ['Не указаны']))}"
+                f"Материал бусин: {draft.material or 'Не указан'}\n"
+                f"Цвет: {draft.color or 'Не указан'}\n"
+                f"Дополнительные опции: {', '.join(draft.options or ['Не указаны'])}"
             )
         
-        # Сохраняем заказ в базу данных
-        order_id = await self.db.add_order(
-            update.effective_user.id,
-            update.effective_user.username,
-            context.user_data
-        )
+        # Сохраняем заказ в базу данных; повторная доставка сообщения с контактом не создает новый заказ,
+        # а новый заказ с тем же содержимым - создает
+        key = message_idempotency_key('wizard', update.effective_user.id, update.effective_message.message_id)
+        try:
+            order_id = await self.db.add_order(
+                update.effective_user.id,
+                update.effective_user.username,
+                draft,
+                idempotency_key=key
+            )
+        except DuplicateOrderError as e:
+            logger.info(f"Повтор заказа #{e.order_id} от пользователя {update.effective_user.id} пропущен")
+            await context.bot.send_message(chat_id=update.effective_user.id, text=MESSAGES['order_already_sent'],
+                                           reply_markup=keyboard_for('cancelled'))
+            context.user_data.clear()
+            context.user_data['stage'] = 'start'
+            return
         
         if order_id:
+            metrics.inc('orders_created_total', source='wizard')
             order = f"Заказ #{order_id}\n{order}"
         
         # Отправляем сообщение с заказом в личный чат продавца
-        contact = context.user_data.get('contact', 'Не указан')
+        contact = draft.contact or 'Не указан'
         order_with_contact = f"{order}\nКонтакт: {contact}"
         
         try:
-            await self.send_telegram_message(order_with_contact, SELLER_CHAT_ID)
-            
-            # Если есть фотографии, отправляем их отдельно
-            if 'custom_photos' in context.user_data:
-                for photo_id in context.user_data['custom_photos']:
-                    await context.bot.send_photo(chat_id=SELLER_CHAT_ID, photo=photo_id)
+            # Текст и фотографии заказа уходят продавцу одной медиагруппой
+            await self.send_order_to_seller(order_with_contact, draft.custom_photos)
             
             # Отправляем сообщение с благодарностью
             chat_id = update.effective_user.id
@@ -477,8 +456,8 @@ class SumkiBot:
             logger.info(f"Заказ #{order_id} успешно отправлен")
             
             # Отправляем сообщение о возможности оформить дополнительный заказ
-            keyboard = ReplyKeyboardMarkup([["Оформить заказ"]], resize_keyboard=True)
-            await context.bot.send_message(chat_id=chat_id, text="Для оформления дополнительного заказа нажмите на кнопку ниже:", reply_markup=keyboard)
+            await context.bot.send_message(chat_id=chat_id, text="Для оформления дополнительного заказа нажмите на кнопку ниже:",
+                                           reply_markup=keyboard_for('cancelled'))
             
         except Exception as e:
             logger.error(f"Ошибка при отправке заказа: {e}")
@@ -488,30 +467,67 @@ class SumkiBot:
         context.user_data.clear()
         context.user_data['stage'] = 'start'
 
-    async def send_telegram_message(self, message, chat_id):
-        """Отправляет сообщение в Telegram чат с повторными попытками"""
-        max_retries = 3
-        retry_delay = 2  # секунды
-        
-        for attempt in range(max_retries):
+    async def send_order_to_seller(self, order_text, photo_ids):
+        """Отправляет продавцу заказ вместе с фотографиями за один-два вызова Bot API.
+
+        Фото уходят одной медиагруппой с текстом заказа в подписи первого фото
+        (одно фото - через send_photo). Если текст длиннее лимита подписи, он
+        отправляется отдельным сообщением перед группой. Если группу отправить
+        не удалось, текст и фото отправляются по отдельности.
+        """
+        photo_ids = list(photo_ids or [])[:10]  # в медиагруппе не больше 10 элементов
+        if not photo_ids:
+            return await self.send_telegram_message(order_text, SELLER_CHAT_ID)
+
+        caption = order_text if len(order_text) <= MAX_CAPTION_LENGTH else None
+        text_sent = False
+        try:
+            if caption is None:
+                text_sent = await self.send_telegram_message(order_text, SELLER_CHAT_ID)
+            if len(photo_ids) == 1:
+                await send_with_retry(
+                    lambda: self.bot.send_photo(chat_id=SELLER_CHAT_ID, photo=photo_ids[0], caption=caption,
+                                                rate_limit_args=PRIORITY_SELLER),
+                    "Отправка фото заказа продавцу"
+                )
+            else:
+                media = [InputMediaPhoto(media=photo_ids[0], caption=caption)]
+                media.extend(InputMediaPhoto(media=photo_id) for photo_id in photo_ids[1:])
+                await send_with_retry(
+                    lambda: self.bot.send_media_group(chat_id=SELLER_CHAT_ID, media=media, rate_limit_args=PRIORITY_SELLER),
+                    "Отправка медиагруппы заказа продавцу"
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Не удалось отправить заказ продавцу медиагруппой, отправляем по отдельности: {e}")
+
+        if not text_sent and not await self.send_telegram_message(order_text, SELLER_CHAT_ID):
+            return False
+        sent_all = True
+        for photo_id in photo_ids:
             try:
-                await Bot(BOT_TOKEN).send_message(chat_id=chat_id, text=message)
-                logger.info(f"Сообщение успешно отправлено в чат {chat_id}")
-                return True
-            except TimedOut:
-                logger.warning(f"Тайм-аут при отправке сообщения (попытка {attempt+1}/{max_retries})")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-            except NetworkError as e:
-                logger.warning(f"Сетевая ошибка при отправке сообщения (попытка {attempt+1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
+                await send_with_retry(
+                    lambda photo_id=photo_id: self.bot.send_photo(chat_id=SELLER_CHAT_ID, photo=photo_id,
+                                                               rate_limit_args=PRIORITY_SELLER),
+                    "Отправка фото заказа продавцу"
+                )
             except Exception as e:
-                logger.error(f"Неизвестная ошибка при отправке сообщения: {e}")
-                break
-        
-        logger.error(f"Не удалось отправить сообщение после {max_retries} попыток")
-        return False
+                logger.error(f"Не удалось отправить фото {photo_id} продавцу: {e}")
+                sent_all = False
+        return sent_all
+
+    async def send_telegram_message(self, message, chat_id):
+        """Отправляет уведомление продавцу в чат chat_id с повторными попытками через общий бот приложения"""
+        try:
+            await send_with_retry(
+                lambda: self.bot.send_message(chat_id=chat_id, text=message, rate_limit_args=PRIORITY_SELLER),
+                f"Отправка сообщения в чат {chat_id}"
+            )
+            logger.info(f"Сообщение успешно отправлено в чат {chat_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+            return False
 
     # Обработчик ошибок
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -529,17 +545,10 @@ class SumkiBot:
 
     def is_admin(self, user_id):
         """Проверяет, является ли пользователь администратором"""
-        user_id_str = str(user_id)
-        logger.info(f"Проверка администратора. Запрашиваемый ID: {user_id_str}")
-        logger.info(f"Список админов: {ADMIN_IDS}")
-        
         # Сравниваем строки (не числа)
-        if user_id_str in ADMIN_IDS:
-            logger.info(f"ID {user_id_str} найден в списке администраторов")
-            return True
-        else:
-            logger.info(f"ID {user_id_str} НЕ найден в списке администраторов")
-            return False
+        is_admin = str(user_id) in ADMIN_IDS
+        logger.debug("Проверка администратора %s: %s", user_id, is_admin)
+        return is_admin
 
     async def admin_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает справку по админ-командам"""
@@ -554,41 +563,252 @@ class SumkiBot:
         logger.info(f"Доступ разрешен для ID: {user_id}")
         await update.message.reply_text(MESSAGES['admin_help'])
 
+    def _format_order_summary(self, order):
+        """Форматирует один заказ для списка /orders"""
+        text = f"Заказ #{order['id']}\n"
+        text += f"Дата: {order['order_date']}\n"
+        text += f"Клиент: {order['username']}\n"
+        text += f"Статус: {order['status']}\n"
+        text += f"Тип: {order['product_type']}\n"
+        if order['product_type'] == "Сумка":
+            text += f"Размер: {order['size']}\n"
+            text += f"Форма: {order['shape']}\n"
+        text += f"Материал: {order['material']}\n"
+        text += f"Цвет: {order['color']}\n"
+        text += f"Опции: {order['options']}\n"
+        if order['custom_description']:
+            description = order['custom_description']
+            if len(description) > 300:
+                description = description[:300] + "…"
+            text += f"Описание: {description}\n"
+        text += f"Контакт: {order['contact']}\n"
+        if order['notes']:
+            text += f"Заметки: {order['notes'][-300:]}\n"
+        return text + "-------------------\n"
+
+    async def _render_orders_page(self, direction='f', cursor=None, status=''):
+        """Загружает одну страницу заказов и строит текст и inline-клавиатуру навигации.
+
+        Данные кнопок имеют вид orders:<направление>:<курсор>:<статус>, где
+        направление - f (первая страница), n (старше курсора) или p (новее курсора).
+        """
+        page = await self.db.get_orders_page(
+            limit=ORDERS_PAGE_SIZE,
+            before_id=cursor if direction == 'n' else None,
+            after_id=cursor if direction == 'p' else None,
+            status=status or None,
+        )
+
+        title = f"Заказы со статусом '{status}':" if status else "Список заказов:"
+        if page['orders']:
+            text = title + "\n\n" + "".join(self._format_order_summary(order) for order in page['orders'])
+        else:
+            text = title + "\n\nНет доступных заказов."
+        # Лимит Telegram на текст сообщения - 4096 символов
+        if len(text) > 4000:
+            text = text[:4000] + "…"
+
+        rows = []
+        nav = []
+        if page['prev_cursor'] is not None:
+            nav.append(InlineKeyboardButton("« Новее", callback_data=f"orders:p:{page['prev_cursor']}:{status}"))
+        if page['next_cursor'] is not None:
+            nav.append(InlineKeyboardButton("Старее »", callback_data=f"orders:n:{page['next_cursor']}:{status}"))
+        if nav:
+            rows.append(nav)
+
+        filters_row = []
+        for value, label in [('', 'Все')] + [(s, s) for s in ORDER_STATUS_FILTERS]:
+            mark = "• " if value == status else ""
+            filters_row.append(InlineKeyboardButton(f"{mark}{label}", callback_data=f"orders:f:0:{value}"))
+        # Не больше трех кнопок фильтра в ряд, чтобы подписи не обрезались
+        rows.extend(filters_row[i:i + 3] for i in range(0, len(filters_row), 3))
+
+        return text, InlineKeyboardMarkup(rows)
+
     async def admin_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показывает список всех заказов"""
+        """Показывает первую страницу заказов (/orders [статус])"""
         if not self.is_admin(update.effective_user.id):
             await update.message.reply_text(MESSAGES['access_denied'])
             return
 
-        orders = await self.db.get_all_orders()
-        if not orders:
-            await update.message.reply_text("Нет доступных заказов.")
+        status = context.args[0] if context.args else ''
+        # callback_data ограничена 64 байтами
+        if len(f"orders:p:{2**63}:{status}".encode('utf-8')) > 64:
+            await update.message.reply_text("Слишком длинный статус для фильтра.")
+            return
+
+        text, keyboard = await self._render_orders_page(status=status)
+        await update.message.reply_text(text, reply_markup=keyboard)
+
+    async def admin_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгружает заказы одним файлом (/export [с] [по] [статус] [csv|jsonl])"""
+        if not self.is_admin(update.effective_user.id):
+            await update.message.reply_text(MESSAGES['access_denied'])
             return
 
-        message = "Список заказов:\n\n"
-        for order in orders:
-            message += f"Заказ #{order['id']}\n"
-            message += f"Дата: {order['order_date']}\n"
-            message += f"Клиент: {order['username']}\n"
-            message += f"Статус: {order['status']}\n"
-            message += f"Тип: {order['product_type']}\n"
-            if order['product_type'] == "Сумка":
-                message += f"Размер: {order['size']}\n"
-                message += f"Форма: {order['shape']}\n"
-            message += f"Материал: {order['material']}\n"
-            message += f"Цвет: {order['color']}\n"
-            message += f"Опции: {order['options']}\n"
-            if order['custom_description']:
-                message += f"Описание: {order['custom_description']}\n"
-            message += f"Контакт: {order['contact']}\n"
-            if order['notes']:
-                message += f"Заметки: {order['notes']}\n"
-            message += "-------------------\n"
-
-        # Разбиваем сообщение на части, если оно слишком длинное
-        max_length = 4000
-        for i in range(0, len(message), max_length):
-            await update.message.reply_text(message[i:i + max_length])
+        try:
+            date_from, date_to, status, export_format = parse_export_args(context.args or [], ORDER_STATUS_FILTERS)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{e}.\nИспользование: /export [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД] [статус] [csv|jsonl]")
+            return
+
+        filename = export_filename(date_from, date_to, status, export_format)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, filename)
+            started = time.perf_counter()
+            # Заказы читаются курсором и пишутся в файл пачками, весь список в памяти не собирается
+            count = await export_orders(self.db.iter_orders(date_from, date_to, status), path, export_format)
+            size = os.path.getsize(path)
+            logger.info(f"Выгрузка {filename}: {count} заказов, {size} байт за {time.perf_counter() - started:.2f} с")
+
+            if count == 0:
+                await update.message.reply_text("Нет заказов для выгрузки с такими условиями.")
+                return
+            if size > EXPORT_MAX_DOCUMENT_SIZE:
+                await update.message.reply_text(
+                    f"Файл выгрузки ({size // (1024 * 1024)} МБ) больше лимита Telegram. "
+                    "Сузьте период или выберите формат jsonl (сжатый).")
+                return
+            await send_with_retry(
+                lambda: context.bot.send_document(chat_id=update.effective_chat.id, document=Path(path),
+                                                  filename=filename, caption=f"Заказов: {count}",
+                                                  rate_limit_args=PRIORITY_ADMIN),
+                "Отправка выгрузки заказов"
+            )
+
+    async def _render_search_page(self, query: str, offset: int = 0):
+        """Ищет заказы и строит текст страницы результатов и кнопки навигации (find:<смещение>)"""
+        page = await self.db.search_orders(build_match_query(query), limit=ORDERS_PAGE_SIZE, offset=offset)
+
+        title = f"Поиск «{query}»"
+        if page['orders']:
+            text = f"{title}, результаты {offset + 1}-{offset + len(page['orders'])}:\n\n"
+            for order in page['orders']:
+                summary = self._format_order_summary(order)
+                separator = "-------------------\n"
+                text += summary.removesuffix(separator) + f"Совпадение: {page['snippets'][order.id]}\n" + separator
+        else:
+            text = f"{title}: ничего не найдено."
+        progress = await self.db.search_backfill_progress()
+        if progress:
+            text += f"\nИндекс поиска еще заполняется (готово до заказа #{progress[0] - 1} из #{progress[1]})."
+        if len(text) > 4000:
+            text = text[:4000] + "…"
+
+        nav = []
+        if offset > 0:
+            nav.append(InlineKeyboardButton("« Назад", callback_data=f"find:{max(0, offset - ORDERS_PAGE_SIZE)}"))
+        if page['has_more']:
+            nav.append(InlineKeyboardButton("Дальше »", callback_data=f"find:{offset + ORDERS_PAGE_SIZE}"))
+        return text, InlineKeyboardMarkup([nav]) if nav else None
+
+    async def admin_find(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ищет заказы по описанию, контакту, имени пользователя и заметкам (/find <запрос>)"""
+        if not self.is_admin(update.effective_user.id):
+            await update.message.reply_text(MESSAGES['access_denied'])
+            return
+
+        query = ' '.join(context.args or [])
+        try:
+            text, keyboard = await self._render_search_page(query)
+        except ValueError as e:
+            await update.message.reply_text(f"{e}.\nИспользование: /find <текст, телефон или имя>")
+            return
+        # Запрос слишком длинный для callback_data (64 байта), поэтому кнопки страниц берут его из user_data
+        context.user_data['find_query'] = query
+        await update.message.reply_text(text, reply_markup=keyboard)
+
+    async def handle_find_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Листает страницы результатов /find, редактируя то же сообщение"""
+        query = update.callback_query
+        if not self.is_admin(update.effective_user.id):
+            await query.answer(MESSAGES['access_denied'], show_alert=True)
+            return
+
+        search_query = context.user_data.get('find_query')
+        try:
+            offset = int(query.data.split(':', 1)[1])
+        except ValueError:
+            await query.answer("Некорректные данные кнопки.")
+            return
+        if not search_query:
+            await query.answer("Поиск устарел, повторите /find.", show_alert=True)
+            return
+
+        await query.answer()
+        text, keyboard = await self._render_search_page(search_query, offset)
+        try:
+            await query.edit_message_text(text, reply_markup=keyboard)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def handle_orders_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Листает страницы /orders и меняет фильтр, редактируя то же сообщение"""
+        query = update.callback_query
+        if not self.is_admin(update.effective_user.id):
+            await query.answer(MESSAGES['access_denied'], show_alert=True)
+            return
+
+        try:
+            _, direction, cursor, status = query.data.split(':', 3)
+            cursor = int(cursor)
+        except ValueError:
+            await query.answer("Некорректные данные кнопки.")
+            return
+
+        await query.answer()
+        text, keyboard = await self._render_orders_page(direction, cursor, status)
+        try:
+            await query.edit_message_text(text, reply_markup=keyboard)
+        except BadRequest as e:
+            # Повторное нажатие на ту же кнопку - содержимое не изменилось
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def admin_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает сводку заказов за период (/stats [дней | all | с [по]] [статус] [изделие])
+
+        Читает только таблицу order_stats, которую поддерживают триггеры,
+        поэтому время ответа не зависит от количества заказов.
+        """
+        if not self.is_admin(update.effective_user.id):
+            await update.message.reply_text(MESSAGES['access_denied'])
+            return
+
+        try:
+            query = parse_stats_args(context.args or [], ORDER_STATUS_FILTERS, product_mapping)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{e}.\nИспользование: /stats [дней | all | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [статус] [{'|'.join(product_mapping)}]")
+            return
+
+        rows = await self.db.get_order_stats(query.date_from, query.date_to, query.status, query.product_type)
+        await update.message.reply_text(format_order_stats(rows, query))
+
+    async def admin_stats_rebuild(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пересчитывает сводку заказов с нуля (/stats_rebuild)"""
+        if not self.is_admin(update.effective_user.id):
+            await update.message.reply_text(MESSAGES['access_denied'])
+            return
+
+        started = time.perf_counter()
+        count = await self.db.rebuild_order_stats()
+        await update.message.reply_text(
+            f"Сводка заказов пересчитана: {count} строк за {time.perf_counter() - started:.2f} с")
+
+    async def admin_metrics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает задержки обработчиков, базы и Bot API и счетчики (/metrics)"""
+        if not self.is_admin(update.effective_user.id):
+            await update.message.reply_text(MESSAGES['access_denied'])
+            return
+
+        text = metrics.summary()
+        if len(text) > 4000:
+            text = text[:4000] + "…"
+        await update.message.reply_text(text)
 
     async def admin_order_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обновляет статус заказа"""
@@ -617,7 +837,8 @@ class SumkiBot:
             order_id = int(context.args[0])
             note = ' '.join(context.args[1:])
             
-            if await self.db.add_order_note(order_id, note):
+            user = update.effective_user
+            if await self.db.add_order_note(order_id, note, author=user.username or str(user.id)):
                 await update.message.reply_text(f"Заметка добавлена к заказу #{order_id}")
             else:
                 await update.message.reply_text(f"Не удалось добавить заметку к заказу #{order_id}")
@@ -638,144 +859,189 @@ class SumkiBot:
         )
 
     async def handle_webapp_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """(УПРОЩЕННАЯ ВЕРСИЯ 2) Обрабатывает данные, полученные из веб-приложения или любое другое сообщение в ЛС"""
-        # --- Логируем вход и сам объект Update --- 
-        logging.info("!!!!!! ++++++ ВХОД В handle_webapp_data (упрощенный 2) ++++++ !!!!!!")
-        print("!!!!!! ++++++ ВХОД В handle_webapp_data (упрощенный 2) ++++++ !!!!!!") 
+        """Создает заказ из данных Mini App: разбор и проверка по схеме, запись в базу, уведомление продавца"""
+        message = update.effective_message
+        user = update.effective_user
+        if not message or not message.web_app_data:
+            logger.info("handle_webapp_data: нет web_app_data в сообщении")
+            return
+        raw = message.web_app_data.data
+        logger.info("handle_webapp_data: получены данные от пользователя %s (%s байт)", user.id, len(raw))
+        logger.debug("handle_webapp_data: данные %s", raw)
+
         try:
-            logging.info(f"!!!!!! handle_webapp_data: UPDATE: {repr(update)} !!!!!!")
-            print(f"!!!!!! handle_webapp_data: UPDATE: {repr(update)} !!!!!!")
-            
-            # --- Проверяем и логируем web_app_data, если есть --- 
-            if update.effective_message and hasattr(update.effective_message, 'web_app_data') and update.effective_message.web_app_data:
-                 logging.info(f"!!!!!! handle_webapp_data: RAW DATA: >>>{update.effective_message.web_app_data.data}<<< !!!!!!")
-                 print(f"!!!!!! handle_webapp_data: RAW DATA: >>>{update.effective_message.web_app_data.data}<<< !!!!!!")
-                 # --- УБРАН ТЕСТОВЫЙ ВЫЗОВ add_order({}) --- 
-            else:
-                 logging.info("!!!!!! handle_webapp_data: НЕТ web_app_data в сообщении !!!!!!")
-                 print("!!!!!! handle_webapp_data: НЕТ web_app_data в сообщении !!!!!!")
+            order_data = parse_order(raw)
+        except MiniAppOrderError as e:
+            logger.warning(f"Mini App: отклонены данные заказа от пользователя {user.id}: {e}")
+            metrics.inc('mini_app_rejected_total', reason='invalid')
+            await message.reply_text(MESSAGES['webapp_invalid'], reply_markup=keyboard_for('cancelled'))
+            return
 
-        except Exception as e:
-             logging.error(f"!!!!!! handle_webapp_data: Ошибка в упрощенном обработчике 2: {e} !!!!!!")
-             print(f"!!!!!! handle_webapp_data: Ошибка в упрощенном обработчике 2: {e} !!!!!!")
-             import traceback
-             logging.error(f"!!!!!! handle_webapp_data: Трассировка ошибки 2: {traceback.format_exc()} !!!!!!")
-             
-        # --- КОНЕЦ УПРОЩЕННОЙ ФУНКЦИИ 2 --- 
-
-    # --- ЗАКОММЕНТИРОВАНА СТАРАЯ ФУНКЦИЯ --- 
-    # async def handle_webapp_data_old(...): 
-    #    ... вся старая логика ...
-
-    async def send_message_to_seller(self, order_text, user, context):
-        """Отправка информации о заказе продавцу"""
+        if order_data['custom_description'] and not await self.check_text_content(order_data['custom_description']):
+            metrics.inc('mini_app_rejected_total', reason='moderation')
+            await message.reply_text(
+                "Извините, но описание заказа содержит неприемлемый контент. "
+                "Пожалуйста, переформулируйте его и отправьте заказ снова."
+            )
+            return
+
+        # Mini App может отправить те же данные повторно: одинаковое содержимое в окне - один заказ
+        key, previous_key = idempotency_keys('mini_app', user.id,
+                                             json.dumps(order_data, ensure_ascii=False, sort_keys=True),
+                                             message.date.timestamp(), ORDER_DEDUP_WINDOW)
         try:
-            # ID продавца
-            SELLER_CHAT_ID = "50122963"
-            
-            logging.info(f"Попытка отправки заказа продавцу в чат {SELLER_CHAT_ID}")
-            logging.info(f"Текст заказа для отправки: {order_text}") # Логируем финальный текст
-            
-            # Сначала пробуем отправить простой текст без форматирования
-            try:
-                # --- Первый try для отправки --- 
-                result = await context.bot.send_message(
-                    chat_id=SELLER_CHAT_ID,
-                    text=order_text
-                )
-                logging.info(f"Сообщение продавцу успешно отправлено без форматирования, message_id: {result.message_id}")
-                return # Выходим при успехе
-            except Exception as plain_error:
-                # --- except для первого try --- 
-                logging.error(f"❌ Ошибка отправки продавцу без форматирования: {plain_error}")
-            
-            # Если не удалось, пробуем с Markdown
-            logging.info("Попытка отправки продавцу с MarkdownV2...")
-            try:
-                # --- Второй try для отправки --- 
-                import re
-                escaped_text = re.sub(r'([_*[\]()~`>#+=|{}.!-])', r'\\\1', order_text)
-                
-                result = await context.bot.send_message(
-                    chat_id=SELLER_CHAT_ID,
-                    text=escaped_text,
-                    parse_mode="MarkdownV2"
-                )
-                logging.info(f"Сообщение продавцу успешно отправлено с MarkdownV2, message_id: {result.message_id}")
-                return # Выходим при успехе
-            except Exception as markdown_error:
-                # --- except для второго try --- 
-                logging.error(f"❌ Ошибка отправки продавцу с MarkdownV2: {markdown_error}")
-                
-                # Крайний случай - пробуем отправить только основную информацию
-                logging.info("Попытка отправки базового уведомления продавцу...")
-                try:
-                    # --- Третий try для отправки --- 
-                    basic_text = f"Новый заказ!\n\nОт: {user.first_name} {user.last_name or ''} (@{user.username or 'без username'})\n\nПожалуйста, проверьте логи."
-                    await context.bot.send_message(
-                        chat_id=SELLER_CHAT_ID,
-                        text=basic_text
-                    )
-                    logging.info("Базовое уведомление продавцу успешно отправлено")
-                except Exception as basic_error:
-                    # --- except для третьего try --- 
-                    logging.error(f"❌ Критическая ошибка! Невозможно отправить продавцу даже базовое уведомление: {basic_error}")
+            order_id = await self.db.add_order(user.id, user.username, order_data, idempotency_key=key,
+                                               previous_idempotency_key=previous_key)
+        except DuplicateOrderError as e:
+            logger.info(f"Повтор заказа #{e.order_id} из Mini App от пользователя {user.id} пропущен")
+            await message.reply_text(MESSAGES['order_already_sent'], reply_markup=keyboard_for('cancelled'))
+            return
+        metrics.inc('orders_created_total', source='mini_app')
 
+        order_text = f"Заказ #{order_id}\n{format_order_text(order_data, user.username)}"
+        order_text += f"\nКонтакт: {order_data['contact'] or 'Не указан'}"
+        try:
+            await self.send_order_to_seller(order_text, order_data['custom_photos'])
+            await message.reply_text(MESSAGES['contact_received'], reply_markup=keyboard_for('cancelled'))
+            logger.info(f"Заказ #{order_id} из Mini App успешно отправлен")
         except Exception as e:
-            # --- Глобальный except для всей функции --- 
-            logging.error(f"❌ Критическая ошибка ВНУТРИ send_message_to_seller: {str(e)}")
-            import traceback
-            logging.error(f"❌ Трассировка send_message_to_seller: {traceback.format_exc()}")
+            logger.error(f"Ошибка при отправке заказа #{order_id} из Mini App: {e}")
+            await message.reply_text("Произошла ошибка при отправке заказа. Пожалуйста, попробуйте позже.")
 
-    def main(self):
-        """Запускает бота"""
-        logger.info('Запуск бота...')
+    @staticmethod
+    def _timed_handler(callback):
+        """Оборачивает обработчик, записывая время его выполнения в метрики"""
+        return timed('handler_seconds', handler=callback.__name__)(callback)
+
+    def build_application(self, rate_limiter: Optional[OutboundRateLimiter] = None) -> Application:
+        """Создает Application со всеми обработчиками (используется в main, тестах и бенчмарках).
 
+        Args:
+            rate_limiter: Очередь исходящих сообщений; по умолчанию - с лимитами Telegram.
+        """
         # Создаем ApplicationBuilder
         builder = ApplicationBuilder().token(BOT_TOKEN)\
                 .read_timeout(TIMEOUTS['read'])\
                 .write_timeout(TIMEOUTS['write'])\
                 .connect_timeout(TIMEOUTS['connect'])\
-            .pool_timeout(TIMEOUTS['pool'])
+            .pool_timeout(TIMEOUTS['pool'])\
+            .connection_pool_size(BOT_CONNECTION_POOL_SIZE)\
+            .http_version(BOT_HTTP_VERSION)
+        # Все запросы бота в чаты идут через очередь с ограничением частоты и приоритетами
+        if rate_limiter is None:
+            rate_limiter = OutboundRateLimiter(seller_chat_ids=[SELLER_CHAT_ID, ADMIN_GROUP_ID], admin_chat_ids=ADMIN_IDS)
+        builder.rate_limiter(rate_limiter)
+        # Разные пользователи обрабатываются параллельно, один пользователь - по порядку
+        builder.concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        if BOT_API_BASE_URL:
+            # Локальный Bot API сервер или тестовая заглушка вместо api.telegram.org
+            builder.base_url(f"{BOT_API_BASE_URL}/bot").base_file_url(f"{BOT_API_BASE_URL}/file/bot")
         
         # Добавляем асинхронную инициализацию БД перед построением приложения
         builder.post_init(self.initialize_db)
+        # Закрываем долгоживущие соединения с БД при остановке
+        builder.post_shutdown(self.close_db)
+        builder.persistence(self.persistence)
         
         application = builder.build()
+        self.bot = application.bot
 
-        # Добавляем обработчики команд
-        application.add_handler(CommandHandler("start", self.start))
-        application.add_handler(CommandHandler("help", self.admin_help))
-        application.add_handler(CommandHandler("orders", self.admin_orders))
-        application.add_handler(CommandHandler("status", self.admin_order_status))
-        application.add_handler(CommandHandler("note", self.admin_order_note))
+        # Очередь исходящих сообщений отдает свои показатели в /metrics (HTTP и команда бота)
+        metrics.add_collector('outbound', rate_limiter.snapshot)
+
+        # Добавляем обработчики команд (время каждого попадает в гистограмму handler_seconds)
+        application.add_handler(CommandHandler("start", self._timed_handler(self.start)))
+        application.add_handler(CommandHandler("help", self._timed_handler(self.admin_help)))
+        application.add_handler(CommandHandler("orders", self._timed_handler(self.admin_orders)))
+        application.add_handler(CommandHandler("status", self._timed_handler(self.admin_order_status)))
+        application.add_handler(CommandHandler("note", self._timed_handler(self.admin_order_note)))
+        application.add_handler(CommandHandler("find", self._timed_handler(self.admin_find)))
+        application.add_handler(CommandHandler("export", self._timed_handler(self.admin_export)))
+        application.add_handler(CommandHandler("stats", self._timed_handler(self.admin_stats)))
+        application.add_handler(CommandHandler("stats_rebuild", self._timed_handler(self.admin_stats_rebuild)))
+        application.add_handler(CommandHandler("metrics", self._timed_handler(self.admin_metrics)))
         
         # --- ОБРАБОТЧИК WEB APP DATA --- 
         # Возвращаем стандартный фильтр
-        application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, self.handle_webapp_data))
+        application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, self._timed_handler(self.handle_webapp_data)))
         # ----------------------------------------------------------------
         
-        application.add_handler(MessageHandler(filters.Regex("^Оформить заказ$"), self.choose_product))
-        application.add_handler(MessageHandler(filters.Regex("^Заказать через приложение$"), self.open_mini_app))
-        application.add_handler(MessageHandler(filters.CONTACT, self.contact_handler))
-        application.add_handler(MessageHandler(filters.PHOTO, self.handle_custom_order_photo))
+        application.add_handler(MessageHandler(filters.Regex("^Оформить заказ$"), self._timed_handler(self.choose_product)))
+        application.add_handler(MessageHandler(filters.Regex("^Заказать через приложение$"), self._timed_handler(self.open_mini_app)))
+        application.add_handler(MessageHandler(filters.CONTACT, self._timed_handler(self.contact_handler)))
+        application.add_handler(MessageHandler(filters.PHOTO, self._timed_handler(self.handle_custom_order_photo)))
         # --- ОБРАБОТЧИК ОБЫЧНЫХ ТЕКСТОВЫХ СООБЩЕНИЙ --- 
-        # Закомментирован, так как упрощенный handle_webapp_data ловит все
-        # application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self.debug_message_handler))
+        # Ответы на шагах мастера заказа разбираются по таблице переходов (wizard.py)
+        application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self._timed_handler(self.handle_input)))
         # -------------------------------------
         
-        application.add_handler(CallbackQueryHandler(self.handle_preview_callback))
+        application.add_handler(CallbackQueryHandler(self._timed_handler(self.handle_orders_callback), pattern=r"^orders:"))
+        application.add_handler(CallbackQueryHandler(self._timed_handler(self.handle_find_callback), pattern=r"^find:"))
+        application.add_handler(CallbackQueryHandler(self._timed_handler(self.handle_preview_callback)))
         application.add_error_handler(self.error_handler)
-        
-        application.post_init(self.set_commands)
-        
+        return application
+
+    async def run_webhook(self, application: Application, stop_event: Optional[asyncio.Event] = None):
+        """Запускает бота в режиме вебхука на встроенном aiohttp-сервере.
+
+        В отличие от run_polling, очередь обновлений на стороне Telegram не
+        сбрасывается при перезапуске. Работает до установки stop_event
+        (или до SIGINT/SIGTERM, если stop_event не передан).
+        """
+        if stop_event is None:
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop_event.set)
+                except NotImplementedError:
+                    pass
+
+        server = WebhookServer(application, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        try:
+            async with application:
+                if application.post_init:
+                    await application.post_init(application)
+                await application.start()
+                await server.start()
+                try:
+                    if WEBHOOK_URL:
+                        await application.bot.set_webhook(
+                            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                            secret_token=WEBHOOK_SECRET,
+                            allowed_updates=Update.ALL_TYPES,
+                            max_connections=WEBHOOK_MAX_CONNECTIONS,
+                            drop_pending_updates=DROP_PENDING_UPDATES,
+                        )
+                        logger.info(f"Вебхук установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+                    else:
+                        logger.warning("WEBHOOK_URL не задан: вебхук в Telegram не регистрируется")
+                    await stop_event.wait()
+                finally:
+                    await server.stop()
+                    await application.stop()
+        finally:
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    def main(self):
+        """Запускает бота"""
+        # Логи пишутся в файл фоновым потоком (JSON Lines, ротация по размеру)
+        setup_logging()
+        logger.info('Запуск бота...')
+        application = self.build_application()
+
         # Печатаем отладочную информацию (можно оставить здесь или перенести в post_init)
         logger.info("Бот настроен, запуск...")
         logger.info(f"Администраторы: {ADMIN_IDS}")
         logger.info(f"ID продавца: {SELLER_CHAT_ID}")
+        logger.info(f"Режим запуска: {RUN_MODE}")
         
         # Запускаем бота
-        application.run_polling(drop_pending_updates=True)
+        if RUN_MODE == 'webhook':
+            asyncio.run(self.run_webhook(application))
+        else:
+            application.run_polling(drop_pending_updates=DROP_PENDING_UPDATES)
     
     async def set_commands(self, application: Application):
         """Устанавливает команды меню асинхронно (принимает Application)."""
@@ -787,5 +1053,5 @@ class SumkiBot:
 
 if __name__ == "__main__":
     bot = SumkiBot()
-    # Вызов main() запускает все, включая асинхронную инициализацию и run_polling
+    # Вызов main() запускает все, включая асинхронную инициализацию и run_polling/вебхук
     bot.main()
\ No newline at end of file
@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import csv
+import datetime
+import gzip
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+# Колонки выгрузки в порядке вывода
+EXPORT_FIELDS = (
+    'id', 'order_date', 'user_id', 'username', 'product_type', 'size', 'shape', 'material', 'color',
+    'options', 'custom_description', 'contact', 'status', 'total_price',
+)
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Сколько строк копится перед записью на диск в отдельном потоке
+EXPORT_CHUNK_ROWS = 1000
+
+
+def parse_export_args(args: List[str], statuses: List[str]) -> Tuple[Optional[str], Optional[str], Optional[str], str]:
+    """Разбирает аргументы /export [с] [по] [статус] [csv|jsonl]
+
+    Даты в формате YYYY-MM-DD, первая - начало, вторая - конец периода
+    включительно. Порядок статуса и формата не важен.
+
+    Returns:
+        (date_from, date_to, status, формат), где date_to - начало следующего за концом периода дня.
+
+    Raises:
+        ValueError: Аргумент не распознан (текст ошибки можно показать администратору).
+    """
+    dates, status, export_format = [], None, 'csv'
+    for arg in args:
+        if arg.lower() in EXPORT_FORMATS:
+            export_format = arg.lower()
+        elif arg in statuses:
+            status = arg
+        else:
+            try:
+                dates.append(datetime.datetime.strptime(arg, '%Y-%m-%d').date())
+            except ValueError:
+                raise ValueError(f"Не понял аргумент '{arg}'") from None
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат")
+    date_from = dates[0].isoformat() if dates else None
+    date_to = (dates[1] + datetime.timedelta(days=1)).isoformat() if len(dates) > 1 else None
+    if date_from and date_to and date_from >= date_to:
+        raise ValueError("Дата начала позже даты конца")
+    return date_from, date_to, status, export_format
+
+
+def _export_row(row) -> Dict[str, Any]:
+    """Строка orders -> словарь выгрузки с options в виде списка"""
+    record = {field: row[field] for field in EXPORT_FIELDS}
+    try:
+        record['options'] = json.loads(record['options']) if record['options'] else []
+    except (TypeError, ValueError):
+        record['options'] = [record['options']]
+    return record
+
+
+# Ячейки, которые Excel и LibreOffice считают формулой (плюс табуляция и перевод строки из рекомендаций OWASP)
+_CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value: Any) -> Any:
+    """Защищает текст покупателя от выполнения как формулы: перед ним ставится апостроф.
+
+    Телефоны вида +7... тоже экранируются, иначе Excel попытается их вычислить.
+    """
+    if isinstance(value, str) and value.startswith(_CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _CsvWriter:
+    """CSV в UTF-8 с BOM, чтобы Excel правильно показывал кириллицу; формулы в тексте экранируются"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_FIELDS)
+
+    def write(self, rows: list):
+        for row in rows:
+            record = _export_row(row)
+            record['options'] = ', '.join(map(str, record['options']))
+            self._writer.writerow([_csv_cell(record[field]) for field in EXPORT_FIELDS])
+
+    def close(self):
+        self._file.close()
+
+
+class _JsonlGzipWriter:
+    """JSON Lines, сжатый gzip: одна строка - один заказ"""
+
+    def __init__(self, path: str):
+        # Уровень 6 вместо 9 по умолчанию: сжатие почти то же, запись быстрее
+        self._file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+    def write(self, rows: list):
+        self._file.writelines(json.dumps(_export_row(row), ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+def export_filename(date_from: Optional[str], date_to: Optional[str], status: Optional[str], export_format: str) -> str:
+    parts = ['orders']
+    if date_from:
+        parts.append(f"from-{date_from}")
+    if date_to:
+        parts.append(f"before-{date_to}")
+    if status:
+        parts.append(status)
+    return '_'.join(parts) + ('.csv' if export_format == 'csv' else '.jsonl.gz')
+
+
+async def export_orders(rows: AsyncIterator, path: str, export_format: str,
+                        chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+    """Записывает заказы из асинхронного итератора в файл по мере чтения.
+
+    Строки копятся пачками по chunk_rows; преобразование, запись на диск и
+    сжатие выполняются в отдельном потоке, поэтому память ограничена одной
+    пачкой, а цикл событий не блокируется.
+
+    Args:
+        rows: Итератор строк orders (например, Database.iter_orders).
+        path: Путь к файлу выгрузки.
+        export_format: 'csv' или 'jsonl' (gzip).
+        chunk_rows: Размер пачки.
+
+    Returns:
+        Количество выгруженных заказов.
+    """
+    writer = await asyncio.to_thread(_CsvWriter if export_format == 'csv' else _JsonlGzipWriter, path)
+    count = 0
+    try:
+        chunk = []
+        async with contextlib.aclosing(rows):
+            async for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    await asyncio.to_thread(writer.write, chunk)
+                    count += len(chunk)
+                    chunk = []
+        if chunk:
+            await asyncio.to_thread(writer.write, chunk)
+            count += len(chunk)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return count
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Telegram Bot API для тестов и бенчмарков.
+
+Принимает запросы вида POST /bot<token>/<method>, запоминает их в self.calls и
+отвечает минимальными валидными объектами, которых достаточно python-telegram-bot.
+Бот направляется сюда через BOT_API_BASE_URL (или ApplicationBuilder.base_url).
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        """
+        Args:
+            host: Адрес для прослушивания.
+            port: Порт (0 - выбрать свободный).
+            latency: Искусственная задержка каждого ответа в секундах.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.web_app = web.Application(client_max_size=50 * 1024 * 1024)
+        self.web_app.router.add_post('/bot{token}/{method}', self.handle)
+
+    @property
+    def base_url(self) -> str:
+        """Значение для BOT_API_BASE_URL"""
+        return f"http://{self.host}:{self.port}"
+
+    def calls_to(self, method: str) -> List[Dict[str, Any]]:
+        """Возвращает параметры всех вызовов указанного метода"""
+        return [call['params'] for call in self.calls if call['method'] == method]
+
+    def _message(self, chat_id, **extra) -> Dict[str, Any]:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+        }
+        message.update(extra)
+        return message
+
+    def _photo(self) -> List[Dict[str, Any]]:
+        file_number = next(self._file_ids)
+        return [{'file_id': f"fake-file-{file_number}", 'file_unique_id': f"u{file_number}",
+                 'width': 1280, 'height': 1280}]
+
+    def _result(self, method: str, params: Dict[str, Any]):
+        chat_id = params.get('chat_id', 0)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getUpdates':
+            return []
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(chat_id or 0, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=self._photo())
+        if method == 'sendDocument':
+            return self._message(chat_id, document={'file_id': f"fake-file-{next(self._file_ids)}",
+                                                    'file_unique_id': 'doc'})
+        if method == 'sendMediaGroup':
+            media = params.get('media', [])
+            return [self._message(chat_id, photo=self._photo(), media_group_id='1') for _ in media]
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        form = await request.post()
+        params: Dict[str, Any] = {}
+        for key, value in form.items():
+            if isinstance(value, str):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            else:
+                params[key] = '<file>'
+        self.calls.append({'method': method, 'params': params, 'time': time.monotonic()})
+
+        if method == 'getUpdates':
+            # Имитируем long polling, чтобы не крутить пустой цикл
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), 1.0))
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self._result(method, params)})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Если порт был 0, узнаем выбранный
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+if __name__ == "__main__":
+    async def serve():
+        api = FakeBotAPI(port=8081)
+        await api.start()
+        print(f"Заглушка Bot API запущена: {api.base_url}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
@@ -0,0 +1,113 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Dict, Optional
+
+from config import LOG_FILE, LOG_LEVEL, LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_LEVELS
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Атрибуты, которые есть у любой LogRecord; все остальное пришло через extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение, поля из extra= и трассировка"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() подставляет аргументы в сообщение до постановки в
+    очередь; очередь здесь внутри процесса, поэтому запись передается как
+    есть, а сообщение собирается в потоке записи. Аргументы логирования не
+    должны изменяться после вызова (передавайте значения, а не буферы).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Разбирает строку вида 'httpx=WARNING,database=DEBUG' в {логгер: уровень}"""
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def setup_logging(log_file: str = LOG_FILE, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT,
+                  max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                  module_levels: str = LOG_LEVELS) -> logging.handlers.QueueListener:
+    """Настраивает логирование через очередь с фоновой записью в файл.
+
+    Обработчики только кладут запись в очередь; форматирование и запись на
+    диск (с ротацией по размеру) выполняет поток QueueListener. Повторный
+    вызов возвращает уже запущенный listener.
+
+    Args:
+        log_file: Путь к файлу лога.
+        level: Уровень корневого логгера.
+        log_format: 'json' (JSON Lines) или 'text'.
+        max_bytes: Размер файла, после которого он ротируется.
+        backup_count: Сколько старых файлов хранить.
+        module_levels: Уровни отдельных логгеров, например 'httpx=WARNING,database=DEBUG'.
+
+    Returns:
+        Запущенный QueueListener (останавливается автоматически при выходе).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonLinesFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.setLevel(level.upper())
+    for name, module_level in parse_levels(module_levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,87 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+from catalog import CatalogImage
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Кэш file_id Telegram для фото каталога.
+
+    Первая отправка фото загружает байты, а возвращенный Telegram file_id
+    сохраняется в таблицу media_cache вместе с хэшем содержимого. Дальше фото
+    отправляется по file_id без загрузки. Если файл в каталоге изменился (другой
+    хэш), запись считается устаревшей и фото загружается заново.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        # key -> (content_hash, file_id): копия таблицы media_cache в памяти
+        self._file_ids: Dict[str, Tuple[str, str]] = {}
+
+    async def _lookup(self, keys: List[str]) -> Dict[str, Tuple[str, str]]:
+        missing = [key for key in keys if key not in self._file_ids]
+        if missing:
+            self._file_ids.update(await self.db.get_media_file_ids(missing))
+        return {key: self._file_ids[key] for key in keys if key in self._file_ids}
+
+    async def _build_media(self, items: List[Tuple[Optional[CatalogImage], Optional[str]]], use_cache: bool):
+        """Готовит InputMediaPhoto: по file_id для актуальных записей, иначе байтами из памяти."""
+        items = [(image, caption) for image, caption in items if image is not None]
+        cached = await self._lookup([image.key for image, _ in items]) if use_cache else {}
+        media, sent_items = [], []
+        for image, caption in items:
+            entry = cached.get(image.key)
+            if entry and entry[0] == image.content_hash:
+                media.append(InputMediaPhoto(media=entry[1], caption=caption))
+                sent_items.append((image.key, image.content_hash, False))
+            else:
+                media.append(InputMediaPhoto(media=image.data, caption=caption))
+                sent_items.append((image.key, image.content_hash, True))
+        return media, sent_items
+
+    async def send_album(self, bot, chat_id, items: List[Tuple[Optional[CatalogImage], Optional[str]]]) -> bool:
+        """Отправляет фото каталога одной медиагруппой, используя file_id из кэша.
+
+        Args:
+            bot: Экземпляр telegram.Bot.
+            chat_id: ID чата получателя.
+            items: Список кортежей (фото из AssetCatalog, подпись или None); None вместо фото пропускается.
+
+        Returns:
+            bool: True, если медиагруппа отправлена.
+        """
+        media, sent_items = await self._build_media(items, use_cache=True)
+        if not media:
+            logger.error("Не удалось подготовить ни одной фотографии для медиагруппы.")
+            return False
+
+        try:
+            messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        except BadRequest as e:
+            stale = [key for key, _, uploaded in sent_items if not uploaded]
+            if not stale:
+                raise
+            # file_id мог стать недействительным (например, сменился токен бота) - загружаем заново
+            logger.warning(f"Telegram не принял закэшированные file_id, загружаем фото заново: {e}")
+            for key in stale:
+                self._file_ids.pop(key, None)
+            await self.db.delete_media_file_ids(stale)
+            media, sent_items = await self._build_media(items, use_cache=False)
+            messages = await bot.send_media_group(chat_id=chat_id, media=media)
+
+        new_entries = []
+        for message, (key, content_hash, uploaded) in zip(messages, sent_items):
+            if uploaded and message.photo:
+                file_id = message.photo[-1].file_id
+                self._file_ids[key] = (content_hash, file_id)
+                new_entries.append((key, content_hash, file_id))
+        if new_entries:
+            await self.db.save_media_file_ids(new_entries)
+            logger.info(f"Закэшировано {len(new_entries)} file_id фото каталога")
+        return True
@@ -5,7 +5,12 @@ def get_menu_commands():
     return [
         BotCommand("start", "Начать работу с ботом"),
         BotCommand("help", "Помощь по использованию бота"),
-        BotCommand("orders", "Просмотр заказов (только для администраторов)"),
+        BotCommand("orders", "Просмотр заказов постранично (только для администраторов)"),
         BotCommand("status", "Изменить статус заказа (только для администраторов)"),
-        BotCommand("note", "Добавить заметку к заказу (только для администраторов)")
+        BotCommand("note", "Добавить заметку к заказу (только для администраторов)"),
+        BotCommand("find", "Поиск заказов по тексту, телефону или имени (только для администраторов)"),
+        BotCommand("export", "Выгрузить заказы в CSV или JSONL (только для администраторов)"),
+        BotCommand("stats", "Сводка заказов и выручки за период (только для администраторов)"),
+        BotCommand("stats_rebuild", "Пересчитать сводку заказов (только для администраторов)"),
+        BotCommand("metrics", "Задержки и счетчики работы бота (только для администраторов)")
     ] 
\ No newline at end of file
@@ -0,0 +1,207 @@
+import bisect
+import collections
+import functools
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Сколько последних наблюдений хранится для расчета перцентилей
+RESERVOIR_SIZE = 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Гистограмма задержек: корзины в стиле Prometheus и последние наблюдения для p50/p95/p99"""
+
+    __slots__ = ('buckets', 'counts', 'total', 'count', 'recent')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.total = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentiles(self, *quantiles: float) -> Tuple[float, ...]:
+        values = sorted(self.recent)
+        if not values:
+            return tuple(0.0 for _ in quantiles)
+        return tuple(values[min(len(values) - 1, int(len(values) * q))] for q in quantiles)
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы процесса.
+
+    Все обновления выполняются в потоке цикла событий, поэтому блокировки не
+    нужны. Дополнительные показатели (например, снимок очереди исходящих
+    сообщений) подключаются через add_collector и читаются при выдаче.
+    """
+
+    def __init__(self, prefix: str = 'sumki'):
+        self.prefix = prefix
+        self.counters: Dict[Tuple[str, LabelKey], float] = collections.defaultdict(float)
+        self.histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+        self.collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def add_collector(self, name: str, collector: Callable[[], Dict[str, Any]]):
+        """Подключает функцию, возвращающую словарь числовых показателей (выдаются как gauge)"""
+        self.collectors[name] = collector
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.collectors.clear()
+
+    def counter_value(self, name: str, **labels) -> float:
+        if labels:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+        return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def render_prometheus(self) -> str:
+        """Показатели в текстовом формате Prometheus"""
+        lines = []
+        families = set()
+
+        def declare(full_name: str, metric_type: str):
+            # Строка # TYPE выдается один раз перед первым образцом семейства
+            if full_name not in families:
+                families.add(full_name)
+                lines.append(f"# TYPE {full_name} {metric_type}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(f"{self.prefix}_{name}", 'counter')
+            lines.append(f"{self.prefix}_{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            full_name = f"{self.prefix}_{name}"
+            declare(full_name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram.total:.6f}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+        for collector_name, collector in self.collectors.items():
+            try:
+                values = collector()
+            except Exception as e:
+                logger.error(f"Метрики: ошибка сборщика {collector_name}: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    declare(f"{self.prefix}_{collector_name}_{key}", 'gauge')
+                    lines.append(f"{self.prefix}_{collector_name}_{key} {value:g}")
+        declare(f"{self.prefix}_uptime_seconds", 'gauge')
+        lines.append(f"{self.prefix}_uptime_seconds {time.time() - self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Краткая сводка для команды /metrics: счетчики и перцентили задержек в миллисекундах"""
+        lines = [f"Аптайм: {int(time.time() - self.started_at)} с"]
+        if self.counters:
+            lines.append("\nСчетчики:")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"  {name}{_format_labels(labels)}: {value:g}")
+        if self.histograms:
+            lines.append("\nЗадержки, мс (p50 / p95 / p99, вызовов):")
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                p50, p95, p99 = (value * 1000 for value in histogram.percentiles(0.5, 0.95, 0.99))
+                label = ','.join(value for _, value in labels)
+                lines.append(f"  {name}[{label}]: {p50:.1f} / {p95:.1f} / {p99:.1f}, {histogram.count}")
+        for collector_name, collector in self.collectors.items():
+            try:
+                values = collector()
+            except Exception:
+                continue
+            lines.append(f"\n{collector_name}: " + ", ".join(f"{key}={value}" for key, value in values.items()))
+        return "\n".join(lines)
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+# Общий реестр процесса
+metrics = MetricsRegistry()
+
+
+def timed(name: str, **labels):
+    """Декоратор корутинной функции: время каждого вызова попадает в гистограмму name"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(name: str, label: str = 'method'):
+    """Декоратор класса: оборачивает все публичные корутинные методы в timed(name, label=<имя метода>)"""
+    def decorator(cls):
+        for attr, func in list(vars(cls).items()):
+            if not attr.startswith('_') and inspect.iscoroutinefunction(func):
+                setattr(cls, attr, timed(name, **{label: attr})(func))
+        return cls
+    return decorator
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с показателями по адресу /metrics (формат Prometheus)"""
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 9100, registry: Optional[MetricsRegistry] = None):
+        self.listen = listen
+        self.port = port
+        self.registry = registry or metrics
+        self.web_app = web.Application()
+        self.web_app.router.add_get('/metrics', self.handle_metrics)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
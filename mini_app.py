@@ -0,0 +1,219 @@
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from database import material_mapping, product_mapping, shape_mapping
+
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json (медленнее, результат тот же)
+    orjson = None
+
+# Telegram передает в web_app_data не больше 4096 байт
+MAX_PAYLOAD_BYTES = 4096
+MAX_SHORT_TEXT = 100
+MAX_DESCRIPTION = 2000
+MAX_OPTIONS = 20
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+class MiniAppOrderError(ValueError):
+    """Данные заказа из Mini App не прошли разбор или проверку"""
+
+
+# --- Схема ---
+# Поле описывается кортежем (тип, обязательное, ограничение): для str ограничение - максимальная
+# длина или множество допустимых значений, для list - схема элемента и длина, для dict - вложенная схема.
+
+CONTACT_SCHEMA = {
+    'id': (int, False, None),
+    'username': (str, False, MAX_SHORT_TEXT),
+    'first_name': (str, False, MAX_SHORT_TEXT),
+    'last_name': (str, False, MAX_SHORT_TEXT),
+    'phone_number': (str, False, 32),
+}
+
+USER_SCHEMA = dict(CONTACT_SCHEMA, language_code=(str, False, 16))
+
+# OrderDetails из src/types.ts и поле user, которое добавляет PreviewStep перед sendData
+ORDER_DETAILS_SCHEMA = {
+    'product': (str, True, frozenset(product_mapping)),
+    'size': (str, False, MAX_SHORT_TEXT),
+    'shape': (str, False, MAX_SHORT_TEXT),
+    'material': (str, False, MAX_SHORT_TEXT),
+    'color': (str, False, MAX_SHORT_TEXT),
+    'options': (list, False, ((str, True, MAX_SHORT_TEXT), MAX_OPTIONS)),
+    'customDescription': (str, False, MAX_DESCRIPTION),
+    'customPhoto': (str, False, MAX_PAYLOAD_BYTES),
+    'contact': (dict, False, CONTACT_SCHEMA),
+    'user': (dict, False, USER_SCHEMA),
+}
+
+Validator = Callable[[Any], Any]
+
+
+def _compile_field(field_type: type, limit: Any, path: str) -> Validator:
+    """Строит функцию проверки одного значения; путь для сообщений об ошибках подставляется здесь же"""
+    if field_type is str:
+        if isinstance(limit, frozenset):
+            def check_choice(value):
+                if not isinstance(value, str) or value not in limit:
+                    raise MiniAppOrderError(f"{path}: недопустимое значение {value!r}")
+                return value
+            return check_choice
+
+        def check_str(value):
+            if not isinstance(value, str):
+                raise MiniAppOrderError(f"{path}: ожидалась строка")
+            # Пробелы по краям отбрасываются и в лимит не засчитываются
+            value = value.strip()
+            if limit is not None and len(value) > limit:
+                raise MiniAppOrderError(f"{path}: длиннее {limit} символов")
+            return value
+        return check_str
+
+    if field_type is int:
+        def check_int(value):
+            # bool - подкласс int, но идентификатором быть не может
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise MiniAppOrderError(f"{path}: ожидалось целое число")
+            return value
+        return check_int
+
+    if field_type is list:
+        (item_type, _, item_limit), max_items = limit
+        check_item = _compile_field(item_type, item_limit, f"{path}[]")
+
+        def check_list(value):
+            if not isinstance(value, list):
+                raise MiniAppOrderError(f"{path}: ожидался список")
+            if len(value) > max_items:
+                raise MiniAppOrderError(f"{path}: больше {max_items} элементов")
+            return [check_item(item) for item in value]
+        return check_list
+
+    if field_type is dict:
+        return compile_schema(limit, path)
+
+    raise TypeError(f"Неподдерживаемый тип поля схемы: {field_type}")
+
+
+def compile_schema(schema: Dict[str, Tuple[type, bool, Any]], path: str = 'order') -> Validator:
+    """Компилирует схему в функцию проверки объекта.
+
+    Неизвестные поля отбрасываются, null в необязательном поле считается
+    отсутствием значения.
+
+    Returns:
+        Функция объект -> проверенный словарь; при ошибке бросает MiniAppOrderError.
+    """
+    fields = tuple((name, required, _compile_field(field_type, limit, f"{path}.{name}"))
+                   for name, (field_type, required, limit) in schema.items())
+
+    def check_object(value):
+        if not isinstance(value, dict):
+            raise MiniAppOrderError(f"{path}: ожидался объект")
+        result = {}
+        for name, required, check in fields:
+            item = value.get(name)
+            if item is None:
+                if required:
+                    raise MiniAppOrderError(f"{path}.{name}: обязательное поле")
+                continue
+            result[name] = check(item)
+        return result
+    return check_object
+
+
+validate_order_details = compile_schema(ORDER_DETAILS_SCHEMA)
+
+
+# --- Нормализация ---
+
+def _canonical_lookup(mapping: Dict[str, str]) -> Dict[str, str]:
+    """Ключи и значения словаря соответствий в нижнем регистре -> каноническое значение"""
+    lookup = {value.lower(): value for value in mapping.values()}
+    lookup.update({key.lower(): value for key, value in mapping.items()})
+    return lookup
+
+
+_SHAPES = _canonical_lookup(shape_mapping)
+_MATERIALS = _canonical_lookup(material_mapping)
+
+
+def _canonical(lookup: Dict[str, str], value: str) -> str:
+    return lookup.get(value.lower().replace('ё', 'е'), value) if value else ''
+
+
+def format_contact(contact: Optional[Dict[str, Any]], user: Optional[Dict[str, Any]] = None) -> str:
+    """Контакт покупателя одной строкой: телефон, иначе @username, иначе ID Telegram"""
+    for source in (contact or {}, user or {}):
+        if source.get('phone_number'):
+            return source['phone_number']
+    for source in (contact or {}, user or {}):
+        if source.get('username'):
+            return f"@{source['username']}"
+    for source in (contact or {}, user or {}):
+        if source.get('id'):
+            return f"tg://user?id={source['id']}"
+    return ''
+
+
+def normalize_order(details: Dict[str, Any]) -> Dict[str, Any]:
+    """Приводит проверенные OrderDetails к данным для Database.add_order.
+
+    Форма и материал приводятся к написанию каталога ('круглая', 'kruglaya',
+    'round' -> 'Круглая') по словарям соответствий из database.py.
+    """
+    photo = details.get('customPhoto', '')
+    return {
+        'product': details['product'],
+        'size': details.get('size', ''),
+        'shape': _canonical(_SHAPES, details.get('shape', '')),
+        'material': _canonical(_MATERIALS, details.get('material', '')),
+        'color': details.get('color', ''),
+        'options': [option for option in details.get('options', []) if option],
+        'custom_description': details.get('customDescription', ''),
+        # Telegram принимает фото по URL; data: URL из браузера продавцу не отправить
+        'custom_photos': [photo] if photo.startswith(('http://', 'https://')) else [],
+        'contact': format_contact(details.get('contact'), details.get('user')),
+    }
+
+
+def parse_order(raw: str) -> Dict[str, Any]:
+    """Разбирает web_app_data.data: JSON -> проверка по схеме -> нормализация
+
+    Raises:
+        MiniAppOrderError: Данные слишком большие, не JSON или не соответствуют схеме.
+    """
+    # Лимит Telegram - в байтах UTF-8, а кириллица занимает по 2 байта на символ
+    if len(raw.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+        raise MiniAppOrderError(f"данные больше {MAX_PAYLOAD_BYTES} байт")
+    try:
+        payload = _loads(raw)
+    except ValueError as e:  # orjson.JSONDecodeError - подкласс ValueError
+        raise MiniAppOrderError(f"некорректный JSON: {e}") from None
+    return normalize_order(validate_order_details(payload))
+
+
+def format_order_text(order: Dict[str, Any], username: Optional[str]) -> str:
+    """Текст заказа для продавца в том же виде, что и у заказов из мастера"""
+    product = product_mapping.get(order['product'], order['product'])
+    if order['product'] == 'custom':
+        text = (
+            f"Нестандартный заказ из приложения от {username}:\n"
+            f"Описание: {order['custom_description'] or 'Не указано'}\n"
+        )
+        if order['custom_photos']:
+            text += "Фотография прикреплена\n"
+        return text
+    text = f"Заказ из приложения от {username}:\nПродукт: {product}\n"
+    if order['product'] == 'bag':
+        text += f"Размер: {order['size'] or 'Не указан'}\n"
+        text += f"Форма: {order['shape'] or 'Не указана'}\n"
+    text += (
+        f"Материал бусин: {order['material'] or 'Не указан'}\n"
+        f"Цвет: {order['color'] or 'Не указан'}\n"
+        f"Дополнительные опции: {', '.join(order['options'] or ['Не указаны'])}"
+    )
+    return text
@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import (
+    MODERATION_WORDLIST_RU, MODERATION_INLINE_LIMIT, MODERATION_POOL,
+    MODERATION_WORKERS, MODERATION_CACHE_SIZE,
+)
+
+try:
+    import better_profanity
+except ImportError:  # английский словарь берется из better_profanity, без него проверяется только русский
+    better_profanity = None
+
+logger = logging.getLogger(__name__)
+
+# Символы, которыми маскируют буквы (sh1t, @ss). Заменяются, только если с обеих сторон
+# буквы (а @ и $ - еще и в начале слова перед буквой), чтобы числа ("45x30", "100 бусин"),
+# "сука!" или "2 girls" не превращались в другие слова
+_LEET_CHARS = {'@': 'a', '$': 's', '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '!': 'i'}
+_LEET_RE = re.compile(r'(?<=[^\W\d_])[@$013457!](?=[^\W\d_])|(?<![\w@$])[@$](?=[^\W\d_])')
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду, в котором ищутся слова: нижний регистр, ё -> е, без масок, одиночные пробелы"""
+    text = text.lower().replace('ё', 'е')
+    text = _LEET_RE.sub(lambda match: _LEET_CHARS[match.group()], text)
+    return ' '.join(text.split())
+
+
+def load_wordlist(path: str) -> List[str]:
+    """Читает словарь: одна запись на строку, пустые строки и строки с # пропускаются"""
+    words = []
+    with open(path, encoding='utf-8') as wordlist:
+        for line in wordlist:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                words.append(line)
+    return words
+
+
+def default_words(ru_wordlist_path: str = MODERATION_WORDLIST_RU) -> List[str]:
+    """Английский словарь better_profanity и русский словарь из файла"""
+    words = []
+    if better_profanity is not None:
+        words.extend(load_wordlist(os.path.join(os.path.dirname(better_profanity.__file__), 'profanity_wordlist.txt')))
+    else:
+        logger.warning("Модерация: better_profanity не установлен, английский словарь не загружен")
+    if os.path.exists(ru_wordlist_path):
+        words.extend(load_wordlist(ru_wordlist_path))
+    else:
+        logger.warning(f"Модерация: русский словарь {ru_wordlist_path} не найден")
+    return words
+
+
+class ProfanityMatcher:
+    """Автомат Ахо-Корасик по всем словам словарей.
+
+    Строится один раз; проверка текста - один проход по символам независимо
+    от размера словаря. Слово без звездочки совпадает только целиком, со
+    звездочкой в конце - как начало слова (основа).
+    """
+
+    __slots__ = ('_goto', '_fail', '_out', 'size')
+
+    def __init__(self, words: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        # Для каждого узла: (длина слова, только целиком) для всех слов, заканчивающихся в нем
+        self._out: List[Tuple[Tuple[int, bool], ...]] = [()]
+        self.size = 0
+        for word in words:
+            self._add(word)
+        self._build_fail_links()
+
+    def _add(self, word: str):
+        whole_word = not word.endswith('*')
+        word = normalize_text(word.rstrip('*'))
+        if not word:
+            return
+        node = 0
+        for char in word:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._out.append(())
+            node = next_node
+        self._out[node] += ((len(word), whole_word),)
+        self.size += 1
+
+    def _build_fail_links(self):
+        self._fail = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # Слова, заканчивающиеся в узле отката, заканчиваются и здесь
+                self._out[child] += self._out[self._fail[child]]
+
+    def find(self, text: str) -> Optional[str]:
+        """Первое найденное слово словаря в тексте или None"""
+        text = normalize_text(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        length = len(text)
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word_length, whole_word in out[node]:
+                start = index - word_length + 1
+                if start > 0 and text[start - 1].isalpha():
+                    continue
+                if whole_word and index + 1 < length and text[index + 1].isalpha():
+                    continue
+                return text[start:index + 1]
+        return None
+
+    def contains(self, text: str) -> bool:
+        return self.find(text) is not None
+
+
+# Автомат в процессе пула (для MODERATION_POOL='process'), строится один раз при запуске процесса
+_worker_matcher: Optional[ProfanityMatcher] = None
+
+
+def _init_worker(words: List[str]):
+    global _worker_matcher
+    _worker_matcher = ProfanityMatcher(words)
+
+
+def _worker_contains(text: str) -> bool:
+    return _worker_matcher.contains(text)
+
+
+class Moderator:
+    """Проверка текстов покупателей на нецензурную лексику.
+
+    Короткие тексты проверяются сразу в цикле событий (это быстрее передачи
+    в пул), длинные - в пуле потоков или процессов, чтобы не задерживать
+    обработку сообщений других пользователей. Вердикты последних
+    cache_size текстов запоминаются.
+    """
+
+    def __init__(self, words: Optional[List[str]] = None, inline_limit: int = MODERATION_INLINE_LIMIT,
+                 pool: str = MODERATION_POOL, workers: int = MODERATION_WORKERS,
+                 cache_size: int = MODERATION_CACHE_SIZE):
+        self.words = words if words is not None else default_words()
+        self.matcher = ProfanityMatcher(self.words)
+        self.inline_limit = inline_limit
+        self.pool = pool
+        self.workers = workers
+        self.cache_size = cache_size
+        self._cache: 'collections.OrderedDict[bytes, bool]' = collections.OrderedDict()
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        logger.info(f"Модерация: словарь из {self.matcher.size} слов, {len(self.matcher._goto)} узлов автомата")
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.pool == 'process':
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(self.words,)
+                )
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='moderation'
+                )
+        return self._executor
+
+    async def is_acceptable(self, text: str) -> bool:
+        """True, если в тексте нет слов из словарей"""
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        verdict = self._cache.get(key)
+        if verdict is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return verdict
+        self.cache_misses += 1
+
+        if len(text) <= self.inline_limit:
+            verdict = not self.matcher.contains(text)
+        elif self.pool == 'process':
+            verdict = not await asyncio.get_running_loop().run_in_executor(self._get_executor(), _worker_contains, text)
+        else:
+            verdict = not await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.matcher.contains, text)
+
+        self._cache[key] = verdict
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return verdict
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
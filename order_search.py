@@ -0,0 +1,56 @@
+import re
+from typing import List, Tuple
+
+
+# Индекс orders_search использует триграммы: находится любая подстрока длиной от 3 символов
+SEARCH_MIN_TERM_LENGTH = 3
+# Сколько цифр должно быть в последовательности цифр и разделителей, чтобы считать ее телефоном
+SEARCH_PHONE_MIN_DIGITS = 7
+# Слова запроса: фраза в кавычках, цифры с разделителями телефона (+7 (999) 123-45-67) или
+# последовательность непробельных символов
+_TERM_RE = re.compile(r'"([^"]+)"|(?<!\S)(\+?\(?\d[\d\s\-().]*\d\)?)(?!\S)|(\S+)')
+_NON_DIGIT_RE = re.compile(r'\D')
+
+
+def search_terms(query: str) -> List[Tuple[str, ...]]:
+    """Разбивает запрос /find на слова и фразы для поиска подстрок.
+
+    Каждое слово - кортеж вариантов, из которых достаточно найти любой.
+    Телефон (не меньше SEARCH_PHONE_MIN_DIGITS цифр с пробелами, скобками,
+    дефисами) ищется и одними цифрами - так контакт хранится в индексе, - и
+    как написан. Более короткие числа остаются отдельными словами. Слова
+    короче SEARCH_MIN_TERM_LENGTH отбрасываются - по триграммам их не найти.
+    """
+    terms = []
+    for phrase, number, word in _TERM_RE.findall(query):
+        if number:
+            digits = _NON_DIGIT_RE.sub('', number)
+            if len(digits) < SEARCH_PHONE_MIN_DIGITS:
+                terms.extend((part,) for part in number.split() if len(part) >= SEARCH_MIN_TERM_LENGTH)
+                continue
+            terms.append((digits,) if digits == number else (digits, number))
+            continue
+        term = (phrase or word).strip()
+        if len(term) >= SEARCH_MIN_TERM_LENGTH:
+            terms.append((term,))
+    return terms
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match_query(query: str) -> str:
+    """Строит выражение FTS5 MATCH: все слова запроса должны встретиться (в любых полях).
+
+    Каждое слово берется в кавычки, поэтому операторы FTS5 из текста
+    администратора не интерпретируются и ошибки синтаксиса не возникает.
+
+    Raises:
+        ValueError: В запросе нет ни одного слова подходящей длины.
+    """
+    terms = search_terms(query)
+    if not terms:
+        raise ValueError(f"Запрос слишком короткий: нужно хотя бы одно слово от {SEARCH_MIN_TERM_LENGTH} символов")
+    return ' AND '.join(_quote(variants[0]) if len(variants) == 1 else
+                        '(' + ' OR '.join(map(_quote, variants)) + ')' for variants in terms)
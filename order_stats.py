@@ -0,0 +1,117 @@
+import datetime
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+# Период /stats по умолчанию (дней, включая сегодня)
+STATS_DEFAULT_DAYS = 7
+# Сколько строк показывать в разбивке по типу и материалу
+STATS_TOP_ROWS = 10
+
+
+class StatsQuery(NamedTuple):
+    """Разобранные аргументы /stats: период (date_to не включительно), фильтры и подпись периода"""
+    date_from: Optional[str]
+    date_to: Optional[str]
+    status: Optional[str]
+    product_type: Optional[str]
+    period: str
+
+
+def parse_stats_args(args: List[str], statuses: List[str], products: Dict[str, str],
+                     today: Optional[datetime.date] = None) -> StatsQuery:
+    """Разбирает аргументы /stats [дней | all | с [по]] [статус] [изделие]
+
+    Без периода - последние STATS_DEFAULT_DAYS дней, число - последние N
+    дней, all - за все время, даты в формате YYYY-MM-DD - период включительно
+    (одна дата - с нее по сегодня). Статус - один из statuses, изделие - ключ
+    products ('bag') или его название ('Сумка'). Порядок аргументов не важен.
+
+    Returns:
+        StatsQuery, где date_to - начало следующего за концом периода дня, а
+        product_type - название изделия, как оно хранится в базе.
+
+    Raises:
+        ValueError: Аргумент не распознан (текст ошибки можно показать администратору).
+    """
+    today = today or datetime.date.today()
+    product_names = {name.lower(): name for name in products.values()}
+    product_names.update((key.lower(), name) for key, name in products.items())
+    days, all_time, dates, status, product_type = None, False, [], None, None
+    for arg in args:
+        if arg.isdigit():
+            days = int(arg)
+        elif arg.lower() == 'all':
+            all_time = True
+        elif arg in statuses:
+            status = arg
+        elif arg.lower() in product_names:
+            product_type = product_names[arg.lower()]
+        else:
+            try:
+                dates.append(datetime.datetime.strptime(arg, '%Y-%m-%d').date())
+            except ValueError:
+                raise ValueError(f"Не понял аргумент '{arg}'") from None
+
+    if (days is not None) + all_time + bool(dates) > 1:
+        raise ValueError("Укажите период одним способом: числом дней, all или датами")
+    if all_time:
+        return StatsQuery(None, None, status, product_type, "за все время")
+    if dates:
+        if len(dates) > 2:
+            raise ValueError("Укажите не больше двух дат")
+        date_last = dates[1] if len(dates) > 1 else today
+        if dates[0] > date_last:
+            raise ValueError("Дата начала позже даты конца")
+        return StatsQuery(dates[0].isoformat(), (date_last + datetime.timedelta(days=1)).isoformat(),
+                          status, product_type, f"с {dates[0].isoformat()} по {date_last.isoformat()}")
+
+    days = STATS_DEFAULT_DAYS if days is None else days
+    if days < 1:
+        raise ValueError("Число дней должно быть больше нуля")
+    date_from = today - datetime.timedelta(days=days - 1)
+    return StatsQuery(date_from.isoformat(), (today + datetime.timedelta(days=1)).isoformat(),
+                      status, product_type, f"за {days} дн. (с {date_from.isoformat()})")
+
+
+def _money(value: float) -> str:
+    return f"{value:,.0f} ₽".replace(',', ' ')
+
+
+def _format_group(title: str, totals: Dict[str, List[float]], limit: int) -> List[str]:
+    lines = [f"\n{title}:"]
+    ordered = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))
+    for key, (count, revenue) in ordered[:limit]:
+        lines.append(f"  {key or '—'}: {int(count)} / {_money(revenue)}")
+    if len(ordered) > limit:
+        lines.append(f"  … и еще {len(ordered) - limit}")
+    return lines
+
+
+def format_order_stats(rows: List[Dict[str, Any]], query: StatsQuery, limit: int = STATS_TOP_ROWS) -> str:
+    """Текст ответа /stats по строкам Database.get_order_stats
+
+    Разбивка по статусу и по изделию показывается, только если по ним нет
+    фильтра; разбивка по материалу - всегда.
+    """
+    filters = [value for value in (query.status, query.product_type) if value]
+    title = f"Заказы {query.period}" + (f" ({', '.join(filters)})" if filters else "")
+    if not rows:
+        return f"{title}: нет."
+
+    groups = {name: defaultdict(lambda: [0, 0.0]) for name in ('status', 'product_type', 'material')}
+    total_orders, total_revenue = 0, 0.0
+    for row in rows:
+        total_orders += row['orders']
+        total_revenue += row['revenue'] or 0
+        for name, totals in groups.items():
+            totals[row[name]][0] += row['orders']
+            totals[row[name]][1] += row['revenue'] or 0
+
+    lines = [f"{title}: {total_orders}, выручка {_money(total_revenue)}", "(количество / выручка)"]
+    if not query.status:
+        lines += _format_group("По статусу", groups['status'], limit)
+    if not query.product_type:
+        lines += _format_group("По типу изделия", groups['product_type'], limit)
+    lines += _format_group("По материалу", groups['material'], limit)
+    return '\n'.join(lines)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class OrderDraft:
+    """Черновик заказа в мастере бота (хранится в context.user_data['draft']).
+
+    Вместо произвольных ключей в user_data - фиксированный набор полей в
+    __slots__: у объекта нет собственного __dict__, поэтому тысячи
+    одновременных черновиков занимают заметно меньше памяти.
+    """
+
+    __slots__ = ('product', 'size', 'shape', 'material', 'color', 'options',
+                 'custom_description', 'custom_photos', 'contact')
+
+    def __init__(self, product: Optional[str] = None, size: Optional[str] = None,
+                 shape: Optional[str] = None, material: Optional[str] = None,
+                 color: Optional[str] = None, options: Optional[List[str]] = None,
+                 custom_description: Optional[str] = None, custom_photos: Optional[List[str]] = None,
+                 contact: Optional[str] = None):
+        self.product = product
+        self.size = size
+        self.shape = shape
+        self.material = material
+        self.color = color
+        self.options = options if options is not None else []
+        self.custom_description = custom_description
+        self.custom_photos = custom_photos if custom_photos is not None else []
+        self.contact = contact
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Заполненные поля в виде словаря (для сохранения сессии и Database.add_order)"""
+        result = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value not in (None, [], ''):
+                result[field] = value
+        return result
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'OrderDraft':
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+    def __repr__(self) -> str:
+        return f"OrderDraft({self.to_dict()!r})"
+
+
+def message_idempotency_key(source: str, user_id: int, message_id: int) -> str:
+    """Ключ идемпотентности заказа, оформленного одним сообщением (контакт в мастере бота).
+
+    Повторная доставка того же обновления несет тот же message_id, а новый
+    заказ с таким же содержимым - другой, поэтому он не считается повтором.
+    """
+    return f"{source}:{user_id}:msg{message_id}"
+
+
+def idempotency_keys(source: str, user_id: int, payload: str, timestamp: float, window: float) -> Tuple[str, str]:
+    """Ключи идемпотентности заказа: (ключ текущего интервала, ключ предыдущего интервала).
+
+    Время делится на интервалы по window секунд. Заказ записывается с ключом
+    своего интервала, а повтором считается заказ с тем же содержимым, у которого
+    есть ключ текущего или предыдущего интервала. Поэтому повтор отправки из Mini
+    App через пару секунд ловится и на границе интервалов; окно получается
+    скользящим - от window до 2 * window секунд. Используется для Mini App, где
+    повторная отправка приходит новым сообщением и опознается только по содержимому.
+
+    Args:
+        source: Источник заказа ('mini_app').
+        user_id: ID пользователя Telegram.
+        payload: Содержимое заказа в каноническом виде.
+        timestamp: Время сообщения (unix time).
+        window: Размер интервала в секундах.
+    """
+    digest = hashlib.blake2b(payload.encode('utf-8'), digest_size=12).hexdigest()
+    bucket = int(timestamp // window)
+    return f"{source}:{user_id}:{bucket}:{digest}", f"{source}:{user_id}:{bucket - 1}:{digest}"
+
+
+def _decode_list(raw: Optional[str], field: str, order_id) -> List[Any]:
+    try:
+        return json.loads(raw or '[]')
+    except (json.JSONDecodeError, TypeError):
+        logger.warning(f"DB: Не удалось десериализовать {field} для заказа {order_id}")
+        return []
+
+
+class OrderRecord:
+    """Заказ, прочитанный из таблицы orders.
+
+    Поля options и custom_photos хранятся в базе как JSON и декодируются только
+    при первом обращении, поэтому списки заказов, где эти поля не нужны, не
+    тратят время на json.loads. Поддерживает доступ как к словарю
+    (order['id'], order.get('notes')) для совместимости со старым кодом.
+    """
+
+    __slots__ = ('id', 'user_id', 'username', 'order_date', 'product_type', 'size', 'shape',
+                 'material', 'color', 'custom_description', 'contact', 'status', 'notes',
+                 'total_price', '_options_raw', '_options', '_custom_photos_raw', '_custom_photos')
+
+    FIELDS = ('id', 'user_id', 'username', 'order_date', 'product_type', 'size', 'shape',
+              'material', 'color', 'options', 'custom_description', 'custom_photos', 'contact',
+              'status', 'notes', 'total_price')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self._options_raw = fields.pop('options', None)
+        self._custom_photos_raw = fields.pop('custom_photos', None)
+        for field, value in fields.items():
+            if field in self.__slots__:
+                setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row) -> 'OrderRecord':
+        """Создает запись из aiosqlite.Row (набор колонок может быть неполным)"""
+        return cls(**{key: row[key] for key in row.keys()})
+
+    @property
+    def options(self) -> List[Any]:
+        if self._options is None:
+            self._options = _decode_list(self._options_raw, 'options', self.id)
+        return self._options
+
+    @property
+    def custom_photos(self) -> List[Any]:
+        if self._custom_photos is None:
+            self._custom_photos = _decode_list(self._custom_photos_raw, 'custom_photos', self.id)
+        return self._custom_photos
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return f"OrderRecord(id={self.id!r}, status={self.status!r}, product_type={self.product_type!r})"
@@ -0,0 +1,290 @@
+import asyncio
+import collections
+import itertools
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from metrics import metrics
+from config import (
+    SEND_RETRIES, SEND_RETRY_BASE_DELAY, SEND_RETRY_MAX_DELAY,
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_RATE_PER_MINUTE, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempt: int, base_delay: float = SEND_RETRY_BASE_DELAY,
+                  max_delay: float = SEND_RETRY_MAX_DELAY) -> float:
+    """Экспоненциальная задержка с полным джиттером для попытки attempt (с нуля)"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+async def send_with_retry(call: Callable[[], Awaitable[Any]], description: str = 'запрос',
+                          max_retries: int = SEND_RETRIES) -> Any:
+    """Выполняет вызов Bot API с повторными попытками при сетевых ошибках.
+
+    Тайм-ауты и сетевые ошибки повторяются с экспоненциальной задержкой.
+    RetryAfter (429) пробрасывается сразу: его уже обработала очередь
+    OutboundRateLimiter (пауза и до OUTBOUND_MAX_RETRIES повторов), и повтор
+    здесь умножил бы число попыток. BadRequest и Forbidden не повторяются -
+    повтор их не исправит.
+
+    Args:
+        call: Функция без аргументов, возвращающая новую корутину вызова на каждую попытку.
+        description: Описание вызова для логов.
+        max_retries: Максимальное количество попыток.
+
+    Returns:
+        Результат вызова. Последняя ошибка пробрасывается, если все попытки исчерпаны.
+    """
+    for attempt in range(max_retries):
+        try:
+            return await call()
+        except (RetryAfter, BadRequest, Forbidden):
+            raise
+        except (TimedOut, NetworkError) as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = backoff_delay(attempt)
+            metrics.inc('send_retries_total', reason='network')
+            logger.warning(f"{description}: {type(e).__name__}: {e}, повтор через {delay:.1f} с (попытка {attempt+1}/{max_retries})")
+        await asyncio.sleep(delay)
+
+
+# Приоритеты очереди исходящих сообщений: меньше - раньше
+PRIORITY_CUSTOMER = 0   # ответы покупателям в мастере заказа
+PRIORITY_ADMIN = 5      # ответы на команды администраторов
+PRIORITY_SELLER = 10    # уведомления и сводки продавцу
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: reserve() сразу занимает токен и
+    возвращает, сколько секунд нужно подождать до его появления."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float = 1.0) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= cost
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+async def _timed_call(endpoint: str, callback, args, kwargs):
+    """Выполняет запрос к Bot API, записывая его длительность и ошибки в метрики"""
+    start = time.perf_counter()
+    try:
+        return await callback(*args, **kwargs)
+    except Exception as e:
+        metrics.inc('bot_api_errors_total', endpoint=endpoint, error=type(e).__name__)
+        raise
+    finally:
+        metrics.observe('bot_api_seconds', time.perf_counter() - start, endpoint=endpoint)
+
+
+class _OutboundJob:
+    __slots__ = ('callback', 'args', 'kwargs', 'endpoint', 'chat_id', 'future', 'enqueued_at', 'reserved', 'attempts')
+
+    def __init__(self, callback, args, kwargs, endpoint, chat_id, future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.reserved = False
+        self.attempts = 0
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    """Очередь исходящих запросов бота с ограничением частоты и приоритетами.
+
+    Подключается через ApplicationBuilder.rate_limiter(), поэтому через нее
+    проходят все запросы общего бота, адресованные чату. Ограничения:
+    глобальное (~30 сообщений/с), на личный чат (~1 сообщение/с с небольшим
+    запасом) и на группу (~20 сообщений/мин). Запросы без chat_id (getMe,
+    answerCallbackQuery и т.п.) не ограничиваются.
+
+    Приоритет задается через rate_limit_args=PRIORITY_*; без него запросы в
+    личные чаты администраторов (ответы на их команды) идут с PRIORITY_ADMIN,
+    в чаты продавца - с PRIORITY_SELLER, остальные - с PRIORITY_CUSTOMER. RetryAfter приостанавливает всю очередь на
+    запрошенное Telegram время, после чего запрос повторяется.
+    """
+
+    def __init__(self, seller_chat_ids=(), admin_chat_ids=(), global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 group_rate_per_minute: float = OUTBOUND_GROUP_RATE_PER_MINUTE,
+                 workers: int = OUTBOUND_WORKERS, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.seller_chat_ids = {str(chat_id) for chat_id in seller_chat_ids}
+        self.admin_chat_ids = {str(chat_id) for chat_id in admin_chat_ids}
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.group_burst = group_rate_per_minute
+        self.workers = workers
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        # Метрики
+        self.deferred = 0
+        self.max_queue_depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retry_after_hits = 0
+        self._wait_times = collections.deque(maxlen=1000)
+
+    async def initialize(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Очередь исходящих сообщений запущена ({self.workers} обработчиков)")
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Запросы, оставшиеся в очереди, завершаем ошибкой, чтобы вызывающие не зависли
+        while self._queue is not None and not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Очередь исходящих сообщений остановлена"))
+        logger.info(f"Очередь исходящих сообщений остановлена: {self.snapshot()}")
+
+    def _bucket_for(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Периодически убираем корзины простаивающих чатов, чтобы словарь не рос
+            if len(self._chat_buckets) > 10000:
+                for key, old_bucket in list(self._chat_buckets.items()):
+                    if old_bucket.is_full():
+                        del self._chat_buckets[key]
+            # Отрицательный id или @username - группа/канал
+            if chat_id.startswith('-') or not chat_id.lstrip('-').isdigit():
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _put(self, priority: int, job: _OutboundJob):
+        self._queue.put_nowait((priority, next(self._sequence), job))
+        depth = self._queue.qsize() + self.deferred
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _requeue_later(self, delay: float, priority: int, job: _OutboundJob):
+        def put_back():
+            self.deferred -= 1
+            self._put(priority, job)
+        self.deferred += 1
+        asyncio.get_running_loop().call_later(delay, put_back)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None or not self._tasks:
+            return await _timed_call(endpoint, callback, args, kwargs)
+
+        chat_id = str(chat_id)
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        elif chat_id in self.admin_chat_ids:
+            priority = PRIORITY_ADMIN
+        elif chat_id in self.seller_chat_ids:
+            priority = PRIORITY_SELLER
+        else:
+            priority = PRIORITY_CUSTOMER
+
+        future = asyncio.get_running_loop().create_future()
+        self._put(priority, _OutboundJob(callback, args, kwargs, endpoint, chat_id, future))
+        return await future
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            if job.future.done():
+                continue
+
+            # Лимит чата: если токена нет, откладываем запрос, не занимая обработчик
+            if not job.reserved:
+                job.reserved = True
+                delay = self._bucket_for(job.chat_id).reserve()
+                if delay > 0:
+                    self._requeue_later(delay, priority, job)
+                    continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            delay = self._global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self._wait_times.append(time.monotonic() - job.enqueued_at)
+            try:
+                result = await _timed_call(job.endpoint, job.callback, job.args, job.kwargs)
+            except RetryAfter as e:
+                self.retry_after_hits += 1
+                metrics.inc('send_retries_total', reason='queue_retry_after')
+                retry_after = e.retry_after
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                # Telegram ограничил бота целиком - приостанавливаем всю очередь
+                self._paused_until = max(self._paused_until, time.monotonic() + float(retry_after) + 0.1)
+                job.attempts += 1
+                if job.attempts > self.max_retries:
+                    self.failed += 1
+                    metrics.inc('send_failures_total', endpoint=job.endpoint)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    logger.warning(f"Очередь: RetryAfter {retry_after} с для чата {job.chat_id}, повтор {job.attempts}/{self.max_retries}")
+                    self._put(priority, job)
+            except Exception as e:
+                self.failed += 1
+                metrics.inc('send_failures_total', endpoint=job.endpoint)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.sent += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие метрики очереди: глубина, ожидание в очереди (секунды), счетчики"""
+        waits = sorted(self._wait_times)
+        return {
+            'queue_depth': (self._queue.qsize() if self._queue else 0) + self.deferred,
+            'max_queue_depth': self.max_queue_depth,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retry_after': self.retry_after_hits,
+            'wait_avg': round(sum(waits) / len(waits), 4) if waits else 0.0,
+            'wait_p95': round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0], 4) if waits else 0.0,
+            'wait_max': round(waits[-1], 4) if waits else 0.0,
+        }
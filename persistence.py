@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import Database
+from orders import OrderDraft
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_value(value: Any) -> Any:
+    # OrderDraft сохраняется как словарь заполненных полей, прочее - строкой
+    if isinstance(value, OrderDraft):
+        return value.to_dict()
+    return str(value)
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит context.user_data (включая историю шагов мастера) в таблице sessions.
+
+    Application сам вызывает update_user_data раз в update_interval секунд и
+    только для пользователей, у которых были обновления. Здесь данные лишь
+    складываются в буфер, а в базу уходят одной транзакцией на весь цикл
+    (и при остановке бота через flush), поэтому сообщение пользователя не
+    стоит отдельной записи на диск. chat_data, bot_data и callback_data не хранятся.
+    """
+
+    def __init__(self, db: Database, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self._initialized = False
+        # user_id -> (JSON-строка, время последней активности), ждущие записи в базу
+        self._pending: Dict[int, Tuple[str, float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _ensure_db(self):
+        # get_user_data вызывается в Application.initialize(), раньше post_init
+        if not self._initialized:
+            await self.db.initialize()
+            self._initialized = True
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        await self._ensure_db()
+        user_data = {}
+        for user_id, raw in (await self.db.load_sessions()).items():
+            try:
+                data = json.loads(raw)
+                if isinstance(data.get('draft'), dict):
+                    data['draft'] = OrderDraft.from_dict(data['draft'])
+                user_data[user_id] = data
+            except (json.JSONDecodeError, TypeError):
+                logger.warning(f"Повреждена сохраненная сессия пользователя {user_id}, пропускаем")
+        logger.info(f"Восстановлено сессий пользователей: {len(user_data)}")
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # Application передает глубокую копию, сериализуем сразу и откладываем запись
+        self._pending[user_id] = (json.dumps(data, ensure_ascii=False, default=_encode_value), time.time())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Даем Application передать остальных пользователей этого цикла, затем пишем всех разом
+        await asyncio.sleep(0)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сессий: {e}")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await self.db.save_sessions([(user_id, raw, ts) for user_id, (raw, ts) in batch.items()])
+                logger.debug(f"Сохранено сессий: {len(batch)}")
+            except Exception:
+                # Возвращаем в буфер то, что не успели перезаписать более свежими данными
+                for user_id, entry in batch.items():
+                    self._pending.setdefault(user_id, entry)
+                raise
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending.pop(user_id, None)
+        await self.db.delete_sessions([user_id])
+
+    async def expired_user_ids(self, ttl_seconds: float) -> List[int]:
+        """ID пользователей, не проявлявших активности дольше ttl_seconds"""
+        cutoff = time.time() - ttl_seconds
+        return [user_id for user_id in await self.db.get_expired_session_ids(cutoff)
+                if user_id not in self._pending]
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        """Данные пользователя меняет только этот процесс - обновлять нечего"""
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        """ConversationHandler не используется"""
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        """chat_data не хранится"""
+
+    async def update_bot_data(self, data) -> None:
+        """bot_data не хранится"""
+
+    async def update_callback_data(self, data) -> None:
+        """callback_data не хранится"""
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        """chat_data не хранится"""
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        """chat_data не хранится"""
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        """bot_data не хранится"""
@@ -31,7 +31,8 @@ fi
 
 # Запустить бота в фоновом режиме с использованием python из venv
 echo "Запуск бота с использованием $PYTHON_EXEC..."
-nohup $PYTHON_EXEC doraborka.py > bot.log 2>&1 &
+# bot.log ведет сам бот (с ротацией), сюда попадает только вывод процесса
+nohup $PYTHON_EXEC doraborka.py > output.log 2>&1 &
 
 # Проверить, что бот запустился
 sleep 2
@@ -39,7 +40,7 @@ BOT_PID=$(pgrep -f "$PYTHON_EXEC doraborka.py")
 if [ -n "$BOT_PID" ]; then
     echo "Бот успешно запущен с PID: $BOT_PID"
 else
-    echo "Ошибка при запуске бота. Проверьте лог-файл bot.log"
+    echo "Ошибка при запуске бота. Проверьте файлы bot.log и output.log"
 fi
 
 # Деактивировать окружение, если активировали
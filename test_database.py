@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Проверка базы данных заказов (database.py) на временном файле SQLite.
+
+Запуск: python test_database.py (или pytest test_database.py).
+"""
+
+import asyncio
+import csv
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+
+from database import Database, DuplicateOrderError, SCHEMA_MIGRATIONS, product_mapping
+from export import export_orders, parse_export_args
+from metrics import metrics
+from order_search import build_match_query
+from order_stats import StatsQuery, format_order_stats, parse_stats_args
+from orders import OrderDraft, idempotency_keys
+
+
+def run_with_db(check, **db_options):
+    async def runner():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = Database(os.path.join(tmp_dir, 'test.db'), **db_options)
+            await db.initialize()
+            try:
+                await check(db)
+            finally:
+                await db.close()
+    asyncio.run(runner())
+
+
+def test_group_commit():
+    async def check(db):
+        draft = OrderDraft(product='Сумка', size='M', options=['Застёжка'], contact='+79990000000')
+        batches = metrics.counter_value('db_order_batches_total')
+        order_ids = await asyncio.gather(*(db.add_order(1000 + number, f"user{number}", draft) for number in range(25)))
+        # Одновременные заказы записаны несколькими транзакциями, каждый вызов получил свой id
+        assert sorted(order_ids) == list(range(1, 26))
+        assert metrics.counter_value('db_order_batches_total') - batches < 25
+        order = await db.get_order_by_id(order_ids[7])
+        assert order['user_id'] == 1007 and order['options'] == ['Застёжка']
+
+        assert await db.add_orders([(1, 'a', {'product': 'bag'}), (2, 'b', {'product': 'coaster'})]) == [26, 27]
+
+    run_with_db(check, batch_max_rows=10)
+
+
+def test_failed_order_does_not_abort_batch():
+    async def check(db):
+        async with db._write() as conn:
+            await conn.execute("CREATE TRIGGER reject_bad BEFORE INSERT ON orders WHEN NEW.username = 'bad' "
+                               "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+        results = await asyncio.gather(
+            db.add_order(1, 'good', {'product': 'bag'}),
+            db.add_order(2, 'bad', {'product': 'bag'}),
+            db.add_order(3, 'good', {'product': 'bag'}),
+            return_exceptions=True,
+        )
+        assert isinstance(results[1], Exception)
+        assert all(isinstance(result, int) for result in (results[0], results[2]))
+        assert (await db.get_order_by_id(results[2]))['user_id'] == 3
+
+    run_with_db(check)
+
+
+def test_synchronous_commit():
+    async def check(db):
+        async with db._write() as conn:
+            async with conn.execute('PRAGMA synchronous') as cursor:
+                assert (await cursor.fetchone())[0] == 2  # FULL
+        assert await db.add_order(1, 'a', {'product': 'bag'}) == 1
+
+    run_with_db(check, synchronous_commit=True)
+
+
+def test_orders_page_cursors():
+    async def check(db):
+        # 12 заказов, каждый третий (id 3, 6, 9, 12) - done
+        await db.add_orders([(number, f"user{number}", {'product': 'bag'}) for number in range(12)])
+        for order_id in (3, 6, 9, 12):
+            await db.update_order_status(order_id, 'done')
+
+        async def ids(**kwargs):
+            page = await db.get_orders_page(**kwargs)
+            return [order.id for order in page['orders']], page['next_cursor'], page['prev_cursor']
+
+        assert await ids(limit=5) == ([12, 11, 10, 9, 8], 8, None)
+        assert await ids(limit=5, before_id=8) == ([7, 6, 5, 4, 3], 3, 7)
+        assert await ids(limit=5, before_id=3) == ([2, 1], None, 2)
+        # Назад с последней страницы возвращает ту же среднюю страницу
+        assert await ids(limit=5, after_id=2) == ([7, 6, 5, 4, 3], 3, 7)
+        assert await ids(limit=5, after_id=7) == ([12, 11, 10, 9, 8], 8, None)
+
+        # Курсоры учитывают фильтр: соседние страницы - только заказы с тем же статусом
+        assert await ids(limit=2, status='done') == ([12, 9], 9, None)
+        assert await ids(limit=2, before_id=9, status='done') == ([6, 3], None, 6)
+        assert await ids(limit=2, after_id=6, status='done') == ([12, 9], 9, None)
+        assert await ids(limit=3, before_id=10, status='new') == ([8, 7, 5], 5, 8)
+        assert await ids(limit=3, status='cancelled') == ([], None, None)
+
+    run_with_db(check)
+
+
+def test_order_notes():
+    async def check(db):
+        order_id = await db.add_order(1, 'a', {'product': 'bag'})
+        other_id = await db.add_order(2, 'b', {'product': 'bag'})
+        # Одновременные заметки не теряются
+        results = await asyncio.gather(*(db.add_order_note(order_id, f"заметка {number}", author='admin')
+                                         for number in range(10)))
+        assert all(results)
+        assert not await db.add_order_note(999, "нет такого заказа")
+
+        notes = await db.get_latest_notes([order_id, other_id], limit=3)
+        assert [note['text'] for note in notes[order_id]] == ["заметка 7", "заметка 8", "заметка 9"]
+        assert other_id not in notes
+        order = await db.get_order_by_id(order_id)
+        assert order['notes'].endswith("(admin) заметка 9") and order['notes'].count("\n") == 2
+
+    run_with_db(check)
+
+
+def test_legacy_notes_migration():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'legacy.db')
+        # База до миграции 4: заметки одним текстом в orders.notes
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+                         "username TEXT, order_date TEXT NOT NULL, product_type TEXT, size TEXT, shape TEXT, "
+                         "material TEXT, color TEXT, options TEXT, custom_description TEXT, custom_photos TEXT, "
+                         "contact TEXT, status TEXT DEFAULT 'new', notes TEXT, total_price REAL)")
+            conn.execute("INSERT INTO orders (user_id, order_date, notes) VALUES (1, '2024-01-01 10:00:00', ?)",
+                         ("[2024-01-02 11:00] позвонить\n[2024-01-03 12:30] оплачено\nналичными",))
+            for version, statements in SCHEMA_MIGRATIONS:
+                if version < 4:
+                    for statement in statements:
+                        conn.execute(statement)
+            conn.execute("PRAGMA user_version = 3")
+
+        async def check():
+            db = Database(path)
+            await db.initialize()
+            try:
+                notes = (await db.get_latest_notes([1]))[1]
+                assert [(note['ts'], note['text']) for note in notes] == [
+                    ('2024-01-02 11:00:00', 'позвонить'), ('2024-01-03 12:30:00', 'оплачено\nналичными')]
+            finally:
+                await db.close()
+
+        asyncio.run(check())
+
+
+def test_failed_migration_is_rolled_back():
+    async def check(db):
+        version = SCHEMA_MIGRATIONS[-1][0]
+        # Сбой после ALTER TABLE: столбец не должен остаться без новой версии схемы
+        SCHEMA_MIGRATIONS.append((version + 1, ['ALTER TABLE orders ADD COLUMN broken TEXT', 'SELECT * FROM no_such_table']))
+        try:
+            try:
+                await db._migrate(db._writer)
+                raise AssertionError("Миграция должна завершиться ошибкой")
+            except sqlite3.OperationalError:
+                pass
+        finally:
+            SCHEMA_MIGRATIONS.pop()
+        async with db._read() as conn:
+            async with conn.execute('PRAGMA user_version') as cursor:
+                assert (await cursor.fetchone())[0] == version
+            async with conn.execute('PRAGMA table_info(orders)') as cursor:
+                assert 'broken' not in [row['name'] for row in await cursor.fetchall()]
+        assert await db.add_order(1, 'a', {'product': 'bag'}) == 1
+
+    run_with_db(check)
+
+
+def test_idempotency_key():
+    async def check(db):
+        # Два одновременных вызова с одним ключом: второй отклоняется, пока первый еще записывается
+        results = await asyncio.gather(db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='k1'),
+                                       db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='k1'),
+                                       return_exceptions=True)
+        assert results[0] == 1 and isinstance(results[1], DuplicateOrderError)
+        # Повтор из кэша возвращает ID уже созданного заказа
+        try:
+            await db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='k1')
+            raise AssertionError("Повтор должен быть отклонен")
+        except DuplicateOrderError as e:
+            assert e.order_id == 1
+        # Ключ вытеснен из кэша (размер 1) - повтор отклоняет уникальный индекс, в том числе внутри пачки
+        assert await db.add_order(2, 'b', {'product': 'bag'}, idempotency_key='k2') == 2
+        results = await asyncio.gather(db.add_order(3, 'c', {'product': 'bag'}),
+                                       db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='k1'),
+                                       return_exceptions=True)
+        assert results[0] == 3 and isinstance(results[1], DuplicateOrderError) and results[1].order_id == 1
+        assert len((await db.get_orders_page(limit=10))['orders']) == 3
+
+        # Повтор через 2 с на границе интервалов: ключ другой, но совпадает ключ предыдущего интервала
+        first = idempotency_keys('mini_app', 7, '{"product": "bag"}', 1_700_000_399, 600)
+        resend = idempotency_keys('mini_app', 7, '{"product": "bag"}', 1_700_000_401, 600)
+        assert first[0] != resend[0] and first[0] == resend[1]
+        order_id = await db.add_order(7, 'g', {'product': 'bag'}, idempotency_key=first[0],
+                                      previous_idempotency_key=first[1])
+        for _ in range(2):  # из кэша, затем (после вытеснения ключа из кэша) из базы
+            try:
+                await db.add_order(7, 'g', {'product': 'bag'}, idempotency_key=resend[0],
+                                   previous_idempotency_key=resend[1])
+                raise AssertionError("Повтор на границе интервалов должен быть отклонен")
+            except DuplicateOrderError as e:
+                assert e.order_id == order_id
+            assert await db.add_order(8, 'h', {'product': 'bag'}, idempotency_key=f"other{_}") > order_id
+        assert len((await db.get_orders_page(limit=10))['orders']) == 6
+
+    run_with_db(check, idempotency_cache_size=1)
+
+
+def test_cancelled_order_keeps_key():
+    async def check(db):
+        # Вызов отменен, пока заказ ждал групповой записи: заказ все равно записан, и ключ ведет на него
+        task = asyncio.create_task(db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='wizard:1:msg5'))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+            raise AssertionError("Вызов должен быть отменен")
+        except asyncio.CancelledError:
+            pass
+        await db._flush_task
+        assert db._order_keys['wizard:1:msg5'] == 1   # ключ уточнен по итогу записи, а не удален
+        try:
+            await db.add_order(1, 'a', {'product': 'bag'}, idempotency_key='wizard:1:msg5')
+            raise AssertionError("Повтор после отмены должен быть отклонен")
+        except DuplicateOrderError as e:
+            assert e.order_id == 1
+        assert len((await db.get_orders_page(limit=10))['orders']) == 1
+
+    run_with_db(check)
+
+
+def test_export():
+    assert parse_export_args(['2024-01-01', '2024-01-31', 'new', 'jsonl'], ['new']) == (
+        '2024-01-01', '2024-02-01', 'new', 'jsonl')
+    for bad_args in (['вчера'], ['2024-02-01', '2024-01-01']):
+        try:
+            parse_export_args(bad_args, ['new'])
+            raise AssertionError(f"Аргументы должны быть отклонены: {bad_args}")
+        except ValueError:
+            pass
+
+    async def check(db):
+        await db.add_orders([(number, f"user{number}", {'product': 'bag', 'options': ['Застёжка', 'Подклад']})
+                             for number in range(25)])
+        await db.add_order(1, '@user1', {'product': 'custom', 'custom_description': '=HYPERLINK("http://evil")'})
+        await db.add_order(2, 'user2', {'product': 'custom', 'custom_description': 'обычный текст',
+                                        'contact': '+7 999 123-45-67'})
+        await db.update_order_status(3, 'done')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'orders.csv')
+            assert await export_orders(db.iter_orders(batch_size=4), csv_path, 'csv', chunk_rows=10) == 27
+            with open(csv_path, encoding='utf-8-sig', newline='') as csv_file:
+                rows = list(csv.DictReader(csv_file))
+            assert [int(row['id']) for row in rows] == list(range(1, 28))
+            assert rows[0]['options'] == 'Застёжка, Подклад'
+            # Текст покупателя, похожий на формулу, не выполняется в Excel
+            assert rows[25]['custom_description'] == "'=HYPERLINK(\"http://evil\")" and rows[25]['username'] == "'@user1"
+            assert rows[26]['custom_description'] == 'обычный текст' and rows[26]['contact'] == "'+7 999 123-45-67"
+
+            jsonl_path = os.path.join(tmp_dir, 'orders.jsonl.gz')
+            assert await export_orders(db.iter_orders(status='done'), jsonl_path, 'jsonl') == 1
+            with gzip.open(jsonl_path, 'rt', encoding='utf-8') as jsonl_file:
+                records = [json.loads(line) for line in jsonl_file]
+            assert records[0]['id'] == 3 and records[0]['options'] == ['Застёжка', 'Подклад']
+
+    run_with_db(check)
+
+
+def test_order_stats():
+    today = datetime.date(2024, 3, 10)
+    statuses = ['new', 'done']
+
+    def parse(*args):
+        return parse_stats_args(list(args), statuses, product_mapping, today)
+
+    assert parse('3') == ('2024-03-08', '2024-03-11', None, None, 'за 3 дн. (с 2024-03-08)')
+    assert parse('2024-03-01', '2024-03-05')[:2] == ('2024-03-01', '2024-03-06')
+    assert parse('all')[:2] == (None, None)
+    assert parse('7', 'new', 'bag')[1:4] == ('2024-03-11', 'new', 'Сумка')
+    assert parse('сумка', 'done') == parse('done', 'bag')
+    for bad_args in (['3', 'all'], ['вчера'], ['2024-03-05', '2024-03-01']):
+        try:
+            parse(*bad_args)
+            raise AssertionError(f"Аргументы должны быть отклонены: {bad_args}")
+        except ValueError:
+            pass
+
+    async def check(db):
+        await db.add_orders([(1, 'a', {'product': 'bag', 'material': 'akril', 'total_price': 100}),
+                             (2, 'b', {'product': 'bag', 'material': 'akril', 'total_price': 50}),
+                             (3, 'c', {'product': 'coaster', 'material': 'hrustal'})])
+        await db.update_order_status(1, 'done')
+
+        async def snapshot():
+            return sorted(tuple(row.values()) for row in await db.get_order_stats())
+
+        # Сводка, поддержанная триггерами, совпадает с пересчетом с нуля
+        maintained = await snapshot()
+        assert maintained == [('done', 'Сумка', 'Акрил', 1, 100.0), ('new', 'Подстаканник', 'Хрусталь', 1, 0.0),
+                              ('new', 'Сумка', 'Акрил', 1, 50.0)], maintained
+        assert await db.rebuild_order_stats() == 3
+        assert await snapshot() == maintained
+
+        tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+        assert await db.get_order_stats(date_from=tomorrow) == []
+        everything = StatsQuery(None, None, None, None, 'за все время')
+        text = format_order_stats(await db.get_order_stats(), everything)
+        assert text.startswith('Заказы за все время: 3, выручка 150 ₽'), text
+
+        # Новые сумки по материалам: фильтры уходят в WHERE, остается разбивка по материалу
+        new_bags = everything._replace(status='new', product_type='Сумка')
+        rows = await db.get_order_stats(status='new', product_type='Сумка')
+        assert [(row['material'], row['orders']) for row in rows] == [('Акрил', 1)]
+        text = format_order_stats(rows, new_bags)
+        assert text.startswith('Заказы за все время (new, Сумка): 1, выручка 50 ₽'), text
+        assert 'По материалу:\n  Акрил: 1 / 50 ₽' in text and 'По статусу' not in text and 'По типу' not in text
+
+    run_with_db(check)
+
+
+def test_search():
+    assert build_match_query('клатч "из бусин" +7 (999) 123-45-67') == (
+        '"клатч" AND "из бусин" AND ("79991234567" OR "+7 (999) 123-45-67")')
+    # Короткие числа - отдельные слова, а не склеенный "телефон"
+    assert build_match_query('клатч 25 40') == '"клатч"'
+    assert build_match_query('заказ 2024 12') == '"заказ" AND "2024"'
+    for bad_query in ('', 'ab', '"x"'):
+        try:
+            build_match_query(bad_query)
+            raise AssertionError(f"Запрос должен быть отклонен: {bad_query!r}")
+        except ValueError:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'search.db')
+
+        async def create_orders():
+            db = Database(path)
+            await db.initialize()
+            await db.add_orders([(number, f"user{number}", {
+                'product': 'custom', 'custom_description': f"Клатч из бусин №{number}",
+                'contact': f"+7 (999) 123-45-{number:02d}"}) for number in range(12)])
+            await db.add_order_note(5, 'перезвонить вечером', author='anna')
+            await db.close()
+
+        asyncio.run(create_orders())
+        # Заказы, созданные до появления индекса: индекс пуст, их заполняет backfill
+        with sqlite3.connect(path) as conn:
+            conn.execute("DELETE FROM orders_search")
+            conn.execute("INSERT INTO search_backfill (next_id, last_id) SELECT MIN(id), MAX(id) FROM orders")
+
+        async def check():
+            db = Database(path)
+            await db.initialize()
+            try:
+                assert (await db.search_orders(build_match_query('клатч')))['orders'] == []
+                new_id = await db.add_order(99, 'newbie', {'product': 'custom', 'custom_description': 'клатч'})
+                assert await db.backfill_search_index(batch_size=5, pause=0) == 12
+                assert await db.search_backfill_progress() is None
+
+                first = await db.search_orders(build_match_query('КЛАТЧ'), limit=10)
+                second = await db.search_orders(build_match_query('КЛАТЧ'), limit=10, offset=10)
+                assert first['has_more'] and not second['has_more']
+                # Самое короткое описание - лучшее совпадение
+                assert first['orders'][0].id == new_id
+                assert len({order.id for order in first['orders'] + second['orders']}) == 13
+
+                found = await db.search_orders(build_match_query('999 123-45-07'))
+                assert [order.id for order in found['orders']] == [8]
+                found = await db.search_orders(build_match_query('вечером anna'))
+                assert [order.id for order in found['orders']] == [5] and 'перезвонить' in found['orders'][0].notes
+
+                await db.add_order_note(3, 'упаковать в коробку')
+                await db.update_order_status(3, 'done')
+                found = await db.search_orders(build_match_query('коробк'))
+                assert [order.id for order in found['orders']] == [3] and found['snippets'][3] == 'упаковать в коробку'
+            finally:
+                await db.close()
+
+        asyncio.run(check())
+
+
+if __name__ == "__main__":
+    test_group_commit()
+    test_failed_order_does_not_abort_batch()
+    test_synchronous_commit()
+    test_orders_page_cursors()
+    test_order_notes()
+    test_legacy_notes_migration()
+    test_failed_migration_is_rolled_back()
+    test_idempotency_key()
+    test_cancelled_order_keeps_key()
+    test_export()
+    test_order_stats()
+    test_search()
+    print("Проверка базы данных пройдена")
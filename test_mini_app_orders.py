@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Проверка приема заказов из Mini App (mini_app.py и SumkiBot.handle_webapp_data).
+
+Разбор данных проверяется напрямую, прием заказа - через локальную заглушку
+Bot API: заказ из test_data.json должен попасть в базу и уйти продавцу.
+Запуск: python test_mini_app_orders.py (или pytest test_mini_app_orders.py).
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from telegram import Update
+
+import doraborka
+from fake_bot_api import FakeBotAPI
+import mini_app
+from mini_app import MiniAppOrderError, parse_order
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_ID = 12345678
+
+
+def load_sample() -> str:
+    with open(os.path.join(BASE_DIR, 'test_data.json'), encoding='utf-8') as sample_file:
+        return sample_file.read()
+
+
+def web_app_update(update_id: int, data: str) -> dict:
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Test', 'username': 'testuser'},
+        'web_app_data': {'data': data, 'button_text': 'Оформить заказ'},
+    }}
+
+
+def test_parse_order():
+    order = parse_order(load_sample())
+    assert order['product'] == 'bag'
+    assert (order['shape'], order['material']) == ('Круглая', 'Акрил')
+    assert order['options'] == ['застежка', 'подклад']
+    assert order['contact'] == '@testuser'
+
+    custom = parse_order(json.dumps({'product': 'custom', 'customDescription': ' клатч ', 'contact': None,
+                                     'user': {'id': 1, 'phone_number': '+7999'}, 'extra': [1, 2]}))
+    assert (custom['custom_description'], custom['contact']) == ('клатч', '+7999')
+
+    # Пробелы по краям не считаются в лимит длины поля
+    padded = parse_order(json.dumps({'product': 'bag', 'color': ' ' * 50 + 'к' * 100 + ' ' * 50}))
+    assert padded['color'] == 'к' * 100
+
+    # Лимит Telegram - 4096 байт: каждое поле в своем лимите, но кириллица занимает по 2 байта на символ
+    cyrillic = json.dumps({'product': 'custom', 'customDescription': 'ж' * 1990, 'color': 'ж' * 100, 'contact': '@x'},
+                          ensure_ascii=False)
+    assert len(cyrillic) < mini_app.MAX_PAYLOAD_BYTES < len(cyrillic.encode('utf-8'))
+
+    for bad in (cyrillic, 'не json', '[]', '{}', '{"product": "car"}', '{"product": "bag", "options": [1]}',
+                '{"product": "bag", "contact": {"id": "1"}}', json.dumps({'product': 'bag', 'color': 'x' * 5000})):
+        try:
+            parse_order(bad)
+        except MiniAppOrderError:
+            continue
+        raise AssertionError(f"Данные должны быть отклонены: {bad[:50]}")
+
+
+async def run_ingestion_check():
+    api = FakeBotAPI()
+    await api.start()
+    doraborka.BOT_API_BASE_URL = api.base_url
+    doraborka.METRICS_PORT = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bot = doraborka.SumkiBot(os.path.join(tmp_dir, 'bot.db'))
+        application = bot.build_application()
+        await application.initialize()
+        await application.post_init(application)
+        try:
+            # Повторная отправка тех же данных не создает второй заказ
+            for update_id, data in ((1, load_sample()), (2, load_sample()), (3, '{"product": "car"}')):
+                await application.process_update(Update.de_json(web_app_update(update_id, data), application.bot))
+
+            page = await bot.db.get_orders_page()
+            assert [(order.product_type, order.shape, order.contact) for order in page['orders']] == [
+                ('Сумка', 'Круглая', '@testuser')]
+            seller_texts = [call['text'] for call in api.calls_to('sendMessage')
+                            if str(call['chat_id']) == str(doraborka.SELLER_CHAT_ID)]
+            assert any(text.startswith(f"Заказ #{page['orders'][0].id}\n") for text in seller_texts), seller_texts
+            replies = [call['text'] for call in api.calls_to('sendMessage') if call['chat_id'] == USER_ID]
+            assert replies == [doraborka.MESSAGES['contact_received'], doraborka.MESSAGES['order_already_sent'],
+                               doraborka.MESSAGES['webapp_invalid']], replies
+        finally:
+            await application.shutdown()
+            await application.post_shutdown(application)
+            await api.stop()
+
+
+def test_ingestion():
+    asyncio.run(run_ingestion_check())
+
+
+if __name__ == "__main__":
+    test_parse_order()
+    test_ingestion()
+    print("Проверка приема заказов из Mini App пройдена")
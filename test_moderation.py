@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Проверка фильтра нецензурной лексики (moderation.py).
+
+Запуск: python test_moderation.py (или pytest test_moderation.py).
+"""
+
+import asyncio
+
+from moderation import Moderator, ProfanityMatcher, normalize_text
+
+BLOCKED = [
+    "Это ПИЗДЕЦ какой-то",
+    "ну бля",
+    "Ёбаный дизайн",
+    "what the fuck",
+    "Sh1t happens",
+]
+
+ALLOWED = [
+    "Хочу сумку в форме сердца, цвет белый",
+    "Употреблять бляху вместо застёжки, цвет мандариновый",
+    "Застрахуйте посылку, пожалуйста",
+    "class assignment in Scunthorpe",
+    "сумка 45x30, 100 бусин",
+]
+
+
+def test_matcher_words_and_stems():
+    matcher = ProfanityMatcher(["сука", "пизд*", "fuck"])
+    assert matcher.find("Вот сука!") == "сука"
+    assert matcher.find("сукно") is None          # слово без * совпадает только целиком
+    assert matcher.find("распиздяй") is None       # основа совпадает только с начала слова
+    assert matcher.find("пиздец") == "пизд"
+    assert matcher.find("FUCK.") == "fuck"
+
+
+def test_normalize_text():
+    assert normalize_text("Sh1t и  @ss") == "shit и ass"
+    assert normalize_text("Сумка 45x30, 100 бусин!") == "сумка 45x30, 100 бусин!"   # числа не трогаются
+    assert normalize_text("su4ka 2 girls") == "suaka 2 girls"
+
+
+def test_default_wordlists():
+    moderator = Moderator(inline_limit=20, cache_size=4)
+
+    async def check():
+        for text in BLOCKED:
+            assert not await moderator.is_acceptable(text), text
+        for text in ALLOWED:
+            assert await moderator.is_acceptable(text), text
+        # Повторная проверка берется из кэша
+        hits = moderator.cache_hits
+        assert await moderator.is_acceptable(ALLOWED[-1])
+        assert moderator.cache_hits == hits + 1
+
+    try:
+        asyncio.run(check())
+    finally:
+        moderator.shutdown()
+
+
+if __name__ == "__main__":
+    test_matcher_words_and_stems()
+    test_normalize_text()
+    test_default_wordlists()
+    print("Проверка модерации пройдена")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Проверка очереди исходящих сообщений (outbound.OutboundRateLimiter).
+
+Запросы подаются напрямую в process_request, как это делает бот PTB:
+проверяются порядок по приоритетам, откладывание запросов в чат без
+свободного токена и пауза всей очереди после RetryAfter.
+Запуск: python test_outbound.py (или pytest test_outbound.py).
+"""
+
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from outbound import OutboundRateLimiter, PRIORITY_ADMIN, PRIORITY_CUSTOMER, PRIORITY_SELLER
+
+UNLIMITED = 1_000_000
+
+
+def make_limiter(**options) -> OutboundRateLimiter:
+    settings = dict(seller_chat_ids=['-100'], admin_chat_ids=['7'], global_rate=UNLIMITED,
+                    chat_rate=UNLIMITED, chat_burst=UNLIMITED, group_rate_per_minute=UNLIMITED * 60, workers=1)
+    settings.update(options)
+    return OutboundRateLimiter(**settings)
+
+
+def send(limiter: OutboundRateLimiter, callback, chat_id, rate_limit_args=None):
+    return limiter.process_request(callback, (chat_id,), {}, 'sendMessage', {'chat_id': chat_id}, rate_limit_args)
+
+
+async def run_priority_check():
+    limiter = make_limiter()
+    await limiter.initialize()
+    sent = []
+    release = asyncio.Event()
+
+    async def blocking(chat_id):
+        await release.wait()
+
+    async def record(chat_id):
+        sent.append(chat_id)
+
+    try:
+        # Единственный обработчик занят, пока остальные запросы копятся в очереди
+        first = asyncio.create_task(send(limiter, blocking, '1'))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.create_task(send(limiter, record, chat_id, priority)) for chat_id, priority in (
+            ('-100', None),               # чат продавца - PRIORITY_SELLER
+            ('7', None),                  # чат администратора - PRIORITY_ADMIN
+            ('5', None),                  # покупатель - PRIORITY_CUSTOMER
+            ('7', PRIORITY_SELLER),       # явный приоритет важнее чата
+            ('6', PRIORITY_CUSTOMER),
+        )]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, *queued)
+    finally:
+        await limiter.shutdown()
+    # Внутри одного приоритета - в порядке постановки
+    assert sent == ['5', '6', '7', '-100', '7'], sent
+    assert PRIORITY_CUSTOMER < PRIORITY_ADMIN < PRIORITY_SELLER
+
+
+async def run_chat_deferral_check():
+    # Один токен в чат и 10 сообщений в секунду: второе сообщение в тот же чат ждет ~0.1 с,
+    # а сообщение в другой чат за это время уходит без очереди
+    limiter = make_limiter(chat_rate=10, chat_burst=1)
+    await limiter.initialize()
+    sent = []
+
+    async def record(chat_id):
+        sent.append((chat_id, time.monotonic()))
+
+    try:
+        start = time.monotonic()
+        await asyncio.gather(send(limiter, record, '1'), send(limiter, record, '1'), send(limiter, record, '2'))
+    finally:
+        await limiter.shutdown()
+    assert [chat_id for chat_id, _ in sent] == ['1', '2', '1'], sent
+    assert sent[1][1] - start < 0.05 and sent[2][1] - start >= 0.08, sent
+    assert limiter.snapshot()['sent'] == 3
+
+
+async def run_retry_after_check():
+    limiter = make_limiter(workers=2)
+    await limiter.initialize()
+    attempts = []
+
+    async def limited_once(chat_id):
+        attempts.append((chat_id, time.monotonic()))
+        if len(attempts) == 1:
+            raise RetryAfter(1)
+        return chat_id
+
+    try:
+        start = time.monotonic()
+        first = asyncio.create_task(send(limiter, limited_once, '1'))
+        await asyncio.sleep(0.05)
+        # Telegram ограничил бота целиком: запрос в другой чат тоже ждет конца паузы
+        results = await asyncio.gather(first, send(limiter, limited_once, '2'))
+    finally:
+        await limiter.shutdown()
+    assert results == ['1', '2']
+    assert len(attempts) == 3 and all(ts - start >= 1.0 for _, ts in attempts[1:]), attempts
+    assert limiter.snapshot()['retry_after'] == 1
+
+
+def test_priority_order():
+    asyncio.run(run_priority_check())
+
+
+def test_chat_deferral():
+    asyncio.run(run_chat_deferral_check())
+
+
+def test_retry_after_pauses_queue():
+    asyncio.run(run_retry_after_check())
+
+
+if __name__ == "__main__":
+    test_priority_order()
+    test_chat_deferral()
+    test_retry_after_pauses_queue()
+    print("Проверка очереди исходящих сообщений пройдена")
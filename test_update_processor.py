@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Проверка порядка и параллельности обработки обновлений (update_processor.py).
+
+Обновления двух пользователей идут вперемешку: у каждого пользователя они
+должны выполняться строго по очереди, разные пользователи - одновременно, но
+не больше max_concurrent_updates обработчиков сразу.
+Запуск: python test_update_processor.py (или pytest test_update_processor.py).
+"""
+
+import asyncio
+import time
+
+from telegram import Update
+
+from update_processor import PerUserUpdateProcessor
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'text': str(update_id),
+    }}, None)
+
+
+async def run_order_check():
+    processor = PerUserUpdateProcessor(max_concurrent_updates=2)
+    started, finished = [], []
+    running = peak = 0
+
+    async def handler(update_id: int, user_id: int, delay: float):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        started.append((user_id, update_id))
+        await asyncio.sleep(delay)
+        finished.append((user_id, update_id))
+        running -= 1
+
+    # Первое обновление каждого пользователя - самое долгое: если бы порядок не соблюдался,
+    # следующие обновления того же пользователя обогнали бы его
+    plan = [(1, 1, 0.05), (2, 2, 0.05), (3, 1, 0.0), (4, 2, 0.0), (5, 1, 0.01), (6, 3, 0.0), (7, 2, 0.01)]
+    await asyncio.gather(*(processor.process_update(message_update(update_id, user_id),
+                                                    handler(update_id, user_id, delay))
+                           for update_id, user_id, delay in plan))
+
+    for user_id in (1, 2, 3):
+        expected = [update_id for update_id, owner, _ in plan if owner == user_id]
+        assert [update_id for owner, update_id in finished if owner == user_id] == expected, finished
+    # Пользователи 1 и 2 начали одновременно, не дожидаясь друг друга, но сразу не больше двух обработчиков
+    assert started[:2] == [(1, 1), (2, 2)], started
+    assert peak == 2, peak
+    # Замки пользователей удалены после обработки
+    assert processor._user_locks == {} and processor._user_waiters == {}
+
+
+async def run_concurrency_cap_check():
+    processor = PerUserUpdateProcessor(max_concurrent_updates=3)
+    running = peak = 0
+
+    async def handler():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await asyncio.gather(*(processor.process_update(message_update(update_id, 100 + update_id), handler())
+                           for update_id in range(9)))
+    # Девять разных пользователей: одновременно ровно три обработчика, а не девять и не по одному
+    assert peak == 3, peak
+
+
+def test_per_user_order():
+    asyncio.run(run_order_check())
+
+
+def test_concurrency_cap():
+    asyncio.run(run_concurrency_cap_check())
+
+
+if __name__ == "__main__":
+    test_per_user_order()
+    test_concurrency_cap()
+    print("Проверка обработки обновлений пройдена")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Проверка режима вебхука без обращения к настоящему Telegram.
+
+Поднимает локальную заглушку Bot API, запускает SumkiBot.run_webhook и
+отправляет во встроенный сервер обновление /start: с неверным секретом оно
+должно быть отклонено, с верным - обработано с ответом пользователю.
+Запуск: python test_webhook_mode.py (или pytest test_webhook_mode.py).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+import time
+
+import aiohttp
+
+import doraborka
+from fake_bot_api import FakeBotAPI
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+USER_ID = 12345
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id: int, text: str, user_id: int = USER_ID) -> dict:
+    """Собирает JSON обновления с текстовым сообщением от пользователя"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': 'testuser'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Не дождались ожидаемого вызова Bot API")
+        await asyncio.sleep(0.02)
+
+
+async def run_webhook_check():
+    api = FakeBotAPI()
+    await api.start()
+
+    port = _free_port()
+    doraborka.BOT_API_BASE_URL = api.base_url
+    doraborka.WEBHOOK_URL = 'https://bot.example.test'
+    doraborka.WEBHOOK_LISTEN = '127.0.0.1'
+    doraborka.WEBHOOK_PORT = port
+    doraborka.WEBHOOK_SECRET = 'test-secret'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bot = doraborka.SumkiBot(os.path.join(tmp_dir, 'bot.db'))
+        application = bot.build_application()
+
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(bot.run_webhook(application, stop_event))
+        try:
+            await wait_for(lambda: api.calls_to('setWebhook'))
+            assert api.calls_to('setWebhook')[0]['secret_token'] == 'test-secret'
+
+            url = f"http://127.0.0.1:{port}{doraborka.WEBHOOK_PATH}"
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json=make_update(1, '/start'),
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as response:
+                    assert response.status == 403, response.status
+                async with session.post(url, json=make_update(2, '/start'),
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': 'test-secret'}) as response:
+                    assert response.status == 200, response.status
+
+            await wait_for(lambda: any(call['chat_id'] == USER_ID for call in api.calls_to('sendMessage')))
+            replies = [call for call in api.calls_to('sendMessage') if call['chat_id'] == USER_ID]
+            assert len(replies) == 1, replies
+            logger.info("Режим вебхука работает: обновление с верным секретом обработано")
+        finally:
+            stop_event.set()
+            await task
+            await api.stop()
+
+
+def test_webhook_mode():
+    asyncio.run(run_webhook_check())
+
+
+if __name__ == "__main__":
+    asyncio.run(run_webhook_check())
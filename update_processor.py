@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates обработчиков сразу), а обновления одного пользователя -
+    строго по очереди, потому что они меняют context.user_data['stage'] и
+    историю шагов мастера context.user_data['history'] (сохраняется через
+    SQLitePersistence). Обновление, ждущее своей очереди у пользователя,
+    не занимает слот обработчика и не тормозит остальных.
+    """
+
+    __slots__ = ('_handler_slots', '_user_locks', '_user_waiters')
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 1000):
+        """
+        Args:
+            max_concurrent_updates: Сколько обработчиков может выполняться одновременно.
+            max_pending_updates: Сколько обновлений может находиться в обработке и ожидании
+                своей очереди; остальные ждут в update_queue приложения.
+        """
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._handler_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiters: Dict[int, int] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        """Ключ очереди: пользователь, а если его нет (посты каналов) - чат"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._handler_slots:
+                await coroutine
+            return
+
+        lock = self._user_locks.get(key)
+        if lock is None:
+            lock = self._user_locks[key] = asyncio.Lock()
+        self._user_waiters[key] = self._user_waiters.get(key, 0) + 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке FIFO, т.е. в порядке прихода обновлений
+            async with lock:
+                async with self._handler_slots:
+                    await coroutine
+        finally:
+            # Удаляем замок, когда у пользователя не осталось обновлений, чтобы словарь не рос
+            self._user_waiters[key] -= 1
+            if not self._user_waiters[key]:
+                del self._user_waiters[key]
+                del self._user_locks[key]
+
+    async def initialize(self) -> None:
+        """Ресурсы не нужны"""
+
+    async def shutdown(self) -> None:
+        """Ресурсы не нужны"""
@@ -0,0 +1,69 @@
+import hmac
+import json
+import logging
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает secret_token из setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Встроенный aiohttp-сервер, принимающий обновления Telegram по вебхуку.
+
+    Каждый запрос только проверяет секрет, разбирает Update и кладет его в
+    application.update_queue, поэтому ответ Telegram уходит сразу, а обработка
+    идет в Application параллельно с приемом следующих обновлений.
+    """
+
+    def __init__(self, application: Application, path: str, secret_token: Optional[str],
+                 listen: str = '127.0.0.1', port: int = 8443):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.listen = listen
+        self.port = port
+        self.web_app = web.Application()
+        self.web_app.router.add_post(path, self.handle_update)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Принимает одно обновление от Telegram"""
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                logger.warning(f"Вебхук: запрос с неверным секретом от {request.remote}")
+                return web.Response(status=403)
+
+        try:
+            data = await request.json(loads=json.loads)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Вебхук: не удалось разобрать обновление: {e}")
+            return web.Response(status=400)
+
+        if update is None:
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self):
+        """Запускает HTTP-сервер"""
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Вебхук-сервер слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Останавливает HTTP-сервер"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("Вебхук-сервер остановлен")
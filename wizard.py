@@ -0,0 +1,142 @@
+"""
+Описание мастера заказа в виде таблиц.
+
+Маршрут каждого продукта - кортеж шагов, поле черновика, которое заполняет
+шаг, и раскладки клавиатур задаются здесь декларативно. По ним один раз при
+импорте строятся таблица переходов (продукт, шаг) -> следующий шаг и готовые
+клавиатуры с заранее сериализованной разметкой, поэтому обработка сообщения -
+это поиск в словарях без цепочек if/elif. Чтобы добавить продукт, достаточно описать его
+маршрут в PRODUCT_FLOWS и, при необходимости, раскладку опций в KEYBOARD_LAYOUTS.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+
+BUTTON_BACK = "Назад"
+BUTTON_CANCEL = "Отменить заказ"
+BUTTON_START_ORDER = "Оформить заказ"
+BUTTON_FINISH_OPTIONS = "Завершить выбор"
+BUTTON_FINISH_DESCRIPTION = "Завершить описание"
+
+PRODUCT_BAG = "Сумка"
+PRODUCT_COASTER = "Подстаканник"
+PRODUCT_CUSTOM = "Нестандартный заказ"
+
+# Маршрут мастера для каждого продукта: шаги после выбора продукта
+PRODUCT_FLOWS: Dict[str, Tuple[str, ...]] = {
+    PRODUCT_BAG: ('choose_size', 'choose_shape', 'choose_material', 'choose_color', 'choose_options', 'preview'),
+    PRODUCT_COASTER: ('choose_material', 'choose_color', 'choose_options', 'preview'),
+    PRODUCT_CUSTOM: ('custom_order', 'contact'),
+}
+
+# Шаги, на которых ответ пользователя записывается в поле черновика
+STEP_FIELDS: Dict[str, str] = {
+    'choose_size': 'size',
+    'choose_shape': 'shape',
+    'choose_material': 'material',
+    'choose_color': 'color',
+}
+
+# Раскладки клавиатур: (шаг, продукт) -> ряды кнопок; продукт None - для всех продуктов
+KEYBOARD_LAYOUTS: Dict[Tuple[str, Optional[str]], List[List[str]]] = {
+    ('start', None): [[BUTTON_START_ORDER], ["Заказать через приложение"]],
+    ('cancelled', None): [[BUTTON_START_ORDER]],
+    ('choose_product', None): [[PRODUCT_BAG, PRODUCT_COASTER], [PRODUCT_CUSTOM]],
+    ('choose_size', None): [
+        ["S (микросумка)"],
+        ["M (влезает телефон и картхолдер)"],
+        ["L (на 5 см больше размера M)"],
+        [BUTTON_BACK],
+    ],
+    ('choose_shape', None): [
+        ["Круглая", "Прямоугольная"],
+        ["Трапеция", "Квадратная"],
+        ["Месяц", "Сердце"],
+        [BUTTON_BACK],
+    ],
+    ('choose_material', None): [["Акрил"], ["Хрусталь", "Swarovski"], [BUTTON_BACK]],
+    ('choose_color', None): [["Белый", "Чёрный"], ["Синий", "Зелёный"], [BUTTON_BACK]],
+    # Дополнительные опции зависят от продукта
+    ('choose_options', PRODUCT_BAG): [["Застёжка", "Подклад"], ["Ручка-цепочка"], [BUTTON_BACK, BUTTON_FINISH_OPTIONS]],
+    ('choose_options', PRODUCT_COASTER): [["Короткая ручка", "Ручка-цепочка"], [BUTTON_BACK, BUTTON_FINISH_OPTIONS]],
+    ('choose_options', None): [[BUTTON_BACK, BUTTON_FINISH_OPTIONS]],
+    ('custom_order', None): [[BUTTON_BACK]],
+    ('custom_order_saved', None): [[BUTTON_FINISH_DESCRIPTION, BUTTON_BACK]],
+}
+
+# Глубина истории шагов для кнопки "Назад": маршрут не длиннее десятка шагов,
+# ограничение лишь защищает сохраняемую сессию от бесконечного роста
+HISTORY_LIMIT = 20
+
+
+def _build_next_steps() -> Dict[Tuple[str, str], str]:
+    next_steps = {}
+    for product, flow in PRODUCT_FLOWS.items():
+        next_steps[(product, 'choose_product')] = flow[0]
+        for step, following in zip(flow, flow[1:]):
+            next_steps[(product, step)] = following
+    return next_steps
+
+
+NEXT_STEP: Dict[Tuple[str, str], str] = _build_next_steps()
+
+
+class CachedReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """ReplyKeyboardMarkup, который сериализуется один раз.
+
+    Bot API вызывает to_dict() у разметки при каждой отправке, обходя все
+    кнопки; здесь словарь и JSON строятся при создании и затем только
+    возвращаются. Объект неизменяем (как и все TelegramObject), поэтому кэш
+    не устаревает. Возвращаемый словарь общий - изменять его нельзя.
+    """
+
+    __slots__ = ('_cached_dict', '_cached_json')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_dict = super().to_dict()
+        self._cached_json = json.dumps(self._cached_dict)
+
+    def to_dict(self, recursive: bool = True) -> Dict[str, Any]:
+        if not recursive:
+            return super().to_dict(recursive=False)
+        return self._cached_dict
+
+    def to_json(self) -> str:
+        return self._cached_json
+
+
+def build_keyboards() -> Dict[Tuple[str, Optional[str]], CachedReplyKeyboardMarkup]:
+    """Строит все клавиатуры мастера по KEYBOARD_LAYOUTS (вызывается один раз при импорте)"""
+    keyboards = {
+        key: CachedReplyKeyboardMarkup(rows, resize_keyboard=True) for key, rows in KEYBOARD_LAYOUTS.items()
+    }
+    keyboards[('contact', None)] = CachedReplyKeyboardMarkup(
+        [[KeyboardButton("Поделиться контактом", request_contact=True)]], resize_keyboard=True
+    )
+    return keyboards
+
+
+KEYBOARDS: Dict[Tuple[str, Optional[str]], CachedReplyKeyboardMarkup] = build_keyboards()
+
+
+def next_step(product: Optional[str], step: str) -> Optional[str]:
+    """Следующий шаг маршрута продукта или None, если переход не описан"""
+    return NEXT_STEP.get((product, step))
+
+
+def keyboard_for(step: str, product: Optional[str] = None) -> CachedReplyKeyboardMarkup:
+    """Готовая клавиатура шага: своя для продукта, если есть, иначе общая"""
+    keyboard = KEYBOARDS.get((step, product))
+    if keyboard is None:
+        keyboard = KEYBOARDS[(step, None)]
+    return keyboard
+
+
+def push_history(history: List[str], step: str) -> None:
+    """Добавляет шаг в историю, отбрасывая самые старые записи сверх HISTORY_LIMIT"""
+    history.append(step)
+    if len(history) > HISTORY_LIMIT:
+        del history[:len(history) - HISTORY_LIMIT]